@@ -0,0 +1,57 @@
+"""
+Micro-benchmark comparing `evaluator.evaluate` against the old `round(eval(...))`.
+
+Usage: python benchmarks/bench_evaluator.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from evaluator import _evaluate_cached, evaluate  # noqa: E402
+
+# Roughly the mix seen in the counting channel: mostly plain numbers, some expressions
+CASES: dict[str, list[str]] = {
+    'plain numbers': [str(i) for i in range(1, 1001)],
+    'simple expressions': ['1+1', '3*4', '100/4', '(2+3)*7', '2**10', '99-1', '7//2', '1.5*2'],
+    'repeated expression': ['(12+13)*4'] * 8,
+}
+
+
+def _eval(expression: str) -> int:
+    return round(eval(expression))  # pylint: disable=eval-used
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=200, help='Number of passes over each case')
+    args = parser.parse_args()
+
+    print(f'{"case":<22}{"eval()":>14}{"evaluate()":>14}{"no cache":>14}')
+    for name, expressions in CASES.items():
+        calls: int = args.number * len(expressions)
+
+        def run_eval() -> None:
+            for expression in expressions:
+                _eval(expression)
+
+        def run_evaluate() -> None:
+            for expression in expressions:
+                evaluate(expression)
+
+        def run_uncached() -> None:
+            for expression in expressions:
+                _evaluate_cached.cache_clear()
+                evaluate(expression)
+
+        results: list[str] = []
+        for func in (run_eval, run_evaluate, run_uncached):
+            seconds: float = timeit.timeit(func, number=args.number)
+            results.append(f'{seconds / calls * 1e6:>11.2f} us')
+        print(f'{name:<22}' + ''.join(f'{result:>14}' for result in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Burst benchmark for the counting pipeline.
+
+Fires hundreds of simulated messages at the pipeline at once, with artificial latency on every
+side effect, and reports how long it takes. The outcomes are checked by tests/test_pipeline.py.
+
+Usage: python benchmarks/bench_pipeline.py [--messages N] [--latency SECONDS]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config  # noqa: E402
+from pipeline import CountPipeline, CountResult, Outcome  # noqa: E402
+
+
+def make_message(message_id: int, author_id: int, content: str) -> SimpleNamespace:
+    return SimpleNamespace(id=message_id, content=content, author=SimpleNamespace(id=author_id))
+
+
+async def burst(messages: list[SimpleNamespace], latency: float) -> tuple[Config, list[CountResult], float]:
+    config: Config = Config()
+    handled: list[CountResult] = []
+
+    async def handler(result: CountResult) -> None:
+        await asyncio.sleep(random.uniform(0, latency))  # Simulated Discord HTTP round trip
+        handled.append(result)
+
+    pipeline: CountPipeline = CountPipeline(handler)
+
+    async def deliver(message: SimpleNamespace) -> None:
+        # Every gateway event is dispatched in its own task, like discord.py does
+        pipeline.submit(config, message)
+
+    start: float = time.perf_counter()
+    await asyncio.gather(*(deliver(message) for message in messages))
+    await pipeline.close()
+    return config, handled, time.perf_counter() - start
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help='Maximum simulated side effect latency')
+    args = parser.parse_args()
+
+    # 1. A clean stream, members taking turns
+    messages = [make_message(i, i % 7, str(i)) for i in range(1, args.messages + 1)]
+    config, handled, elapsed = await burst(messages, args.latency)
+    print(f'clean stream:      {args.messages} messages in {elapsed:.3f}s, final count {config.current_count}')
+
+    # 2. Everyone races to post the same number
+    messages = [make_message(i, i, '1') for i in range(args.messages)]
+    config, handled, elapsed = await burst(messages, args.latency)
+    credited: int = sum(result.outcome is Outcome.CORRECT for result in handled)
+    print(f'racing duplicates: {args.messages} messages in {elapsed:.3f}s, {credited} credited')
+
+    # 3. Expressions, a double count and a wrong number mixed in
+    contents: list[tuple[int, str]] = [(1, '1'), (2, '1+1'), (3, '3'), (3, '4'), (1, '1'), (2, '2*1'), (1, '7')]
+    messages = [make_message(i, author, content) for i, (author, content) in enumerate(contents)]
+    config, handled, elapsed = await burst(messages, args.latency)
+    print(f'mixed stream:      {len(messages)} messages in {elapsed:.3f}s, high score {config.high_score}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
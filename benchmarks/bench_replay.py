@@ -0,0 +1,353 @@
+"""
+Offline replay benchmark for the `Bot.on_message` hot path.
+
+Builds the real `Bot` from main.py in a temporary directory (fresh database, no gateway) and feeds
+it a counting stream through stub Discord objects. Every stubbed HTTP call (reactions, messages,
+role changes) sleeps for a configurable artificial latency. The stream is either synthetic, a mix
+of correct counts, double counts, wrong numbers, expressions and chatter, or recorded: one JSON
+object per line with `author_id` and `content`.
+
+Reports throughput (until every queued reaction and alert has been sent), p50/p99 handling
+latency (from `on_message` until the side effects of the message are done or queued), time spent
+in the database and time spent evaluating expressions.
+
+Usage: python benchmarks/bench_replay.py [--messages N] [--latency SECONDS] [--rate MSG_PER_S]
+                                         [--replay FILE] [--record FILE] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GUILD_ID: int = 1
+CHANNEL_ID: int = 10
+
+# Share of each kind of message in a synthetic stream
+MIX: dict[str, float] = {
+    'correct': 0.80,
+    'expression': 0.08,
+    'double': 0.02,
+    'wrong': 0.02,
+    'chatter': 0.08,
+}
+
+
+class Latency:
+    """Artificial HTTP latency, counted per call"""
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds: float = seconds
+        self.calls: int = 0
+
+    async def __call__(self) -> None:
+        self.calls += 1
+        if self.seconds:
+            await asyncio.sleep(random.uniform(self.seconds / 2, self.seconds * 1.5))
+
+
+class StubRole:
+    def __init__(self, role_id: int, guild: 'StubGuild') -> None:
+        self.id: int = role_id
+        self.guild: StubGuild = guild
+        self.mention: str = f'<@&{role_id}>'
+
+    @property
+    def members(self) -> list['StubMember']:
+        return [member for member in self.guild.members.values() if self in member.roles]
+
+
+class StubMember:
+    def __init__(self, member_id: int, guild: 'StubGuild', http: Latency) -> None:
+        self.id: int = member_id
+        self.guild: StubGuild = guild
+        self.roles: list[StubRole] = []
+        self.mention: str = f'<@{member_id}>'
+        self.display_name: str = f'member-{member_id}'
+        self._http: Latency = http
+
+    async def add_roles(self, *roles: StubRole) -> None:
+        await self._http()
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles: StubRole) -> None:
+        await self._http()
+        self.roles = [role for role in self.roles if role not in roles]
+
+
+class StubGuild:
+    def __init__(self, guild_id: int) -> None:
+        self.id: int = guild_id
+        self.name: str = f'guild-{guild_id}'
+        self.members: dict[int, StubMember] = {}
+        self.roles: list[StubRole] = []
+
+    def get_member(self, member_id: int) -> Optional[StubMember]:
+        return self.members.get(member_id)
+
+    def get_role(self, role_id: int) -> Optional[StubRole]:
+        return next((role for role in self.roles if role.id == role_id), None)
+
+
+class StubChannel:
+    def __init__(self, channel_id: int, guild: StubGuild, http: Latency) -> None:
+        self.id: int = channel_id
+        self.guild: StubGuild = guild
+        self._http: Latency = http
+
+    async def send(self, *args: Any, **kwargs: Any) -> None:
+        await self._http()
+
+
+class StubMessage:
+    def __init__(self, message_id: int, content: str, author: StubMember, channel: StubChannel,
+                 http: Latency) -> None:
+        self.id: int = message_id
+        self.content: str = content
+        self.author: StubMember = author
+        self.channel: StubChannel = channel
+        self.guild: StubGuild = channel.guild
+        self.created_at: datetime = datetime.now(timezone.utc)
+        self.reactions: list[str] = []
+        self.jump_url: str = f'https://discord.com/channels/{channel.guild.id}/{channel.id}/{message_id}'
+        self._http: Latency = http
+
+    async def add_reaction(self, emoji: str) -> None:
+        await self._http()
+        self.reactions.append(emoji)
+
+
+class Timer:
+    """Accumulates the time spent in the wrapped callables"""
+
+    def __init__(self) -> None:
+        self.seconds: float = 0.0
+        self.calls: int = 0
+
+    def wrap(self, func: Callable) -> Callable:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start: float = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+        return wrapper
+
+    def wrap_async(self, func: Callable) -> Callable:
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start: float = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+        return wrapper
+
+
+def synthetic_stream(length: int, members: int, seed: int) -> list[tuple[int, str]]:
+    """
+    A stream of `(author_id, content)` with the kinds of messages in `MIX`.
+    The counting state is simulated along the way, so that correct counts really are correct.
+    """
+    rng: random.Random = random.Random(seed)
+    kinds: list[str] = list(MIX)
+    weights: list[float] = list(MIX.values())
+    count: int = 0
+    last_author: Optional[int] = None
+    stream: list[tuple[int, str]] = []
+
+    for _ in range(length):
+        kind: str = rng.choices(kinds, weights)[0]
+        author: int = rng.choice([m for m in range(1, members + 1) if m != last_author])
+        if kind == 'chatter':
+            stream.append((author, rng.choice(['nice', 'gg everyone', 'who broke it?', 'lol'])))
+            continue
+        if kind == 'double' and last_author is not None and count:
+            stream.append((last_author, str(count + 1)))
+            count, last_author = 0, None
+            continue
+        if kind == 'wrong':
+            stream.append((author, str(count + rng.choice([2, 3, 10]))))
+            count, last_author = 0, None
+            continue
+        count += 1
+        if kind == 'expression':
+            content: str = rng.choice([f'{count - 1}+1', f'{count * 2}/2', f'({count}*3)/3', f'{count + 5}-5'])
+        else:
+            content = str(count)
+        stream.append((author, content))
+        last_author = author
+    return stream
+
+
+def load_stream(path: str) -> list[tuple[int, str]]:
+    with open(path, 'r', encoding='utf-8') as file:
+        return [(int(event['author_id']), event['content']) for event in map(json.loads, file) if event]
+
+
+def save_stream(path: str, stream: list[tuple[int, str]]) -> None:
+    with open(path, 'w', encoding='utf-8') as file:
+        for author_id, content in stream:
+            file.write(json.dumps({'author_id': author_id, 'content': content}) + '\n')
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered: list[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def replay(stream: list[tuple[int, str]], latency: float, rate: float) -> dict[str, Any]:
+    # The bot keeps its files in the working directory, and must not touch the real ones
+    os.chdir(tempfile.mkdtemp(prefix='counting-bench-'))
+    import burst  # noqa: E402
+    import main  # noqa: E402  (imported here so that it uses the temporary directory)
+    import outbound  # noqa: E402
+    import pipeline  # noqa: E402
+
+    bot: main.Bot = main.bot
+    http: Latency = Latency(latency)
+    eval_timer: Timer = Timer()
+    write_timer: Timer = Timer()
+    read_timer: Timer = Timer()
+
+    # No gateway: prepare the client like `Client.start` would, minus logging in and syncing the commands
+    async def no_sync(*args: Any, **kwargs: Any) -> list:
+        return []
+
+    bot.tree.sync = no_sync
+    bot.db._write_batch = write_timer.wrap(bot.db._write_batch)
+    bot.db.fetchone = read_timer.wrap_async(bot.db.fetchone)
+    bot.db.fetchall = read_timer.wrap_async(bot.db.fetchall)
+    pipeline.evaluate = eval_timer.wrap(pipeline.evaluate)
+    await bot._async_setup_hook()
+    await bot.setup_hook()
+
+    guild: StubGuild = StubGuild(GUILD_ID)
+    channel: StubChannel = StubChannel(CHANNEL_ID, guild, http)
+    bot.config_store.add_channel(GUILD_ID, CHANNEL_ID)
+    for author_id in {author_id for author_id, _ in stream}:
+        guild.members[author_id] = StubMember(author_id, guild, http)
+
+    received: dict[int, float] = {}
+    latencies: list[float] = []
+    handle_count_result: Callable = bot.handle_count_result
+
+    async def timed_handle_count_result(result: Any) -> None:
+        await handle_count_result(result)
+        latencies.append(time.perf_counter() - received[result.message.id])
+
+    bot.handle_count_result = timed_handle_count_result  # Picked up by the channel's pipeline
+
+    async def deliver(message: StubMessage) -> None:
+        received[message.id] = time.perf_counter()
+        await bot.on_message(message)
+
+    tasks: list[asyncio.Task] = []
+    start: float = time.perf_counter()
+    for message_id, (author_id, content) in enumerate(stream, 1):
+        message: StubMessage = StubMessage(message_id, content, guild.members[author_id], channel, http)
+        # Every gateway event is dispatched in its own task, like discord.py does
+        tasks.append(asyncio.create_task(deliver(message)))
+        if rate:
+            await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+    for channel_pipeline in bot._pipelines.values():
+        await channel_pipeline.join()
+    await bot.outbound.join()
+    handled: float = time.perf_counter() - start
+
+    bot.member_stats.flush()
+    await bot.db.flush()
+    drained: float = time.perf_counter() - start
+
+    config = bot.config_store.for_channel(CHANNEL_ID)
+    result: dict[str, Any] = {
+        'messages': len(stream),
+        'counted': len(latencies),
+        'final_count': config.current_count,
+        'high_score': config.high_score,
+        'seconds': round(handled, 4),
+        'throughput': round(len(stream) / handled, 1) if handled else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'drain_ms': round((drained - handled) * 1000, 2),
+        'db_write_ms': round(write_timer.seconds * 1000, 2),
+        'db_write_batches': write_timer.calls,
+        'db_read_ms': round(read_timer.seconds * 1000, 2),
+        'db_reads': read_timer.calls,
+        'eval_ms': round(eval_timer.seconds * 1000, 2),
+        'evals': eval_timer.calls,
+        'http_calls': http.calls,
+        'reactions_sent': outbound.OUTBOUND_SENT.labels('reaction').value,
+        'reactions_dropped': outbound.OUTBOUND_DROPPED.labels('reaction').value,
+        'alerts_sent': outbound.OUTBOUND_SENT.labels('alert').value,
+        'alerts_coalesced': outbound.OUTBOUND_COALESCED.value,
+        'reactions_skipped': burst.BURST_SKIPPED_REACTIONS.value,
+        'latency_s': latency,
+    }
+    await bot.close()
+    return result
+
+
+def expected_final_state(stream: list[tuple[int, str]]) -> tuple[int, int]:
+    """The (count, high score) the bot must end with, computed without the bot"""
+    from config import Config
+    from pipeline import decide
+
+    config: Config = Config()
+    for message_id, (author_id, content) in enumerate(stream):
+        decide(config, StubMessage(message_id, content, StubMember(author_id, StubGuild(0), Latency(0)),
+                                   StubChannel(0, StubGuild(0), Latency(0)), Latency(0)))
+    return config.current_count, config.high_score
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help='Length of a synthetic stream')
+    parser.add_argument('--members', type=int, default=50, help='Number of members in a synthetic stream')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.05, help='Average simulated HTTP latency in seconds')
+    parser.add_argument('--rate', type=float, default=0, help='Messages per second to deliver; 0 for all at once')
+    parser.add_argument('--replay', help='Replay a recorded stream instead (one JSON object per line)')
+    parser.add_argument('--record', help='Save the stream that is replayed, to replay it again later')
+    parser.add_argument('--json', action='store_true', help='Print the results as one line of JSON')
+    args = parser.parse_args()
+
+    stream: list[tuple[int, str]] = load_stream(args.replay) if args.replay \
+        else synthetic_stream(args.messages, args.members, args.seed)
+    if args.record:
+        save_stream(args.record, stream)
+
+    expected: tuple[int, int] = expected_final_state(stream)
+    result: dict[str, Any] = await replay(stream, args.latency, args.rate)
+    assert (result['final_count'], result['high_score']) == expected, (result, expected)
+
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f'''\
+messages:    {result["messages"]} ({result["counted"]} counted), final count {result["final_count"]}
+throughput:  {result["throughput"]} msg/s over {result["seconds"]}s, {result["drain_ms"]} ms to drain the database
+latency:     p50 {result["p50_ms"]} ms, p99 {result["p99_ms"]} ms ({result["http_calls"]} HTTP calls of \
+~{result["latency_s"] * 1000:.0f} ms)
+database:    {result["db_write_ms"]} ms writing {result["db_write_batches"]} batch(es), \
+{result["db_read_ms"]} ms waiting on {result["db_reads"]} read(s)
+evaluation:  {result["eval_ms"]} ms for {result["evals"]} expression(s)
+outbound:    {result["reactions_sent"]:g} reaction(s) sent, {result["reactions_dropped"]:g} dropped, \
+{result["reactions_skipped"]:g} skipped in burst mode, {result["alerts_sent"]:g} alert message(s) sent, \
+{result["alerts_coalesced"]:g} alert(s) merged''')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""Per-channel message rate tracking, and a degraded mode for bursts of counting"""
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import discord
+
+from metrics import REGISTRY, Family, Metric
+from pipeline import CountResult, Outcome
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+BURST_SWITCHES: Family = REGISTRY.counter('burst_mode_switches_total', 'Channels entering or leaving burst mode',
+                                          ('to',))
+BURST_SKIPPED_REACTIONS: Metric = REGISTRY.counter('burst_skipped_reactions_total',
+                                                   'Reactions to correct counts skipped in burst mode').labels()
+
+PLAIN_EMOJI: str = '✅'  # The reaction that burst mode skips; milestone and failure reactions are kept
+
+
+@dataclass
+class _Channel:
+    channel: discord.abc.Messageable
+    weight: float = 0.0  # Exponentially decayed number of messages
+    updated: float = 0.0
+    active: bool = False
+    since: float = 0.0  # When burst mode was entered
+    last_summary: float = 0.0
+    last_number: Optional[int] = None
+    counted: int = 0  # Correct counts since burst mode was entered
+    counted_at_summary: int = 0
+    breaks: int = 0
+    skipped: int = 0
+
+
+class BurstMonitor:
+    """
+    Estimates the rate of counting messages of every channel, and switches channels into burst mode
+    while it is higher than Discord lets the bot react.
+
+    The rate is an exponentially weighted moving average with a half-life of `half_life` seconds,
+    updated in O(1) per message. A channel enters burst mode at `enter_rate` messages per second and
+    leaves it once the rate is below `exit_rate` and it has been in burst mode for `min_duration`
+    seconds, so it does not flap around a single threshold. In burst mode, `PLAIN_EMOJI` reactions
+    are skipped and a progress summary is passed to `post` every `summary_interval` seconds, and
+    once more when the burst is over.
+    """
+
+    def __init__(self, post: Callable[[discord.abc.Messageable, str], None], enter_rate: float = 2.0,
+                 exit_rate: float = 1.0, half_life: float = 5.0, min_duration: float = 15.0,
+                 summary_interval: float = 30.0, tick: float = 1.0) -> None:
+        self._post: Callable[[discord.abc.Messageable, str], None] = post
+        self.enter_rate: float = enter_rate
+        self.exit_rate: float = exit_rate
+        self.half_life: float = half_life
+        self.min_duration: float = min_duration
+        self.summary_interval: float = summary_interval
+        self.tick: float = tick
+        self._channels: dict[int, _Channel] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name='burst-monitor')
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _rate(self, state: _Channel, now: float) -> float:
+        """Decays the weight of `state` to `now`, and returns its rate in messages per second"""
+        state.weight *= 0.5 ** ((now - state.updated) / self.half_life)
+        state.updated = now
+        return state.weight * math.log(2) / self.half_life
+
+    def rate(self, channel_id: int) -> float:
+        state: Optional[_Channel] = self._channels.get(channel_id)
+        return self._rate(state, time.monotonic()) if state is not None else 0.0
+
+    def observe(self, result: CountResult) -> bool:
+        """
+        Count a message of a counting channel, in arrival order. Returns whether the channel is in
+        burst mode, in which case the reaction to a plain correct count should be skipped. Never awaits.
+        """
+        channel_id: int = result.message.channel.id
+        now: float = time.monotonic()
+        state: Optional[_Channel] = self._channels.get(channel_id)
+        if state is None:
+            state = self._channels[channel_id] = _Channel(result.message.channel, updated=now)
+        rate: float = self._rate(state, now)
+        state.weight += 1
+
+        if not state.active and rate >= self.enter_rate:
+            state.active = True
+            state.since = state.last_summary = now
+            state.counted = state.counted_at_summary = state.breaks = state.skipped = 0
+            BURST_SWITCHES.labels('burst').inc()
+            logger.info('Channel %d entered burst mode at %.1f messages/s', channel_id, rate)
+        if state.active:
+            if result.outcome is Outcome.CORRECT:
+                state.counted += 1
+                state.last_number = result.number
+            elif result.outcome.is_failure:
+                state.breaks += 1
+                state.last_number = None
+        return state.active
+
+    def skip_reaction(self, channel_id: int) -> None:
+        """Record that a reaction was skipped because of burst mode."""
+        self._channels[channel_id].skipped += 1
+        BURST_SKIPPED_REACTIONS.inc()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            now: float = time.monotonic()
+            for channel_id, state in list(self._channels.items()):
+                rate: float = self._rate(state, now)
+                if not state.active:
+                    if state.weight < 0.01:
+                        del self._channels[channel_id]  # Quiet channel
+                    continue
+                if rate < self.exit_rate and now - state.since >= self.min_duration:
+                    state.active = False
+                    BURST_SWITCHES.labels('normal').inc()
+                    logger.info('Channel %d left burst mode after %.0f s at %.1f messages/s: %d counted, '
+                                '%d chain break(s), %d reaction(s) skipped', channel_id, now - state.since, rate,
+                                state.counted, state.breaks, state.skipped)
+                    self._post(state.channel, f'✅ The burst is over: **{state.counted}** numbers counted in '
+                                              f'{now - state.since:.0f} seconds, with {state.breaks} chain '
+                                              f'break(s). Reactions are back to normal.')
+                elif now - state.last_summary >= self.summary_interval:
+                    if state.counted > state.counted_at_summary:
+                        self._post(state.channel, self._summary(state, now))
+                    state.last_summary = now
+                    state.counted_at_summary = state.counted
+
+    @staticmethod
+    def _summary(state: _Channel, now: float) -> str:
+        progress: str = f', now at **{state.last_number}**' if state.last_number is not None else ''
+        return (f'⚡ Counting fast! **{state.counted - state.counted_at_summary}** numbers in the last '
+                f'{now - state.last_summary:.0f} seconds{progress}. Only milestones and mistakes get '
+                f'a reaction until things calm down.')
+
+    def metrics(self) -> dict[str, float]:
+        """The rate of every channel that counted recently, in messages per second"""
+        now: float = time.monotonic()
+        return {channel_id: round(self._rate(state, now), 2) for channel_id, state in self._channels.items()}
+
+    @property
+    def bursting(self) -> int:
+        return sum(state.active for state in self._channels.values())
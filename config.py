@@ -0,0 +1,425 @@
+"""Bot configuration and its persistence"""
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Optional
+
+from database import Database
+from journal import CountJournal
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Config:
+    """
+    Counting configuration and state of a counting channel. The settings of the guild (its roles) are
+    the same in each of its configs; a guild that counts nowhere has one config without a channel for them.
+    """
+    guild_id: Optional[int] = None
+    channel_id: Optional[int] = None
+    current_count: int = 0
+    high_score: int = 0
+    current_member_id: Optional[int] = None
+    put_high_score_emoji: bool = False
+    failed_role_id: Optional[int] = None
+    reliable_counter_role_id: Optional[int] = None
+    failed_member_id: Optional[int] = None
+    correct_inputs_by_failed_member: int = 0
+    last_message_id: Optional[int] = None  # The last message of the counting channel that was processed
+
+    def increment(self, member_id: int) -> None:
+        """
+        Increment the current count.
+        NOTE: config is not persisted by this method. Call ConfigStore.mark_dirty() afterwards.
+        """
+        # increment current count
+        self.current_count += 1
+
+        # update current member id
+        self.current_member_id = member_id
+
+        # check the high score
+        self.high_score = max(self.high_score, self.current_count)
+
+    def reset(self) -> None:
+        """
+        Reset current count.
+        NOTE: config is not persisted by this method. Call ConfigStore.mark_dirty() afterwards.
+        """
+        self.current_count = 0
+
+        self.correct_inputs_by_failed_member = 0
+
+        # update current member id
+        self.current_member_id = None
+        self.put_high_score_emoji = False
+
+    def reaction_emoji(self) -> str:
+        """
+        Get the reaction emoji based on the current count.
+        NOTE: config is not persisted by this method. Call ConfigStore.mark_dirty() afterwards.
+        """
+        if self.current_count == self.high_score and not self.put_high_score_emoji:
+            emoji = "🎉"
+            self.put_high_score_emoji = True  # Needs to be persisted
+        elif self.current_count == 100:
+            emoji = "💯"
+        elif self.current_count == 69:
+            emoji = "😏"
+        elif self.current_count == 666:
+            emoji = "👹"
+        else:
+            emoji = "✅"
+        return emoji
+
+
+FIELDS: tuple[str, ...] = tuple(field.name for field in fields(Config))  # Also the columns of `guild_configs`
+# The settings of a guild, kept the same in each of its configs
+GUILD_FIELDS: tuple[str, ...] = ('failed_role_id', 'reliable_counter_role_id')
+# The fields that counting changes, in the order they are stored in journal entries after the channel ID
+JOURNAL_FIELDS: tuple[str, ...] = ('current_count', 'high_score', 'current_member_id', 'put_high_score_emoji',
+                                   'failed_member_id', 'correct_inputs_by_failed_member', 'last_message_id')
+LEGACY_GUILD_ID: int = 0  # Stands in for the unknown guild of a config from before multiple guilds were supported
+
+Key = tuple[int, Optional[int]]  # (guild_id, channel_id) of a config
+
+
+def _key(config: Config) -> Key:
+    return config.guild_id, config.channel_id
+
+
+class ConfigStore:
+    """
+    Owns the `Config` of every counting channel, indexed by guild ID and by channel ID. A guild can
+    count in several channels, each with a count of its own.
+
+    The in-memory configs are the only source of truth: they are loaded from the `guild_configs`
+    table once at startup and every change afterwards is made to them in place. Changed configs
+    are marked dirty, and at most once every `min_interval` seconds only the columns that differ
+    from what was last written are updated, so a write costs the same however many channels there are.
+
+    Counting transitions are also appended to `journal`, if given, and every snapshot records the
+    sequence number of the last journal entry it contains. At startup, newer journal entries are
+    replayed on top of the snapshot, so no count is lost if the bot crashes between snapshots.
+    Journal segments are deleted at most every `compact_interval` seconds, once a snapshot that
+    contains them has been made durable.
+    """
+
+    def __init__(self, db: Database, legacy_path: str = 'config.json', min_interval: float = 2.0,
+                 journal: Optional[CountJournal] = None, compact_interval: float = 60.0) -> None:
+        self._db: Database = db
+        self.legacy_path: str = legacy_path
+        self.min_interval: float = min_interval
+        self.journal: Optional[CountJournal] = journal
+        self.compact_interval: float = compact_interval
+        self._last_compaction: float = time.monotonic()
+        self._guilds: dict[int, list[Config]] = {}
+        self._channels: dict[int, Config] = {}
+        # A config from before multiple guilds were supported, until `adopt_legacy` is called
+        self.legacy: Optional[Config] = None
+        self._saved: dict[Key, dict[str, Any]] = {}  # The row of each config as last written
+        self._dirty: set[Key] = set()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self._last_flush: float = 0.0  # time.monotonic() of the last write
+        self._last_attempt: float = 0.0  # time.monotonic() of the last write attempt, successful or not
+        self.flush_count: int = 0
+        self.change_count: int = 0
+        self.rows_written: int = 0
+        self.last_flush_duration: float = 0.0
+
+    async def load(self) -> None:
+        """Load every config from the database. Imports `legacy_path` if the table is still empty."""
+        rows: list[tuple] = await self._db.fetchall(f'SELECT {", ".join(FIELDS)} FROM guild_configs')
+        for row in rows:
+            config: Config = Config(*row)
+            config.put_high_score_emoji = bool(config.put_high_score_emoji)
+            self._saved[_key(config)] = asdict(config)
+            if config.guild_id == LEGACY_GUILD_ID:
+                self.legacy = config
+            else:
+                self._add(config)
+        snapshot_seq: int = 0
+        if self.journal is not None:
+            row: Optional[tuple[str]] = await self._db.fetchone("SELECT value FROM meta WHERE key = 'journal_seq'")
+            snapshot_seq = int(row[0]) if row is not None else 0
+            entries: list[list[Any]] = await self.journal.open(after_seq=snapshot_seq)
+        if not rows:
+            await self._import_json()
+        if self.journal is not None:
+            self._replay(entries, snapshot_seq)
+
+    def _replay(self, entries: list[list[Any]], snapshot_seq: int) -> None:
+        replayed: int = 0
+        for seq, guild_id, *values in entries:
+            if seq <= snapshot_seq:
+                continue  # Already in the snapshot
+            config: Optional[Config]
+            if len(values) > len(JOURNAL_FIELDS):
+                config = self._find((guild_id, values.pop(0)))
+            else:
+                # From before a guild could count in several channels, when it had a single config
+                config = self.legacy if guild_id == LEGACY_GUILD_ID else self.get(guild_id)
+            if config is None:
+                continue  # The channel has stopped counting since
+            for name, value in zip(JOURNAL_FIELDS, values):
+                setattr(config, name, value)
+            self._dirty.add(_key(config))
+            replayed += 1
+        if replayed:
+            logger.info('Replayed %d count(s) from the journal on top of the last snapshot', replayed)
+
+    async def _import_json(self) -> None:
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as file:
+                data: dict[str, Any] = json.load(file)
+        except FileNotFoundError:
+            return
+
+        if 'guilds' not in data:
+            # The whole file is the config of a single guild, whose ID was not stored
+            data = {'guilds': {}, 'legacy': data}
+        for config_data in data['guilds'].values():
+            config: Config = Config(**config_data)
+            self._add(config)
+            self._dirty.add(_key(config))
+        if data.get('legacy') is not None:
+            self.legacy = Config(**data['legacy'])
+            self.legacy.guild_id = LEGACY_GUILD_ID
+            self._dirty.add(_key(self.legacy))
+
+        imported: int = len(self._dirty)
+        await self.flush()
+        os.replace(self.legacy_path, f'{self.legacy_path}.imported')  # Never imported twice
+        logger.info('Imported %d config(s) from %s', imported, self.legacy_path)
+
+    def _add(self, config: Config) -> None:
+        self._guilds.setdefault(config.guild_id, []).append(config)
+        if config.channel_id is not None:
+            self._channels[config.channel_id] = config
+
+    def _find(self, key: Key) -> Optional[Config]:
+        if key[0] == LEGACY_GUILD_ID:
+            return self.legacy
+        return next((config for config in self._guilds.get(key[0], ()) if config.channel_id == key[1]), None)
+
+    def _remove(self, config: Config) -> None:
+        """Forget a config and delete its row."""
+        self._guilds[config.guild_id] = [other for other in self._guilds[config.guild_id] if other is not config]
+        if config.channel_id is not None:
+            self._channels.pop(config.channel_id, None)
+        self._dirty.discard(_key(config))
+        saved: Optional[dict[str, Any]] = self._saved.pop(_key(config), None)
+        if saved is not None:
+            self._db.write('DELETE FROM guild_configs WHERE guild_id = ? AND channel_id IS ?',
+                           (saved['guild_id'], saved['channel_id']))
+
+    def _rekey(self, config: Config, old_key: Key) -> None:
+        """Track a config under its new guild or channel. Its row is updated in place by the next write."""
+        saved: Optional[dict[str, Any]] = self._saved.pop(old_key, None)
+        if saved is not None:
+            self._saved[_key(config)] = saved
+        self._dirty.discard(old_key)
+        self.mark_dirty(_key(config))
+
+    def adopt_legacy(self, guild_id: int) -> None:
+        """Assign the legacy config to the guild it belongs to, replacing the configs the guild already has."""
+        if self.legacy is not None:
+            self._db.write('DELETE FROM guild_configs WHERE guild_id = ?', (LEGACY_GUILD_ID,))
+            self._saved.pop(_key(self.legacy), None)
+            self._dirty.discard(_key(self.legacy))
+            for config in self.for_guild(guild_id):
+                self._remove(config)
+            self.legacy.guild_id = guild_id
+            self._add(self.legacy)
+            self.mark_dirty(_key(self.legacy))
+            self.legacy = None
+
+    def get(self, guild_id: int) -> Config:
+        """A config of a guild, to read its settings, created with default values if the guild has none yet."""
+        configs: Optional[list[Config]] = self._guilds.get(guild_id)
+        if configs:
+            return configs[0]
+        config: Config = Config(guild_id=guild_id)
+        self._add(config)
+        return config
+
+    def for_guild(self, guild_id: int) -> list[Config]:
+        """The configs of a guild: one per counting channel, or one without a channel."""
+        return list(self._guilds.get(guild_id, ()))
+
+    def for_channel(self, channel_id: int) -> Optional[Config]:
+        """The config of a counting channel, if it is one. O(1)."""
+        return self._channels.get(channel_id)
+
+    def configs(self) -> list[Config]:
+        return [config for configs in self._guilds.values() for config in configs]
+
+    def add_channel(self, guild_id: int, channel_id: int, **changes: Any) -> Config:
+        """
+        Start counting in a channel of a guild, with a count of its own, and change some fields of its config.
+        The first counting channel of a guild takes over the count of the guild's previous one, if any.
+        """
+        config: Optional[Config] = self._channels.get(channel_id)
+        if config is None:
+            config = self.get(guild_id)
+            if config.channel_id is None:
+                config.channel_id = channel_id
+                self._rekey(config, (guild_id, None))
+            else:
+                config = Config(guild_id=guild_id, channel_id=channel_id,
+                                **{name: getattr(config, name) for name in GUILD_FIELDS})
+                self._add(config)
+                self.mark_dirty(_key(config))
+            self._channels[channel_id] = config
+        self.update_config(config, **changes)
+        return config
+
+    def remove_channel(self, channel_id: int) -> None:
+        """Stop counting in a channel. The settings of its guild are kept."""
+        config: Optional[Config] = self._channels.pop(channel_id, None)
+        if config is None:
+            return
+        if len(self._guilds[config.guild_id]) > 1:
+            self._remove(config)
+        else:
+            config.channel_id = None  # The guild's last counting channel
+            self._rekey(config, (config.guild_id, channel_id))
+
+    def update(self, guild_id: int, **changes: Any) -> None:
+        """Change some fields of every config of a guild in place, e.g. its settings, and schedule a write."""
+        self.get(guild_id)  # A guild that counts nowhere keeps its settings in a config without a channel
+        for config in self.for_guild(guild_id):
+            self.update_config(config, **changes)
+
+    def update_config(self, config: Config, **changes: Any) -> None:
+        """Change some fields of a config in place and schedule a write."""
+        for name in changes:
+            if not hasattr(config, name) or name == 'channel_id':  # See `add_channel` and `remove_channel`
+                raise AttributeError(f'Config has no field {name!r} that can be changed')
+        for name, value in changes.items():
+            setattr(config, name, value)
+        if self.journal is not None and not changes.keys().isdisjoint(JOURNAL_FIELDS):
+            self.record_transition(config)  # Or replaying older transitions would undo this change
+        else:
+            self.mark_dirty(_key(config))
+
+    def record_transition(self, config: Config) -> int:
+        """
+        Record that counting has changed a config in place: journal it and schedule a write.
+        Returns the sequence number to pass to `synced`. Never awaits.
+        """
+        self.mark_dirty(_key(config))
+        if self.journal is None:
+            return 0
+        return self.journal.append(config.guild_id,
+                                   [config.channel_id, *(getattr(config, name) for name in JOURNAL_FIELDS)])
+
+    async def synced(self, seq: int) -> None:
+        """Wait until the transition `seq` returned by `record_transition` is durable."""
+        if self.journal is not None:
+            await self.journal.synced(seq)
+
+    def mark_dirty(self, key: Key) -> None:
+        """Schedule a write after the config with this (guild ID, channel ID) has been changed in place."""
+        self._dirty.add(key)
+        self.change_count += 1
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is None and self._flushing is None:
+            delay: float = max(0.0, self._last_attempt + self.min_interval - time.monotonic())
+            self._timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        self._flushing = asyncio.create_task(self.flush(), name='config-flush')
+        self._flushing.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task: asyncio.Task) -> None:
+        self._flushing = None
+        if not task.cancelled():
+            task.exception()  # Retrieve it so that asyncio does not log it again
+        if self._dirty:
+            # Changed while being written
+            self._schedule()
+
+    async def flush(self) -> None:
+        """Write the changed columns of every dirty config now, and wait until they are committed."""
+        if not self._dirty:
+            return
+        dirty: set[Key] = self._dirty
+        self._dirty = set()
+        start: float = time.monotonic()
+        self._last_attempt = start
+        statements: list[tuple[str, tuple]] = []
+        written: dict[Key, Optional[dict[str, Any]]] = {}  # The rows as they were last written before
+        for key in dirty:
+            config: Optional[Config] = self._find(key)
+            if config is None:
+                continue
+            row: dict[str, Any] = asdict(config)  # Snapshot taken on the event loop
+            saved: Optional[dict[str, Any]] = self._saved.get(key)
+            if saved is None:
+                statements.append((f'INSERT OR REPLACE INTO guild_configs ({", ".join(FIELDS)}) '
+                                   f'VALUES ({", ".join("?" * len(FIELDS))})', tuple(row.values())))
+            else:
+                changed: dict[str, Any] = {name: value for name, value in row.items() if saved[name] != value}
+                if not changed:
+                    continue
+                # The row is found by what was written last: its guild or channel may have changed since
+                statements.append((f'UPDATE guild_configs SET {", ".join(f"{name} = ?" for name in changed)} '
+                                   f'WHERE guild_id = ? AND channel_id IS ?',
+                                   (*changed.values(), saved['guild_id'], saved['channel_id'])))
+            self._saved[key] = row
+            written[key] = saved
+
+        segment: Optional[int] = None
+        if self.journal is not None:
+            # The snapshot contains every journal entry appended so far
+            statements.append(("INSERT INTO meta VALUES ('journal_seq', ?) ON CONFLICT(key) DO UPDATE SET "
+                               "value = excluded.value", (str(self.journal.seq),)))
+            if time.monotonic() - self._last_compaction >= self.compact_interval:
+                self._last_compaction = time.monotonic()
+                segment = self.journal.rotate()  # Entries appended from now on are not in this snapshot
+
+        if written or segment is not None:
+            try:
+                await self._db.write_atomic(statements)
+            except Exception:  # Any error of the write, see `Database.write_atomic`
+                # Already logged by the database. Write these configs again next time.
+                for key, saved in written.items():
+                    if saved is None:
+                        self._saved.pop(key, None)
+                    else:
+                        self._saved[key] = saved
+                    self._dirty.add(key)
+                return
+            self.rows_written += len(written)
+        if segment is not None:
+            await self._db.checkpoint()  # Makes the snapshot durable against power loss as well
+            await self.journal.drop_segments_before(segment)
+        self._last_flush = time.monotonic()
+        self.last_flush_duration = self._last_flush - start
+        self.flush_count += 1
+
+    @property
+    def dirty(self) -> bool:
+        """Whether some config has changes that have not been written yet"""
+        return bool(self._dirty)
+
+    def metrics(self) -> dict[str, Any]:
+        """Persistence statistics, for display in admin commands"""
+        return {
+            'dirty': len(self._dirty),
+            'changes': self.change_count,
+            'writes': self.flush_count,
+            'rows': self.rows_written,
+            'coalesced': max(0, self.change_count - self.rows_written),
+            'last_write_ms': round(self.last_flush_duration * 1000, 2),
+            'seconds_since_write': round(time.monotonic() - self._last_flush, 1) if self.flush_count else None,
+        }
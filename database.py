@@ -0,0 +1,316 @@
+"""Long-lived SQLite access layer shared by the bot and its commands"""
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterable, Optional, Sequence, TypeVar
+
+from metrics import REGISTRY, Family, Metric
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+QUERY_SECONDS: Family = REGISTRY.histogram('db_query_seconds',
+                                           'Time until a read returns or a write batch is committed', ('op',))
+_READ_SECONDS: Metric = QUERY_SECONDS.labels('read')
+_WRITE_SECONDS: Metric = QUERY_SECONDS.labels('write_batch')
+_STATEMENTS: Metric = REGISTRY.counter('db_written_statements_total', 'Statements applied by the writer task').labels()
+
+SCHEMA_VERSION: int = 8  # Stored in `PRAGMA user_version`
+
+# See `rollups.Rollups`. `resolution` is the length of a bucket in seconds, `bucket` the unix time it starts at.
+ROLLUP_SCHEMA: tuple[str, ...] = (
+    '''CREATE TABLE IF NOT EXISTS guild_rollups (guild_id INTEGER, resolution INTEGER, bucket INTEGER,
+                correct INTEGER, breaks INTEGER, PRIMARY KEY (guild_id, resolution, bucket)) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS member_rollups (guild_id INTEGER, resolution INTEGER, bucket INTEGER,
+                member_id INTEGER, correct INTEGER, breaks INTEGER,
+                PRIMARY KEY (guild_id, resolution, bucket, member_id)) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS member_streaks (guild_id INTEGER, member_id INTEGER, current INTEGER,
+                best INTEGER, PRIMARY KEY (guild_id, member_id))''',
+    'CREATE INDEX IF NOT EXISTS idx_member_streaks_guild_best ON member_streaks(guild_id, best)',
+)
+
+# Append-only, see `events.EventLog`. `kind` is an `events.EventKind`, `created_at` is in unix seconds.
+# `number` has no type so that numbers too large for an integer are kept exactly, as text.
+COUNT_EVENTS_TABLE: str = '''CREATE TABLE IF NOT EXISTS count_events (id INTEGER PRIMARY KEY, guild_id INTEGER,
+                channel_id INTEGER, message_id INTEGER, member_id INTEGER, kind INTEGER, number, expected INTEGER,
+                created_at INTEGER)'''
+
+# One row per counting channel, with the fields of `config.Config`. A guild that counts nowhere has
+# one row without a channel, for its settings.
+GUILD_CONFIGS_TABLE: str = '''CREATE TABLE IF NOT EXISTS guild_configs (guild_id INTEGER NOT NULL,
+                channel_id INTEGER UNIQUE, current_count INTEGER, high_score INTEGER, current_member_id INTEGER,
+                put_high_score_emoji INTEGER, failed_role_id INTEGER, reliable_counter_role_id INTEGER,
+                failed_member_id INTEGER, correct_inputs_by_failed_member INTEGER, last_message_id INTEGER)'''
+
+SCHEMA: tuple[str, ...] = (
+    '''CREATE TABLE IF NOT EXISTS members (guild_id INTEGER, member_id INTEGER,
+                score INTEGER, correct INTEGER, wrong INTEGER,
+                highest_valid_count INTEGER, PRIMARY KEY (guild_id, member_id))''',
+    # Keyset pagination of the leaderboards, see `leaderboard.ORDERS`; the expressions must match exactly
+    'CREATE INDEX IF NOT EXISTS idx_members_score ON members(guild_id, score, member_id)',
+    'CREATE INDEX IF NOT EXISTS idx_members_correct ON members(guild_id, correct, member_id)',
+    'CREATE INDEX IF NOT EXISTS idx_members_accuracy ON members(guild_id, (correct * 100.0 / (correct + wrong)), '
+    'member_id)',
+    'CREATE INDEX IF NOT EXISTS idx_members_highest_valid_count ON members(guild_id, highest_valid_count, member_id)',
+    GUILD_CONFIGS_TABLE,
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_guild_configs_unset ON guild_configs(guild_id) WHERE channel_id IS NULL',
+    COUNT_EVENTS_TABLE,
+    'CREATE INDEX IF NOT EXISTS idx_count_events_channel ON count_events(channel_id, message_id)',
+    # Small values the bot needs to remember between runs, such as the hash of the synced command tree
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    *ROLLUP_SCHEMA,
+)
+
+# Statements that bring a database from version `n - 1` to version `n`, for existing databases only
+MIGRATIONS: dict[int, tuple[str, ...]] = {
+    # Members are kept per guild. Rows from before that get guild_id 0 until the bot finds out
+    # which guild they belong to (see `Bot.adopt_legacy_data`).
+    1: (
+        'ALTER TABLE members RENAME TO members_legacy',
+        SCHEMA[0],
+        'INSERT INTO members SELECT 0, member_id, score, correct, wrong, highest_valid_count FROM members_legacy',
+        'DROP TABLE members_legacy',
+    ),
+    # The config moved from config.json to `guild_configs`, which is created by `SCHEMA` and filled
+    # from the file by `ConfigStore.load`
+    2: (),
+    # Added `count_events`, created by `SCHEMA`
+    3: (),
+    # Added `meta`, created by `SCHEMA`
+    4: (),
+    # Added the rollup tables, filled from the correct counts and chain breaks already in `count_events`.
+    # Streaks start from scratch. Databases from before version 3 get an empty `count_events` here.
+    5: (
+        COUNT_EVENTS_TABLE,
+        *ROLLUP_SCHEMA,
+        *(f'''INSERT INTO guild_rollups SELECT guild_id, {resolution}, created_at - created_at % {resolution},
+                SUM(kind = 1), SUM(kind IN (2, 3)) FROM count_events WHERE kind IN (1, 2, 3) GROUP BY 1, 3'''
+          for resolution in (60, 3600, 86400)),
+        *(f'''INSERT INTO member_rollups SELECT guild_id, {resolution}, created_at - created_at % {resolution},
+                member_id, SUM(kind = 1), SUM(kind IN (2, 3)) FROM count_events WHERE kind IN (1, 2, 3)
+                GROUP BY 1, 3, 4''' for resolution in (60, 3600, 86400)),
+    ),
+    # The leaderboard indexes, created by `SCHEMA`, replace the score index
+    6: ('DROP INDEX IF EXISTS idx_members_guild_score',),
+    # Added `guild_configs.last_message_id`. Unknown for existing configs, so nothing is caught up on the first start.
+    # Databases from before version 2 get the table as it was first, so that the column can be added the same way.
+    7: (
+        '''CREATE TABLE IF NOT EXISTS guild_configs (guild_id INTEGER PRIMARY KEY, channel_id INTEGER,
+                current_count INTEGER, high_score INTEGER, current_member_id INTEGER,
+                put_high_score_emoji INTEGER, failed_role_id INTEGER, reliable_counter_role_id INTEGER,
+                failed_member_id INTEGER, correct_inputs_by_failed_member INTEGER)''',
+        'ALTER TABLE guild_configs ADD COLUMN last_message_id INTEGER',
+    ),
+    # A guild can count in several channels, so `guild_configs` has a row per channel instead of per guild
+    8: (
+        'ALTER TABLE guild_configs RENAME TO guild_configs_v7',
+        GUILD_CONFIGS_TABLE,
+        'INSERT INTO guild_configs SELECT * FROM guild_configs_v7',
+        'DROP TABLE guild_configs_v7',  # With its index on `channel_id`, which the new table has already
+    ),
+}
+
+
+class Database:
+    """
+    Wraps two persistent SQLite connections: one for reads and one for writes.
+
+    Writes are queued without blocking the caller and are applied by a single writer task,
+    which groups everything queued at that moment into one transaction (one fsync per batch
+    instead of one per statement). Reads run in a thread pool so they never block the event loop.
+    The database is in WAL mode, so long reads and the writer never block each other.
+    """
+
+    def __init__(self, path: str = 'database.sqlite3', max_batch_size: int = 500) -> None:
+        self.path: str = path
+        self.max_batch_size: int = max_batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        # Each connection is only ever used from its own single thread
+        self._write_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        self._read_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-read')
+
+    async def start(self) -> None:
+        """Open the connections, create the schema and start the writer task."""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        self._write_conn = await loop.run_in_executor(self._write_executor, self._connect)
+        self._read_conn = await loop.run_in_executor(self._read_executor, self._connect)
+        await loop.run_in_executor(self._write_executor, self._migrate)
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop(), name='db-writer')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn: sqlite3.Connection = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = WAL')  # Persistent; readers see the last commit while a write runs
+        conn.execute('PRAGMA synchronous = NORMAL')  # In WAL mode, commits can only be lost on power failure
+        return conn
+
+    def _migrate(self) -> None:
+        version: int = self._write_conn.execute('PRAGMA user_version').fetchone()[0]
+        is_new: bool = self._write_conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'members'").fetchone() is None
+        statements: list[str] = []
+        if not is_new:
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                logger.info('Migrating database to version %d', target)
+                statements.extend(MIGRATIONS[target])
+        statements.extend(SCHEMA)
+        statements.append(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._write_conn.execute('BEGIN')  # Also makes the schema changes part of the transaction
+        self._write_batch([(stmt, (), False, None) for stmt in statements])
+
+    async def close(self) -> None:
+        """Apply all queued writes, then stop the writer task and close the connections."""
+        if self._writer is not None:
+            await self.flush()
+            self._writer.cancel()
+            self._writer = None
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if self._write_conn is not None:
+            await loop.run_in_executor(self._write_executor, self._write_conn.close)
+            self._write_conn = None
+        if self._read_conn is not None:
+            await loop.run_in_executor(self._read_executor, self._read_conn.close)
+            self._read_conn = None
+
+    # ---------
+    # Writes
+    # ---------
+    def write(self, sql: str, params: Sequence[Any] = ()) -> None:
+        """Queue a single statement. Returns immediately."""
+        self._queue.put_nowait((sql, params, False, None))
+
+    def write_many(self, sql: str, seq_of_params: Iterable[Sequence[Any]]) -> None:
+        """Queue a statement to be executed once for every parameter set. Returns immediately."""
+        self._queue.put_nowait((sql, list(seq_of_params), True, None))
+
+    def write_atomic(self, statements: list[tuple[str, Sequence[Any]]]) -> asyncio.Future:
+        """
+        Queue statements that must be committed together. Returns immediately, with a future that
+        is resolved once they are committed, or fails with the error that prevented it.
+        """
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((None, statements, False, future))
+        return future
+
+    async def checkpoint(self) -> None:
+        """
+        Checkpoint the WAL after the writes queued so far. Also fsyncs the WAL, which makes every
+        commit so far durable against power loss, not only against crashes.
+        """
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(
+            self._write_executor, self._write_conn.execute, 'PRAGMA wal_checkpoint(PASSIVE)')
+
+    async def run_in_transaction(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        Run `func` with the write connection on the writer thread, in a transaction of its own, after
+        every write queued so far. For bulk jobs too large to queue; writes queued meanwhile wait for it.
+        """
+        await self.flush()
+        start: float = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._write_executor, self._run_transaction, func)
+        finally:
+            _WRITE_SECONDS.observe(time.perf_counter() - start)
+
+    def _run_transaction(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        with self._write_conn:
+            return func(self._write_conn)
+
+    async def flush(self) -> None:
+        """Wait until every write queued so far has been committed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    @property
+    def pending_writes(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _write_loop(self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while True:
+            batch: list[tuple[Optional[str], Any, bool, Optional[asyncio.Future]]] = [await self._queue.get()]
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            start: float = time.perf_counter()
+            errors: list[Optional[Exception]] = [None] * len(batch)
+            try:
+                try:
+                    await loop.run_in_executor(self._write_executor, self._write_batch, batch)
+                except Exception:  # E.g. an integer that SQLite cannot store, besides `sqlite3.Error`
+                    # The other writes of the batch are not lost with the one that failed
+                    logger.warning('Failed to write a batch of %d statement(s), retrying them one by one', len(batch))
+                    errors = await loop.run_in_executor(self._write_executor, self._write_each, batch)
+                _STATEMENTS.inc(errors.count(None))
+            finally:
+                _WRITE_SECONDS.observe(time.perf_counter() - start)
+                for (*_, future), error in zip(batch, errors):
+                    if future is not None and not future.done():
+                        if error is not None:
+                            future.set_exception(error)
+                        else:
+                            future.set_result(None)
+                    self._queue.task_done()
+
+    def _write_each(self, batch: list[tuple[Optional[str], Any, bool, Optional[asyncio.Future]]]
+                    ) -> list[Optional[Exception]]:
+        # Runs in the writer thread, after the batch failed as a whole: every write in a transaction of its own.
+        # Returns the error of each write, if any; only those writes are dropped.
+        errors: list[Optional[Exception]] = []
+        for write in batch:
+            try:
+                self._write_batch([write])
+                errors.append(None)
+            except Exception as exc:
+                logger.exception('Dropped a write that failed: %s', write[0] or 'atomic statements')
+                errors.append(exc)
+        return errors
+
+    def _write_batch(self, batch: list[tuple[Optional[str], Any, bool, Optional[asyncio.Future]]]) -> None:
+        # Runs in the writer thread. The whole batch is one transaction.
+        with self._write_conn:
+            for sql, params, many, _ in batch:
+                if sql is None:
+                    for statement, statement_params in params:  # From `write_atomic`
+                        self._write_conn.execute(statement, statement_params)
+                elif many:
+                    self._write_conn.executemany(sql, params)
+                else:
+                    self._write_conn.execute(sql, params)
+
+    # ---------
+    # Reads
+    # ---------
+    async def fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        """Run a query off the event loop and return the first row."""
+        start: float = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._read_executor, lambda: self._read_conn.execute(sql, params).fetchone())
+        finally:
+            _READ_SECONDS.observe(time.perf_counter() - start)
+
+    async def stream(self, sql: str, params: Sequence[Any] = (), chunk_size: int = 1000) -> AsyncIterator[list[tuple]]:
+        """Run a query off the event loop and yield its rows in chunks, never holding all of them in memory."""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        cursor: sqlite3.Cursor = await loop.run_in_executor(self._read_executor, self._read_conn.execute, sql, params)
+        try:
+            while rows := await loop.run_in_executor(self._read_executor, cursor.fetchmany, chunk_size):
+                yield rows
+        finally:
+            self._read_executor.submit(cursor.close)  # Not awaited, as the generator may be closed by the GC
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = ()) -> list[tuple]:
+        """Run a query off the event loop and return all rows."""
+        start: float = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._read_executor, lambda: self._read_conn.execute(sql, params).fetchall())
+        finally:
+            _READ_SECONDS.observe(time.perf_counter() - start)
@@ -0,0 +1,135 @@
+"""Bounded evaluator for the mathematical expressions posted in the counting channel"""
+import ast
+import math
+import operator
+import string
+import time
+from functools import lru_cache
+from typing import Callable, Union
+
+Number = Union[int, float]
+
+POSSIBLE_CHARACTERS: str = string.digits + '+-*/. ()'
+
+MAX_EXPRESSION_LENGTH: int = 256
+MAX_NODES: int = 64
+MAX_MAGNITUDE: int = 10 ** 100
+_MAX_DIGITS: int = len(str(MAX_MAGNITUDE))
+MAX_EXPONENT: int = 128
+MAX_EVAL_TIME: float = 0.05  # seconds
+CACHE_SIZE: int = 1024
+
+_BINARY_OPERATORS: dict[type, Callable[[Number, Number], Number]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Pow: operator.pow,
+}
+
+_UNARY_OPERATORS: dict[type, Callable[[Number], Number]] = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+class ExpressionTooComplex(ValueError):
+    """Raised when an expression exceeds one of the evaluation limits."""
+
+
+class _Evaluator:
+    """Walks a parsed expression tree, enforcing the node, size and time limits."""
+
+    def __init__(self, deadline: float) -> None:
+        self._deadline: float = deadline
+        self._nodes: int = 0
+
+    def visit(self, node: ast.AST) -> Number:
+        self._nodes += 1
+        if self._nodes > MAX_NODES:
+            raise ExpressionTooComplex('Too many operations in expression')
+        if time.perf_counter() > self._deadline:
+            raise ExpressionTooComplex('Expression took too long to evaluate')
+
+        if isinstance(node, ast.Expression):
+            return self.visit(node.body)
+
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return self._check(node.value)
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            return _UNARY_OPERATORS[type(node.op)](self.visit(node.operand))
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            left: Number = self.visit(node.left)
+            right: Number = self.visit(node.right)
+            if isinstance(node.op, ast.Pow):
+                self._check_power(left, right)
+            try:
+                return self._check(_BINARY_OPERATORS[type(node.op)](left, right))
+            except OverflowError as exc:
+                raise ExpressionTooComplex('Result is too large') from exc
+
+        # Anything else (names, calls, tuples, comparisons, ...) is not a mathematical expression
+        raise SyntaxError(f'Unsupported element in expression: {type(node).__name__}')
+
+    @staticmethod
+    def _check(value: Number) -> Number:
+        if isinstance(value, complex):
+            # A negative number raised to a fractional power
+            raise ExpressionTooComplex('Result is not a real number')
+        if value != value or abs(value) > MAX_MAGNITUDE:  # value != value is only True for NaN
+            raise ExpressionTooComplex('Result is too large')
+        return value
+
+    @staticmethod
+    def _check_power(base: Number, exponent: Number) -> None:
+        if abs(exponent) > MAX_EXPONENT:
+            raise ExpressionTooComplex('Exponent is too large')
+        if abs(base) > 1 and exponent > 0 and exponent * math.log10(abs(base)) > 100:
+            # Check the size of the result before computing it
+            raise ExpressionTooComplex('Result is too large')
+
+
+def is_expression(content: str) -> bool:
+    """Whether a message looks like a number or an expression, i.e. whether it takes part in counting"""
+    return all(c in POSSIBLE_CHARACTERS for c in content) and any(c.isdigit() for c in content)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _evaluate_cached(expression: str) -> int:
+    tree: ast.Expression = ast.parse(expression.strip(), mode='eval')
+    value: Number = _Evaluator(time.perf_counter() + MAX_EVAL_TIME).visit(tree)
+    try:
+        return round(value)
+    except (OverflowError, ValueError) as exc:
+        raise ExpressionTooComplex('Result is not a finite number') from exc
+
+
+def evaluate(expression: str) -> int:
+    """
+    Evaluate a mathematical expression and round the result to the nearest integer.
+
+    Behaves like `round(eval(expression))` for the expressions allowed in the counting channel, but
+    never executes arbitrary code and refuses expressions that would take too long or grow too large.
+
+    Raises:
+        SyntaxError: the expression is not a valid mathematical expression.
+        ZeroDivisionError: the expression divides by zero.
+        ExpressionTooComplex: the expression exceeds one of the evaluation limits.
+    """
+    # Fast path: most messages in the channel are plain numbers. Leading zeros are rejected
+    # by the parser, so they do not take the fast path either.
+    if expression.isascii() and expression.isdigit() and (len(expression) == 1 or expression[0] != '0'):
+        if len(expression) > _MAX_DIGITS:  # Checked first, so that no huge number is parsed
+            raise ExpressionTooComplex('Number is too large')
+        number: int = int(expression)
+        if number > MAX_MAGNITUDE:  # The same limit as for the numbers in an expression
+            raise ExpressionTooComplex('Number is too large')
+        return number
+
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionTooComplex('Expression is too long')
+
+    return _evaluate_cached(expression)
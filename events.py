@@ -0,0 +1,105 @@
+"""Append-only log of everything that happens to the count"""
+import asyncio
+import logging
+import time
+from enum import IntEnum
+from typing import Optional, Union
+
+import discord
+
+from database import Database
+from pipeline import CountResult, Outcome
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+INT64_MAX: int = 2 ** 63 - 1
+
+
+class EventKind(IntEnum):
+    """Stored as the `kind` column of `count_events`; never renumber"""
+    CORRECT = 1
+    WRONG_NUMBER = 2
+    WRONG_MEMBER = 3
+    SYNTAX_ERROR = 4
+    TOO_COMPLEX = 5
+    EDITED = 6
+    DELETED = 7
+
+
+OUTCOME_KINDS: dict[Outcome, EventKind] = {
+    Outcome.CORRECT: EventKind.CORRECT,
+    Outcome.WRONG_NUMBER: EventKind.WRONG_NUMBER,
+    Outcome.WRONG_MEMBER: EventKind.WRONG_MEMBER,
+    Outcome.SYNTAX_ERROR: EventKind.SYNTAX_ERROR,
+    Outcome.TOO_COMPLEX: EventKind.TOO_COMPLEX,
+}
+
+Event = tuple[int, int, int, int, int, Union[int, str, None], Optional[int], int]
+
+
+class EventLog:
+    """
+    Buffers count events in memory and appends them to the `count_events` table in bulk.
+
+    Recording an event only appends a tuple to a list. The buffer is handed to the database
+    writer as a single `executemany` every `flush_interval` seconds, or as soon as it holds
+    `max_buffer` events, so the counting path never waits for the database.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 1.0, max_buffer: int = 500) -> None:
+        self._db: Database = db
+        self.flush_interval: float = flush_interval
+        self.max_buffer: int = max_buffer
+        self._buffer: list[Event] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self.recorded: int = 0
+
+    async def start(self) -> None:
+        self._flusher = asyncio.create_task(self._flush_loop(), name='event-log-flusher')
+
+    async def close(self) -> None:
+        """Stop the periodic flush and queue everything that is still buffered."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Queue one bulk insert for all buffered events."""
+        if not self._buffer:
+            return
+        events: list[Event] = self._buffer
+        self._buffer = []
+        self._db.write_many('''INSERT INTO count_events (guild_id, channel_id, message_id, member_id, kind, number,
+expected, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', events)
+        logger.debug('Flushed %d count event(s)', len(events))
+
+    def record(self, kind: EventKind, guild_id: int, channel_id: int, message_id: int, member_id: int,
+               number: Optional[int] = None, expected: Optional[int] = None, created_at: Optional[int] = None) -> None:
+        """Append an event about a message, which happened at `created_at` (a Unix timestamp), or now. Never awaits."""
+        stored: Union[int, str, None] = number
+        if number is not None and not -INT64_MAX <= number <= INT64_MAX:
+            stored = str(number)  # Too large for an SQLite integer; the column keeps text as is
+        if created_at is None:
+            created_at = int(time.time())
+        self._buffer.append((guild_id, channel_id, message_id, member_id, kind, stored, expected, created_at))
+        self.recorded += 1
+        if len(self._buffer) >= self.max_buffer:
+            self.flush()
+
+    def record_result(self, result: CountResult) -> None:
+        """Append the event of a message whose outcome has been decided by the pipeline."""
+        message: discord.Message = result.message
+        self.record(OUTCOME_KINDS[result.outcome], message.guild.id, message.channel.id, message.id, message.author.id,
+                    result.number,
+                    result.expected if result.outcome.is_failure or result.outcome is Outcome.CORRECT else None,
+                    int(message.created_at.timestamp()))  # Not now: messages counted while catching up are older
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
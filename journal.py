@@ -0,0 +1,146 @@
+"""Append-only, fsync-batched journal of counting state transitions"""
+import asyncio
+import glob
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+Entry = list[Any]  # [seq, guild_id, *values]
+
+
+class CountJournal:
+    """
+    Makes every change to the count durable without rewriting the whole config.
+
+    Each transition is appended as one JSON line with an increasing sequence number. Appending
+    never awaits: lines are buffered and written by a single background task that writes and
+    fsyncs everything buffered so far at once (group commit), so the cost of an fsync is shared
+    by all the transitions that arrived while the previous one was running. `synced` waits until
+    a given entry is on disk.
+
+    The journal is split into segment files. Old segments are deleted by `drop_segments_before`
+    once a snapshot that contains their entries is durable elsewhere.
+    """
+
+    def __init__(self, prefix: str = 'count_journal') -> None:
+        self.prefix: str = prefix
+        self.seq: int = 0  # Sequence number of the last appended entry
+        self.synced_seq: int = 0  # Sequence number of the last entry known to be on disk
+        self.sync_count: int = 0
+        self._segment: int = 0
+        self._fd: Optional[int] = None
+        self._buffer: list[str] = []
+        self._syncer: Optional[asyncio.Task] = None
+        self._round: Optional[asyncio.Event] = None
+        # A single thread, so that file operations happen in the order they were requested
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+
+    def _segment_path(self, segment: int) -> str:
+        return f'{self.prefix}.{segment:08d}.log'
+
+    def _segments(self) -> list[int]:
+        return sorted(int(path.rsplit('.', 2)[1]) for path in glob.glob(f'{glob.escape(self.prefix)}.*.log'))
+
+    async def open(self, after_seq: int = 0) -> list[Entry]:
+        """
+        Read every entry left by previous runs, oldest first, and start a new segment.
+        New sequence numbers continue after the last entry, and after `after_seq`.
+        """
+        entries: list[Entry] = await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        self.seq = self.synced_seq = max(self.seq, after_seq)
+        return entries
+
+    def _open(self) -> list[Entry]:
+        entries: list[Entry] = []
+        segments: list[int] = self._segments()
+        for segment in segments:
+            with open(self._segment_path(segment), 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # The last line may have been cut short by a crash; it was never acknowledged
+                        logger.warning('Ignoring a torn line in journal segment %d', segment)
+        self.seq = self.synced_seq = max((entry[0] for entry in entries), default=0)
+        self._start_segment(segments[-1] + 1 if segments else 1)
+        return entries
+
+    def _start_segment(self, segment: int) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+        self._segment = segment
+        self._fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    async def close(self) -> None:
+        """Write out what is still buffered and close the current segment."""
+        while self._syncer is not None:
+            await asyncio.shield(self._syncer)
+        if self._fd is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, os.close, self._fd)
+            self._fd = None
+
+    def append(self, guild_id: int, values: list[Any]) -> int:
+        """Append a transition and return its sequence number. Never awaits."""
+        self.seq = max(self.seq + 1, self.synced_seq + 1)
+        self._buffer.append(json.dumps([self.seq, guild_id, *values], separators=(',', ':')) + '\n')
+        if self._syncer is None:
+            self._round = asyncio.Event()
+            self._syncer = asyncio.create_task(self._sync_loop(), name='journal-sync')
+        return self.seq
+
+    async def synced(self, seq: int) -> None:
+        """Wait until the entry with sequence number `seq` has been fsynced."""
+        while self.synced_seq < seq and self._syncer is not None:
+            await self._round.wait()
+
+    async def _sync_loop(self) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        try:
+            while self._buffer:
+                data: bytes = ''.join(self._buffer).encode()
+                last: int = self.seq
+                self._buffer = []
+                try:
+                    await loop.run_in_executor(self._executor, self._write, data)
+                    self.sync_count += 1
+                except OSError:
+                    # Counting goes on; the snapshot still persists the state, just less often
+                    logger.exception('Failed to write %d byte(s) to the count journal', len(data))
+                self.synced_seq = last
+                done: asyncio.Event = self._round
+                self._round = asyncio.Event()  # Set once the next round is on disk
+                done.set()
+        finally:
+            self._syncer = None
+            self._round.set()
+
+    def _write(self, data: bytes) -> None:
+        view: memoryview = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        os.fsync(self._fd)
+
+    def rotate(self) -> int:
+        """Start a new segment for the entries appended from now on. Returns the number of the new segment."""
+        segment: int = self._segment + 1
+        self._segment = segment  # Reserved right away; the file is switched in order with pending writes
+        self._executor.submit(self._start_segment, segment)
+        return segment
+
+    async def drop_segments_before(self, segment: int) -> None:
+        """Delete the segments older than `segment`, whose entries are all in a durable snapshot."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._drop_segments_before, segment)
+
+    def _drop_segments_before(self, segment: int) -> None:
+        for old in self._segments():
+            if old < segment:
+                os.remove(self._segment_path(old))
+
+    @property
+    def pending(self) -> int:
+        """Entries that are not known to be on disk yet"""
+        return self.seq - self.synced_seq
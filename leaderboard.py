@@ -0,0 +1,210 @@
+"""Paginated leaderboards, read with keyset queries and cached as rendered pages"""
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import discord
+
+from database import Database
+from member_resolver import MemberResolver
+from member_stats import MemberStats, MemberStatsCache
+from metrics import REGISTRY, Family
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+LEADERBOARD_PAGES: Family = REGISTRY.counter('leaderboard_pages_total', 'Leaderboard pages shown, by source',
+                                             ('source',))
+
+# The SQL expression each leaderboard is sorted by, and its title. Every expression has an index
+# on (guild_id, expression, member_id) with the same text, see `database.SCHEMA`.
+ORDERS: dict[str, tuple[str, str]] = {
+    'score': ('score', 'Score'),
+    'correct': ('correct', 'Correct'),
+    'accuracy': ('correct * 100.0 / (correct + wrong)', 'Accuracy'),
+    'highest_valid_count': ('highest_valid_count', 'Highest valid count'),
+}
+
+Value = Union[int, float]
+
+
+def order_value(stats: MemberStats, order: str) -> Optional[Value]:
+    """The value of `stats` in the leaderboard `order`, computed like the SQL expression"""
+    if order == 'accuracy':
+        total: int = stats.correct + stats.wrong
+        return stats.correct * 100.0 / total if total else None
+    return getattr(stats, order)
+
+
+@dataclass
+class Page:
+    """A rendered leaderboard page"""
+    description: str
+    member_ids: set[int]
+    last: Optional[tuple[Value, int]]  # (value, member_id) of the last row: where the next page starts
+    has_next: bool
+    rendered_at: float
+
+
+class Leaderboards:
+    """
+    Serves leaderboard pages of `page_size` rows, sorted by one of `ORDERS`.
+
+    Pages are read with keyset queries (`WHERE (value, member_id) < (last value, last member_id)`)
+    on covering indexes, so any page costs the same as the first one. Rendered pages are cached
+    per guild and order, from the first page on. When a member's stats change, only the cached
+    pages from the first one the member is on, or would now be on, are dropped, so counting at
+    the bottom of a leaderboard does not invalidate its top pages. Pages also expire after `ttl`
+    seconds, since they show whether members are still in the server.
+    """
+
+    def __init__(self, db: Database, member_stats: MemberStatsCache, resolver: MemberResolver,
+                 page_size: int = 10, max_pages: int = 20, max_boards: int = 256, ttl: float = 300.0) -> None:
+        self._db: Database = db
+        self._member_stats: MemberStatsCache = member_stats
+        self._resolver: MemberResolver = resolver
+        self.page_size: int = page_size
+        self.max_pages: int = max_pages
+        self.max_boards: int = max_boards
+        self.ttl: float = ttl
+        # (guild_id, order) -> consecutive pages from the first one
+        self._boards: OrderedDict[tuple[int, str], list[Page]] = OrderedDict()
+        # Changes made while pages of a guild are being rendered, applied to them once they are cached.
+        # `None` stands for the whole guild.
+        self._renders: dict[int, list[list[Optional[MemberStats]]]] = {}
+
+    async def page(self, guild: discord.Guild, order: str, number: int) -> tuple[int, Page]:
+        """
+        Get page `number` (from 0) of a leaderboard, or its last page if it has fewer pages.
+        Returns the number of the page as well. Renders the pages before it too if they are not cached.
+        """
+        key: tuple[int, str] = (guild.id, order)
+        pages: list[Page] = list(self._boards.get(key, ()))
+        if pages and time.monotonic() - pages[0].rendered_at > self.ttl:
+            pages = []  # Later pages are never older than the first one
+        if number < len(pages) or (pages and not pages[-1].has_next):
+            self._boards.move_to_end(key)
+            LEADERBOARD_PAGES.labels('cache').inc()
+            number = min(number, len(pages) - 1)
+            return number, pages[number]
+
+        changes: list[Optional[MemberStats]] = []
+        self._renders.setdefault(guild.id, []).append(changes)
+        try:
+            self._member_stats.flush()  # Bring the table up to date with the cached stats
+            await self._db.flush()
+            while len(pages) <= number and (not pages or pages[-1].has_next):
+                pages.append(await self._render(guild, order, len(pages), pages[-1].last if pages else None))
+        finally:
+            self._renders[guild.id].remove(changes)
+            if not self._renders[guild.id]:
+                del self._renders[guild.id]
+        LEADERBOARD_PAGES.labels('database').inc()
+        number = min(number, len(pages) - 1)
+
+        self._boards[key] = pages[:self.max_pages]
+        self._boards.move_to_end(key)
+        if len(self._boards) > self.max_boards:
+            self._boards.popitem(last=False)
+        for stats in changes:
+            if stats is None:
+                self.invalidate(guild.id)
+            else:
+                self.member_changed(stats)
+        return number, pages[number]
+
+    async def _render(self, guild: discord.Guild, order: str, number: int,
+                      after: Optional[tuple[Value, int]]) -> Page:
+        expression: str = ORDERS[order][0]
+        where: str = 'guild_id = ?'
+        params: list = [guild.id]
+        if order == 'accuracy':
+            where += f' AND {expression} IS NOT NULL'  # Members who never counted
+        if after is not None:
+            # The first condition is redundant, but lets SQLite seek in the expression index as well
+            where += f' AND {expression} <= ? AND ({expression}, member_id) < (?, ?)'
+            params.extend((after[0], *after))
+        rows: list[tuple[int, Value]] = await self._db.fetchall(
+            f'SELECT member_id, {expression} FROM members WHERE {where} '
+            f'ORDER BY {expression} DESC, member_id DESC LIMIT ?', (*params, self.page_size + 1))
+        has_next: bool = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        # Resolves all members at once, from the cache where possible
+        members: dict[int, Optional[discord.Member]] = await self._resolver.resolve_many(
+            guild, [member_id for member_id, _ in rows])
+        lines: list[str] = []
+        for rank, (member_id, value) in enumerate(rows, number * self.page_size + 1):
+            member: Optional[discord.Member] = members[member_id]
+            shown: str = f'{value:.2f}%' if order == 'accuracy' else str(value)
+            lines.append(f'{rank}. {member.mention if member else "An ex-member"} **{shown}**')
+        return Page('\n'.join(lines), {member_id for member_id, _ in rows},
+                    (rows[-1][1], rows[-1][0]) if rows else None, has_next, time.monotonic())
+
+    def member_changed(self, stats: MemberStats) -> None:
+        """Drop the cached pages that a change to the stats of a member may have made wrong. Never awaits."""
+        for changes in self._renders.get(stats.guild_id, ()):
+            changes.append(stats)
+        for order in ORDERS:
+            pages: Optional[list[Page]] = self._boards.get((stats.guild_id, order))
+            if not pages:
+                continue
+            value: Optional[Value] = order_value(stats, order)
+            for number, page in enumerate(pages):
+                # Rows below the last page belong to it as well
+                if stats.member_id in page.member_ids or (value is not None and (
+                        not page.has_next or page.last is None or (value, stats.member_id) > page.last)):
+                    del pages[number:]
+                    break
+            if not pages:
+                del self._boards[stats.guild_id, order]
+
+    def invalidate(self, guild_id: int) -> None:
+        """Drop every cached page of a guild, e.g. after rows were deleted or imported."""
+        for changes in self._renders.get(guild_id, ()):
+            changes.append(None)
+        for order in ORDERS:
+            self._boards.pop((guild_id, order), None)
+
+
+class LeaderboardView(discord.ui.View):
+    """Previous/next buttons under a leaderboard, for the member who asked for it"""
+
+    def __init__(self, leaderboards: Leaderboards, user_id: int, order: str) -> None:
+        super().__init__(timeout=180)
+        self.leaderboards: Leaderboards = leaderboards
+        self.user_id: int = user_id
+        self.order: str = order
+        self.number: int = 0
+        self.message: Optional[discord.Message] = None
+
+    def embed(self, guild: discord.Guild, page: Page) -> discord.Embed:
+        self.previous_page.disabled = self.number == 0
+        self.next_page.disabled = not page.has_next
+        emb = discord.Embed(title=f'Top users in {guild.name} by {ORDERS[self.order][1].lower()}',
+                            color=discord.Color.blue(), description=page.description or 'Nobody has counted yet!')
+        emb.set_footer(text=f'Page {self.number + 1}')
+        return emb
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    async def on_timeout(self) -> None:
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+    async def _show(self, interaction: discord.Interaction, number: int) -> None:
+        self.number, page = await self.leaderboards.page(interaction.guild, self.order, number)
+        await interaction.response.edit_message(embed=self.embed(interaction.guild, page), view=self)
+
+    @discord.ui.button(label='Previous', emoji='◀️', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        await self._show(interaction, max(0, self.number - 1))
+
+    @discord.ui.button(label='Next', emoji='▶️', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        await self._show(interaction, self.number + 1)
@@ -1,466 +1,670 @@
 """Counting Discord bot for Indently server"""
+import argparse
 import asyncio
+import hashlib
 import json
+import logging
 import os
-import sqlite3
-import string
-from dataclasses import dataclass
-from typing import Optional
+import time
+from collections import defaultdict
+from functools import partial
+from typing import Literal, Optional
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 
+from burst import PLAIN_EMOJI, BurstMonitor
+from config import Config, ConfigStore
+from database import Database
+from evaluator import ExpressionTooComplex, evaluate, is_expression
+from events import EventKind, EventLog
+from journal import CountJournal
+from leaderboard import LeaderboardView, Leaderboards, Page
+from maintenance import MaintenanceScheduler
+from member_resolver import MemberResolver
+from message_index import IndexedMessage, MessageIndex
+from member_stats import MemberStats, MemberStatsCache
+from metrics import REGISTRY, Family, Metric, MetricsServer, PhaseTimer
+from outbound import OutboundQueue
+from pipeline import STAGE_SECONDS, CountPipeline, CountResult, Outcome
+from ranking import ScoreIndex
+from reliable_role import ReliableRoleTracker
+from role_queue import RoleMutationQueue
+from rollups import DAY, HOUR, MINUTE, Rollups, resolution_for, sparkline
+from transfer import FORMATS, TABLES, export_table, import_table
+
 load_dotenv('.env')
 
 TOKEN: str = os.getenv('TOKEN')
-POSSIBLE_CHARACTERS: str = string.digits + '+-*/. ()'
-
-
-@dataclass
-class Config:
-    """Configuration for the bot"""
-    channel_id: Optional[int] = None
-    current_count: int = 0
-    high_score: int = 0
-    current_member_id: Optional[int] = None
-    put_high_score_emoji: bool = False
-    failed_role_id: Optional[int] = None
-    reliable_counter_role_id: Optional[int] = None
-    failed_member_id: Optional[int] = None
-    correct_inputs_by_failed_member: int = 0
+METRICS_PORT: Optional[str] = os.getenv('METRICS_PORT')  # Serve Prometheus metrics on localhost if set
+PRUNE_CHUNK_SIZE: int = 1000
+CATCH_UP_PAGE_SIZE: int = 100  # Messages the history API returns per request
+EXPORT_DIR: str = 'exports'  # Exports too large to attach are left here
 
-    @staticmethod
-    def read():
-        _config: Optional[Config] = None
-        try:
-            with open("config.json", "r") as file:
-                _config = Config(**json.load(file))
-        except FileNotFoundError:
-            _config = Config()
-            _config.dump_data()
-        return _config
-
-    def dump_data(self) -> None:
-        """Update the config.json file"""
-        with open("config.json", "w", encoding='utf-8') as file:
-            json.dump(self.__dict__, file, indent=2)
-
-    def increment(self, member_id: int) -> None:
-        """
-        Increment the current count.
-        NOTE: config is no longer dumped by default. Explicitly call config.dump().
-        """
-        # increment current count
-        self.current_count += 1
+logger: logging.Logger = logging.getLogger(__name__)
 
-        # update current member id
-        self.current_member_id = member_id
+_DB_READ_SECONDS: Metric = STAGE_SECONDS.labels('db_read')
+# Updating the cached stats only; their writes are timed by `database.QUERY_SECONDS`
+_STATS_UPDATE_SECONDS: Metric = STAGE_SECONDS.labels('stats_update')
+MAINTENANCE_SECONDS: Family = REGISTRY.histogram('maintenance_seconds', 'Time spent in background maintenance',
+                                                 ('task',))
+COMMAND_SECONDS: Family = REGISTRY.histogram('command_seconds', 'Time spent handling slash commands', ('command',))
+CAUGHT_UP: Metric = REGISTRY.counter('counting_caught_up_total',
+                                     'Counts and chain breaks posted while the bot was offline').labels()
+COMMAND_ERRORS: Family = REGISTRY.counter('command_errors_total', 'Slash commands that raised an error',
+                                          ('command',))
 
-        # check the high score
-        self.high_score = max(self.high_score, self.current_count)
 
-    def reset(self) -> None:
-        """
-        Reset current count.
-        NOTE: config is no longer dumped by default. Explicitly call config.dump_data().
-        """
-        self.current_count = 0
+class CommandTree(app_commands.CommandTree):
+    """Command tree that records how long every slash command takes and how often it fails"""
 
-        self.correct_inputs_by_failed_member = 0
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started'] = time.perf_counter()
+        return True
 
-        # update current member id
-        self.current_member_id = None
-        self.put_high_score_emoji = False
-
-    def reaction_emoji(self) -> str:
-        """
-        Get the reaction emoji based on the current count.
-        NOTE: Data is no longer dumped automatically. Explicitly call config.data_dump().
-        """
-        if self.current_count == self.high_score and not self.put_high_score_emoji:
-            emoji = "🎉"
-            self.put_high_score_emoji = True  # Needs a config data dump
-        elif self.current_count == 100:
-            emoji = "💯"
-        elif self.current_count == 69:
-            emoji = "😏"
-        elif self.current_count == 666:
-            emoji = "👹"
-        else:
-            emoji = "✅"
-        return emoji
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError) -> None:
+        COMMAND_ERRORS.labels(interaction.command.name if interaction.command else 'unknown').inc()
+        await super().on_error(interaction, error)
 
 
-class Bot(commands.Bot):
+class Bot(commands.AutoShardedBot):
     """Counting Discord bot for Indently discord server."""
 
     def __init__(self) -> None:
         intents = discord.Intents.default()
         intents.message_content = True
         intents.members = True
-        self._config: Config = Config.read()
-        self._busy: int = 0
-        self._participating_users: Optional[set[int]] = None
-        self.failed_role: Optional[discord.Role] = None
-        self.reliable_role: Optional[discord.Role] = None
-        super().__init__(command_prefix='!', intents=intents)
-
-    def read_config(self):
-        """
-        Force re-reading the config from the json to the instance variable.
-        Mostly for use by slash command functions after they have changed the config values.
-        """
-        self._config = Config.read()
+        self._startup: PhaseTimer = PhaseTimer('startup')
+        self._announced: bool = False
+        # Per-guild state, keyed by guild ID
+        self.reliable_trackers: defaultdict[int, ReliableRoleTracker] = defaultdict(ReliableRoleTracker)
+        self._tracked_guilds: set[int] = set()  # Guilds whose tracker knows the current reliable role holders
+        self.score_indexes: defaultdict[int, ScoreIndex] = defaultdict(ScoreIndex)
+        self.role_queue: RoleMutationQueue = RoleMutationQueue()
+        self.outbound: OutboundQueue = OutboundQueue()  # Reactions and alerts of the counting path
+        self.db: Database = Database('database.sqlite3')
+        # Configs are changed in place; each guild's config is always the same object
+        self.journal: CountJournal = CountJournal('count_journal')  # Counts since the last config snapshot
+        self.config_store: ConfigStore = ConfigStore(self.db, legacy_path='config.json', journal=self.journal)
+        self.member_stats: MemberStatsCache = MemberStatsCache(self.db, self.score_indexes)
+        self.event_log: EventLog = EventLog(self.db)
+        self.rollups: Rollups = Rollups(self.db)
+        self.message_index: MessageIndex = MessageIndex()
+        self.member_resolver: MemberResolver = MemberResolver()
+        self.leaderboards: Leaderboards = Leaderboards(self.db, self.member_stats, self.member_resolver)
+        self._pipelines: dict[int, CountPipeline] = {}
+        # Messages of counting channels that are held back until `catch_up` is done with the channel
+        self._held: dict[int, list[discord.Message]] = {}
+        # Skips plain reactions while a channel counts faster than they can be sent
+        self.burst: BurstMonitor = BurstMonitor(lambda channel, summary: self.outbound.alert(channel, summary, {}))
+        self.maintenance: MaintenanceScheduler = MaintenanceScheduler(self.do_busy_work, idle_delay=5, max_delay=60)
+        self.metrics_server: Optional[MetricsServer] = None
+        super().__init__(command_prefix='!', intents=intents, tree_cls=CommandTree)
+        self.register_gauges()
+
+    def register_gauges(self) -> None:
+        """Gauges are only read when the metrics are scraped or shown"""
+        REGISTRY.gauge('gateway_latency_seconds', 'Heartbeat latency of each shard',
+                       lambda: dict(self.latencies), label_name='shard')
+        REGISTRY.gauge('counting_pending_results', 'Counting messages whose side effects are not done yet',
+                       lambda: sum(pipeline.pending for pipeline in self._pipelines.values()))
+        REGISTRY.gauge('db_pending_writes', 'Statements queued for the writer task', lambda: self.db.pending_writes)
+        REGISTRY.gauge('member_stats_cached', 'Members whose stats are cached', lambda: self.member_stats.size)
+        REGISTRY.gauge('member_stats_dirty', 'Cached members with unsaved stats', lambda: self.member_stats.dirty_count)
+        REGISTRY.gauge('message_index_size', 'Counting messages indexed for edit and delete detection',
+                       lambda: len(self.message_index))
+        REGISTRY.gauge('count_events_buffered', 'Count events not handed to the database yet',
+                       lambda: self.event_log.pending)
+        REGISTRY.gauge('count_journal_pending', 'Journaled counts not fsynced yet', lambda: self.journal.pending)
+        REGISTRY.gauge('config_dirty_guilds', 'Guilds whose config has unsaved changes',
+                       lambda: self.config_store.metrics()['dirty'])
+        REGISTRY.gauge('outbound_queue_depth', 'Reactions and alerts waiting to be sent, by kind',
+                       self.outbound.metrics, label_name='kind')
+        REGISTRY.gauge('burst_mode_channels', 'Counting channels in burst mode', lambda: self.burst.bursting)
+        REGISTRY.gauge('role_changes', 'Role changes, by state', self.role_queue.metrics, label_name='state')
 
     async def on_ready(self) -> None:
         """Override the on_ready method"""
-        print(f'Bot is ready as {self.user.name}#{self.user.discriminator}')
+        logger.info('Bot is ready as %s#%s', self.user.name, self.user.discriminator)
+        if self._announced:
+            return  # Reconnected
+        self._announced = True
+        self._startup.mark('gateway')
+        logger.info('Startup: %s', self._startup)
+        # Counting is already being accepted; the announcements are sent in the background
+        asyncio.create_task(self.announce_online(), name='announce-online')
+
+    async def announce_online(self) -> None:
+        """Catches up with every counting channel, then posts the current state of the count in it"""
+        # Concurrently, so that no channel holds back the live messages of another for long
+        busy_work_necessary: list[bool] = await asyncio.gather(
+            *(self.announce_in_channel(config) for config in self.config_store.configs() if config.channel_id))
+        if any(busy_work_necessary):
+            await self.maintenance.run_now('startup')
+
+    async def announce_in_channel(self, config: Config) -> bool:
+        """Catches up with a counting channel and announces the count. Returns whether busy work is necessary."""
+        channel: Optional[discord.TextChannel] = self.get_channel(config.channel_id)
+        if not channel:  # Counting channel doesn't exist.
+            self._held.pop(config.channel_id, None)
+            self.config_store.remove_channel(config.channel_id)
+            return True
 
         busy_work_necessary: bool = False
+        counts, breaks = await self.catch_up(config, channel)
 
-        if self._config.channel_id:
+        emb: discord.Embed = discord.Embed(description=':green_circle:  **I\'m now online!**',
+                                           colour=discord.Color.brand_green())
 
-            channel: Optional[discord.TextChannel] = bot.get_channel(self._config.channel_id)
-            if channel:  # It is possible that the channel was removed, so check if channel exists
+        if counts or breaks:
+            emb.description += (f'\n\n:inbox_tray:  Counted the {counts + breaks} number(s) posted while I was '
+                                f'offline, with {breaks} chain break(s).')
 
-                emb: discord.Embed = discord.Embed(description=':green_circle:  **I\'m now online!**',
-                                                   colour=discord.Color.brand_green())
+        if config.high_score > 0:
+            emb.description += (f'\n\n:fire:  Let\'s beat the high score of {config.high_score}!  '
+                                f':muscle:\n')
 
-                if self._config.high_score > 0:
-                    emb.description += (f'\n\n:fire:  Let\'s beat the high score of {self._config.high_score}!  '
-                                        f':muscle:\n')
+        emb.add_field(name='CURRENT number', value=f'{config.current_count}', inline=True)
 
-                emb.add_field(name='CURRENT number', value=f'{self._config.current_count}', inline=True)
+        if config.current_member_id:
 
-                if self._config.current_member_id:
+            member: Optional[discord.Member] = channel.guild.get_member(config.current_member_id)
+            if member:  # It is possible that the member has left the server, so check if member exists
+                emb.add_field(name='Last input by', value=f'{member.mention}', inline=True)
 
-                    member: Optional[discord.Member] = channel.guild.get_member(self._config.current_member_id)
-                    if member:  # It is possible that the member has left the server, so check if member exists
-                        emb.add_field(name='Last input by', value=f'{member.mention}', inline=True)
-
-                    else:  # Member has left the server.
-                        self._config.current_member_id = None
-                        emb.add_field(name='Last input by', value=f'An ex-member', inline=True)
-                        busy_work_necessary = True
-
-                await channel.send(embed=emb)
-
-            else:  # Counting channel doesn't exist.
-                self._config.channel_id = None
+            else:  # Member has left the server.
+                config.current_member_id = None
+                self.config_store.record_transition(config)
+                emb.add_field(name='Last input by', value=f'An ex-member', inline=True)
                 busy_work_necessary = True
 
-        self.set_roles()
+        try:
+            await channel.send(embed=emb)
+        except discord.HTTPException:
+            logger.warning('Could not announce in channel %d', channel.id, exc_info=True)
+        return busy_work_necessary or bool(breaks)  # Breaks may have changed the failed role
 
-        if busy_work_necessary:
-            await self.do_busy_work()
+    def guild_role(self, guild_id: int, role_id: Optional[int]) -> Optional[discord.Role]:
+        """Looks up a role of a guild in the gateway cache. O(1), so roles are never stored."""
+        guild: Optional[discord.Guild] = self.get_guild(guild_id)
+        return guild.get_role(role_id) if guild and role_id is not None else None
 
-    def set_roles(self):
+    def roles_changed(self, guild_id: int) -> None:
         """
-        Sets the `self.failed_role` and `self.reliable_counter_role` variables.
+        Must be called after the failed or reliable role of a guild has been set or removed.
+        The holders of the reliable role are looked up again the next time they are needed.
         """
-        for member in self.get_all_members():
-            guild: discord.Guild = member.guild
+        self._tracked_guilds.discard(guild_id)
+        if guild_id in self.reliable_trackers:
+            self.reliable_trackers[guild_id].forget_holders()
 
-            # Set self.failed_role
-            if self._config.failed_role_id is not None:
-                self.failed_role = discord.utils.get(guild.roles, id=self._config.failed_role_id)
-            else:
-                self.failed_role = None
-
-            # Set self.reliable_counter_role
-            if self._config.reliable_counter_role_id is not None:
-                self.reliable_role = discord.utils.get(guild.roles, id=self._config.reliable_counter_role_id)
-            else:
-                self.reliable_role = None
-
-            break
-
-    async def add_remove_reliable_role(self):
+    async def add_remove_reliable_role(self, guild_id: int):
         """
-        Adds/removes the reliable role from participating users.
-
-        Criteria for getting the reliable role:
-        1. Accuracy must be > 99%. (Accuracy = correct / (correct + wrong))
-        2. Must have score >= 100.
+        Adds/removes the reliable role for members of a guild whose eligibility has changed since the last call.
+        See `reliable_role.is_reliable` for the criteria.
         """
-        if self.reliable_role and self._participating_users:
-
-            conn: sqlite3.Connection = sqlite3.connect('database.sqlite3')
-            cursor: sqlite3.Cursor = conn.cursor()
-
-            # Make a copy of the set to prevent runtime errors if the set changes while execution
-            users: set[int] = self._participating_users.copy()
-            self._participating_users = None
+        reliable_role: Optional[discord.Role] = self.guild_role(
+            guild_id, self.config_store.get(guild_id).reliable_counter_role_id)
+        if reliable_role:
+            tracker: ReliableRoleTracker = self.reliable_trackers[guild_id]
+            if guild_id not in self._tracked_guilds:
+                # Role changes are only made for members whose eligibility differs from their current role.
+                # Finding the holders is O(members), so it is done once, when they are first needed.
+                tracker.reset(member.id for member in reliable_role.members)
+                self._tracked_guilds.add(guild_id)
+            for member_id, eligible in tracker.take_transitions().items():
+                member: Optional[discord.Member] = reliable_role.guild.get_member(member_id)
+                if member:
+                    # Applied in the background; the holder is only recorded once the change has been made
+                    self.role_queue.set_role(member, reliable_role, eligible,
+                                             partial(self.reliable_role_changed, tracker, member_id, eligible))
 
-            if len(users) == 1:
-                sql_stmt: str = f'SELECT member_id, correct, wrong FROM members WHERE member_id = {tuple(users)[0]}'
-            else:
-                sql_stmt: str = f'SELECT member_id, correct, wrong FROM members WHERE member_id IN {tuple(users)}'
-
-            cursor.execute(sql_stmt)
-            result: Optional[list[tuple[int]]] = cursor.fetchall()
-            conn.close()
-
-            if result:
-                for data in result:
-                    member: Optional[discord.Member] = self.reliable_role.guild.get_member(data[0])
-                    if member:
-                        accuracy: float = (data[1] / (data[1] + data[2])) * 100
-
-                        if float(f'{accuracy:.2f}') >= 99.00 and data[1] - data[2] >= 100:
-                            await member.add_roles(self.reliable_role)
-                        else:
-                            await member.remove_roles(self.reliable_role)
+    @staticmethod
+    def reliable_role_changed(tracker: ReliableRoleTracker, member_id: int, eligible: bool, done: bool,
+                              error: Optional[discord.HTTPException]) -> None:
+        """Called by the role queue once the reliable role of a member has been changed, or could not be"""
+        if done:
+            tracker.set_holder(member_id, eligible)
+        elif isinstance(error, discord.Forbidden):
+            tracker.change_refused(member_id, eligible)  # Retrying would fail the same way; already logged
+        else:
+            tracker.change_failed(member_id, eligible)  # Tried again at the next reconciliation
 
-    async def add_remove_failed_role(self):
+    async def add_remove_failed_role(self, guild_id: int):
         """
-        Adds the `self.failed_role` to the user whose id is stored in `self._config.failed_member_id`.
-        Removes the failed role from all other users.
+        Adds the guild's failed role to the users whose id is stored in the `failed_member_id` of one of
+        the guild's counting channels. Removes the failed role from all other users.
         Does not proceed if failed role has not been set.
-        If `self.failed_role` is not `None` but `self._config.failed_member_id` is `None`, then simply removes
-        the failed role from all members who have it currently.
+        If nobody has failed in any of the channels, then simply removes the failed role from all members
+        who have it currently.
         """
-        if self.failed_role:
-            handled_member: bool = False
-
-            for member in self.failed_role.members:
+        configs: list[Config] = self.config_store.for_guild(guild_id)
+        failed_role: Optional[discord.Role] = self.guild_role(guild_id, self.config_store.get(guild_id).failed_role_id)
+        if failed_role:
+            failed_member_ids: set[int] = {config.failed_member_id for config in configs if config.failed_member_id}
+            # Role changes are queued; the queue only keeps the final state per member and skips no-ops
+            for member in failed_role.members:
                 # Iterate through members who have the failed role, and remove those who have not failed
-
-                if self._config.failed_member_id and self._config.failed_member_id == member.id:
-                    # Current failed member already has the failed role, so just continue
-                    handled_member = True
-                    continue
+                if member.id not in failed_member_ids:
+                    self.role_queue.set_role(member, failed_role, False)
+
+            for member_id in failed_member_ids:
+                failed_member: Optional[discord.Member] = await self.member_resolver.resolve(
+                    failed_role.guild, member_id)
+                if failed_member:
+                    self.role_queue.set_role(failed_member, failed_role, True)
                 else:
-                    # Either failed_member_id is None, or this member is not the current failed member.
-                    # In either case, we have to remove the role.
-                    await member.remove_roles(self.failed_role)
-
-            if not handled_member and self._config.failed_member_id:
-                # Current failed member does not yet have the failed role
-                try:
-                    failed_member: discord.Member = await self.failed_role.guild.fetch_member(self._config.failed_member_id)
-                    await failed_member.add_roles(self.failed_role)
-                except discord.NotFound:
                     # Member is no longer in the server
-                    self._config.failed_member_id = None
-                    self._config.correct_inputs_by_failed_member = 0
-                    self._config.dump_data()
-
-    async def schedule_busy_work(self):
-        await asyncio.sleep(5)
-        self._busy -= 1
-        await self.do_busy_work()
+                    for config in configs:
+                        if config.failed_member_id == member_id:
+                            self.config_store.update_config(config, failed_member_id=None,
+                                                            correct_inputs_by_failed_member=0)
 
     async def do_busy_work(self):
-        if self._busy == 0:
-            self._config.dump_data()
-            await self.add_remove_failed_role()
-            await self.add_remove_reliable_role()
+        """
+        Persists the config and reconciles the failed/reliable roles of every guild.
+        Run by `self.maintenance` once counting has been quiet for a few seconds.
+        """
+        start: float = time.perf_counter()
+        await self.config_store.flush()
+        flushed: float = time.perf_counter()
+        for guild_id in {config.guild_id for config in self.config_store.configs()}:
+            await self.add_remove_failed_role(guild_id)
+            await self.add_remove_reliable_role(guild_id)
+        done: float = time.perf_counter()
+        MAINTENANCE_SECONDS.labels('config_flush').observe(flushed - start)
+        MAINTENANCE_SECONDS.labels('role_reconcile').observe(done - flushed)
+        MAINTENANCE_SECONDS.labels('busy_work').observe(done - start)
 
     async def on_message(self, message: discord.Message) -> None:
         """Override the on_message method"""
         if message.author == self.user:
             return
 
-        # Check if the message is in the channel
-        if message.channel.id != self._config.channel_id:
+        # Check if the message is in a counting channel
+        config: Optional[Config] = self.config_store.for_channel(message.channel.id)
+        if config is None:
             return
 
-        content: str = message.content
-        if not all(c in POSSIBLE_CHARACTERS for c in content) or not any(char.isdigit() for char in content):
+        held: Optional[list[discord.Message]] = self._held.get(message.channel.id)
+        if held is not None:
+            held.append(message)  # Counted after the messages posted while the bot was offline, see `catch_up`
             return
+        self.count_message(config, message)
 
-        zero_division: bool = False
+    def count_message(self, config: Config, message: discord.Message, live: bool = True) -> Optional[CountResult]:
+        """
+        Decides the outcome of a counting message and records it. Never awaits.
+        Unless `live` is false, its side effects are queued as well. Messages that were already counted are ignored.
+        """
+        if config.last_message_id is not None and message.id <= config.last_message_id:
+            return None
+
+        pipeline: Optional[CountPipeline] = self._pipelines.get(message.channel.id)
+        if pipeline is None:
+            pipeline = self._pipelines[message.channel.id] = CountPipeline(self.handle_count_result)
+
+        # Decides the outcome right away, in the order the messages arrive in the channel. Each channel
+        # has its own pipeline, so channels never wait for each other. Reactions, announcements
+        # and stats updates are done concurrently afterwards by `self.handle_count_result`.
+        result: Optional[CountResult] = pipeline.submit(config, message, handle=live)
+        if result is not None:
+            if result.outcome is not Outcome.SYNTAX_ERROR and result.outcome is not Outcome.TOO_COMPLEX:
+                # The pipeline has changed the config. Journaled now, in counting order; config writes are coalesced.
+                result.journal_seq = self.config_store.record_transition(config)
+            self.event_log.record_result(result)  # Buffered; appended to the log in bulk
+            self.rollups.record_result(result)  # Likewise added to the time buckets in bulk
+            self.message_index.add(result)  # For detecting edits and deletions
+            if live and self.burst.observe(result) and result.emoji == PLAIN_EMOJI:
+                self.burst.skip_reaction(message.channel.id)  # Milestones still get their reaction
+                result.emoji = None
+        return result
+
+    async def catch_up(self, config: Config, channel: discord.TextChannel) -> tuple[int, int]:
+        """
+        Counts the messages posted in a counting channel while the bot was offline, with the usual rules,
+        then hands the channel over to `on_message`. Returns the number of counts and of chain breaks.
 
+        The history after the last processed message is read oldest first, one page of `CATCH_UP_PAGE_SIZE`
+        messages at a time, and the side effects of each page are applied in bulk. Messages that arrive
+        meanwhile are held back, and counted right after the history without awaiting in between,
+        so no message is missed or counted twice.
+        """
+        counts: int = 0
+        breaks: int = 0
+        page: list[CountResult] = []
         try:
-            number: int = round(eval(content))
-        except SyntaxError:
-            await message.add_reaction('⚠️')
-            await message.channel.send(f'Syntax error in mathematical expression!\nThe chain has **not** been broken.')
+            if config.last_message_id is not None:  # Otherwise nothing was counted in the channel yet
+                async for message in channel.history(limit=None, after=discord.Object(config.last_message_id),
+                                                     oldest_first=True):
+                    if message.author == self.user:
+                        continue
+                    result: Optional[CountResult] = self.count_message(config, message, live=False)
+                    if result is None or (result.outcome is not Outcome.CORRECT and not result.outcome.is_failure):
+                        continue
+                    page.append(result)
+                    counts += result.outcome is Outcome.CORRECT
+                    breaks += result.outcome.is_failure
+                    if len(page) >= CATCH_UP_PAGE_SIZE:
+                        full, page = page, []
+                        await self.apply_caught_up(full)
+        except discord.HTTPException:
+            logger.warning('Could not catch up with channel %d', channel.id, exc_info=True)
+        finally:
+            try:
+                # Also if reading the history failed: these counts have been decided and journaled already
+                await self.apply_caught_up(page)
+            finally:
+                # No awaits from here on, so every message posted later is counted after these
+                for message in sorted(self._held.pop(channel.id, ()), key=lambda held: held.id):
+                    self.count_message(config, message)
+        if counts or breaks:
+            CAUGHT_UP.inc(counts + breaks)
+            logger.info('Caught up with channel %d: %d count(s), %d chain break(s)', channel.id, counts, breaks)
+        return counts, breaks
+
+    async def pause_counting(self, guild_id: int) -> list[int]:
+        """
+        Holds back the new messages of a guild's counting channels, like while catching up, and waits until
+        the side effects of the messages counted so far are done. Returns the channels to pass to
+        `resume_counting`; channels that are already held back are left alone.
+        """
+        channel_ids: list[int] = [config.channel_id for config in self.config_store.for_guild(guild_id)
+                                  if config.channel_id is not None and config.channel_id not in self._held]
+        for channel_id in channel_ids:
+            self._held[channel_id] = []
+        for channel_id in channel_ids:
+            if channel_id in self._pipelines:
+                await self._pipelines[channel_id].join()
+        return channel_ids
+
+    def resume_counting(self, channel_ids: list[int]) -> None:
+        """Counts the messages held back by `pause_counting`, in order. Never awaits."""
+        for channel_id in channel_ids:
+            held: list[discord.Message] = self._held.pop(channel_id, [])
+            config: Optional[Config] = self.config_store.for_channel(channel_id)
+            if config is None:
+                continue  # No longer a counting channel
+            for message in sorted(held, key=lambda message: message.id):
+                self.count_message(config, message)
+
+    async def apply_caught_up(self, results: list[CountResult]) -> None:
+        """
+        Performs the side effects of a page of counts that were posted while the bot was offline:
+        updates the stats of all their members at once, and only reacts to mistakes and milestones.
+        """
+        if not results:
             return
-        except ZeroDivisionError:
-            zero_division = True
-
-        self._busy += 1
-
-        if self._participating_users is None:
-            self._participating_users = {message.author.id, }
-        else:
-            self._participating_users.add(message.author.id)
-
-        conn = sqlite3.connect('database.sqlite3')
-        c = conn.cursor()
-        c.execute(f'SELECT highest_valid_count FROM members WHERE member_id = {message.author.id}')
-        stats: Optional[tuple[int]] = c.fetchone()
-
-        if stats is None:
-            highest_valid_count = 0
-            c.execute(f'INSERT INTO members VALUES({message.author.id}, 0, 0, 0, 0)')
-            conn.commit()
-        else:
-            highest_valid_count = stats[0]
-
-        # -------------
-        # Wrong member
-        # -------------
-        if zero_division or (self._config.current_count and self._config.current_member_id == message.author.id):
-
-            if self.failed_role:
-                self._config.failed_member_id = message.author.id  # Designate current user as failed member
-                # Adding/removing failed role is done when not busy
-
-            await self.handle_wrong_member(message)
-
-            c.execute('UPDATE members SET score = score - 1, wrong = wrong + 1 WHERE member_id = ?',
-                      (message.author.id,))
-            conn.commit()
-            conn.close()
-
-            await self.schedule_busy_work()
+        await self.config_store.synced(results[-1].journal_seq)
+        guild_id: int = results[0].message.guild.id
+        stats_by_member: dict[int, MemberStats] = await self.member_stats.get_many(
+            guild_id, {result.message.author.id for result in results})
+        for result in results:
+            message: discord.Message = result.message
+            stats: Optional[MemberStats] = stats_by_member.get(message.author.id)
+            if stats is None:  # Counted for the first time
+                stats = stats_by_member[message.author.id] = await self.member_stats.get_or_create(
+                    guild_id, message.author.id)
+            if result.outcome is Outcome.CORRECT:
+                self.member_stats.record_correct(stats, result.number)
+            else:
+                self.member_stats.record_wrong(stats)
+
+            emoji: Optional[str] = '❌' if result.outcome.is_failure else result.emoji
+            # Reactions already there were added before a restart in the middle of catching up
+            if emoji != PLAIN_EMOJI and not any(reaction.me for reaction in message.reactions):
+                self.outbound.react(message, emoji)
+        for stats in stats_by_member.values():
+            self.reliable_trackers[guild_id].observe(stats)
+            self.leaderboards.member_changed(stats)
+        self.maintenance.poke()
+
+    async def handle_count_result(self, result: CountResult) -> None:
+        """Performs the side effects of a message whose outcome has been decided by the pipeline"""
+        message: discord.Message = result.message
+
+        if result.outcome is Outcome.SYNTAX_ERROR:
+            self.outbound.react(message, '⚠️')
+            self.outbound.alert(message.channel, 'Syntax error in mathematical expression!',
+                                {'not_broken': 'The chain has **not** been broken.'})
             return
 
-        # --------------
-        # Wrong number
-        # --------------
-        if int(number) != int(self._config.current_count) + 1:
-
-            if self.failed_role:
-                self._config.failed_member_id = message.author.id  # Designate current user as failed member
-                # Adding/removing failed role is done when not busy
-
-            await self.handle_wrong_count(message)
-
-            c.execute('UPDATE members SET score = score - 1, wrong = wrong + 1 WHERE member_id = ?',
-                      (message.author.id,))
-
-            conn.commit()
-            conn.close()
-
-            await self.schedule_busy_work()
-
+        if result.outcome is Outcome.TOO_COMPLEX:
+            self.outbound.react(message, '⚠️')
+            self.outbound.alert(message.channel, 'That expression is too complex to evaluate!',
+                                {'not_broken': 'The chain has **not** been broken.'})
             return
 
-        # --------------------
-        # Everything is fine
-        # ---------------------
-        self._config.increment(message.author.id)  # config dump triggered at the end of the method
+        # Never acknowledge a count that could be lost by a crash
+        await self.config_store.synced(result.journal_seq)
+        self.maintenance.poke()  # Roles are reconciled once counting goes quiet
 
-        await message.add_reaction(self._config.reaction_emoji())  # config dumping done at the end of the method
+        # Only hits the database if the member is not cached yet
+        start: float = time.perf_counter()
+        stats: MemberStats = await self.member_stats.get_or_create(message.guild.id, message.author.id)
+        loaded: float = time.perf_counter()
+        _DB_READ_SECONDS.observe(loaded - start)
 
-        c.execute(f'''UPDATE members SET score = score + 1,
-correct = correct + 1
-{f", highest_valid_count  = {number}" if number > highest_valid_count else ""}
-WHERE member_id = ?''',
-                  (message.author.id,))
-        conn.commit()
-        conn.close()
-
-        # Check and reset the self._config.failed_member_id to None.
-        # No need to remove the role itself, it will be done later when not busy
-        if self.failed_role and self._config.failed_member_id == message.author.id:
-            self._config.correct_inputs_by_failed_member += 1
-            if self._config.correct_inputs_by_failed_member >= 30:
-                self._config.failed_member_id = None
-                self._config.correct_inputs_by_failed_member = 0
-
-        await self.schedule_busy_work()
+        if result.outcome is Outcome.CORRECT:
+            self.member_stats.record_correct(stats, result.number)  # written to the database in the background
+        else:
+            self.member_stats.record_wrong(stats)
+        _STATS_UPDATE_SECONDS.observe(time.perf_counter() - loaded)
+        self.reliable_trackers[message.guild.id].observe(stats)  # Queues a role change if the member crossed a threshold
+        self.leaderboards.member_changed(stats)  # Drops the cached leaderboard pages this changes
 
-    async def handle_wrong_count(self, message: discord.Message) -> None:
-        """Handles when someone messes up the count with a wrong number"""
-        correct_number: int = self._config.current_count + 1
+        # Queued, never awaited: reactions are sent first, and alerts that pile up are merged
+        if result.outcome is Outcome.WRONG_MEMBER:
+            self.handle_wrong_member(result)
 
-        self._config.reset()  # config dump is triggered in on_message
+        elif result.outcome is Outcome.WRONG_NUMBER:
+            self.handle_wrong_count(result)
 
-        await message.channel.send(f'''{message.author.mention} messed up the count! \
-The correct number was {correct_number}.
-Restart from **1** and try to beat the current high score of **{self._config.high_score}**!''')
-        await message.add_reaction('❌')
+        elif result.emoji is not None:
+            self.outbound.react(message, result.emoji)
 
-    async def handle_wrong_member(self, message: discord.Message) -> None:
+    def handle_wrong_count(self, result: CountResult) -> None:
+        """Handles when someone messes up the count with a wrong number"""
+        message: discord.Message = result.message
+        self.outbound.react(message, '❌')
+        self.outbound.alert(message.channel,
+                            f'{message.author.mention} messed up the count! The correct number was {result.expected}.',
+                            {'next': f'Restart from **1** and try to beat the current high score of '
+                                     f'**{result.high_score}**!'})
+
+    def handle_wrong_member(self, result: CountResult) -> None:
         """Handles when someone messes up the count by counting twice"""
-
-        self._config.reset()  # config dump is triggered in on_message
-
-        await message.channel.send(f'''{message.author.mention} messed up the count! \
-You cannot count two numbers in a row!
-Restart from **1** and try to beat the current high score of **{self._config.high_score}**!''')
-        await message.add_reaction('❌')
-
-    async def on_message_delete(self, message: discord.Message) -> None:
+        message: discord.Message = result.message
+        self.outbound.react(message, '❌')
+        self.outbound.alert(message.channel,
+                            f'{message.author.mention} messed up the count! You cannot count two numbers in a row!',
+                            {'next': f'Restart from **1** and try to beat the current high score of '
+                                     f'**{result.high_score}**!'})
+
+    async def on_app_command_completion(self, interaction: discord.Interaction,
+                                        command: app_commands.Command) -> None:
+        started: Optional[float] = interaction.extras.get('started')
+        if started is not None:
+            COMMAND_SECONDS.labels(command.name).observe(time.perf_counter() - started)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
         """Post a message in the channel if a user deletes their input."""
 
         if not self.is_ready():
             return
-        if message.author == self.user:
+        config: Optional[Config] = self.config_store.for_channel(payload.channel_id)
+        if config is None:
             return
-        if message.channel.id != self._config.channel_id:
+
+        # Only messages that took part in counting are indexed (the bot reacted to all of them),
+        # whether or not they are still in the message cache
+        deleted: Optional[IndexedMessage] = self.message_index.pop(payload.message_id)
+        channel: Optional[discord.TextChannel] = self.get_channel(payload.channel_id)
+        if deleted is None or channel is None:
             return
 
-        # Check if the deleted message was a legal message
-        if not all(c in POSSIBLE_CHARACTERS for c in message.content):
-            # The deleted message was not a legal message.
-            # But, it is possible that this message was edited prior to deletion,
-            # and the original message could have been a legal number.
-            # If so, the bot would have reacted to it in some way (tick or cross, we don't care).
-            # So we iterate through the reactions and check if any of those had been
-            # added by this bot.
-            dont_return: bool = False
-            if message.reactions:
-                for reaction in message.reactions:
-                    if reaction.me:
-                        # We found a reaction that was posted by this bot.
-                        # => this message was a legal message in the past.
-                        # Therefore, we need to show a deletion alert.
-                        dont_return = True
-                        break
-            if not dont_return:
-                # No reactions were found under the message that were posted
-                # by this bot. So we can safely ignore the message.
-                return
-
-        await message.channel.send(
-            f'{message.author.mention} deleted their number!\n'
-            f'Please note that deleting numbers is **prohibited**, even if it has messed up the count. Repeated '
-            f'violation of this policy will force the Mods to revoke your access the counting channel permanently.\n\n'
-            f'The **NEXT** number is **{self._config.current_count + 1}**.')
-
-    async def on_message_edit(self, before: discord.Message, after: discord.Message) -> None:
+        self.event_log.record(EventKind.DELETED, payload.guild_id, payload.channel_id, payload.message_id,
+                              deleted.author_id, deleted.number, config.current_count + 1)
+        self.outbound.alert(channel, f'<@{deleted.author_id}> deleted their number!', {
+            'deleted': 'Please note that deleting numbers is **prohibited**, even if it has messed up the count. '
+                       'Repeated violation of this policy will force the Mods to revoke your access the counting '
+                       'channel permanently.',
+            'next': f'The **NEXT** number is **{config.current_count + 1}**.'})
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
         """Send a message in the channel if a user modifies their input."""
 
         if not self.is_ready():
             return
-        if before.author == self.user:
+        config: Optional[Config] = self.config_store.for_channel(payload.channel_id)
+        if config is None:
+            return
+
+        # Read from the raw data, as `payload.message` only exists in discord.py 2.5 and later
+        data: dict = payload.data
+        if 'content' not in data or 'author' not in data:
+            return  # Not a change to the content, e.g. an embed being added
+        author_id: int = int(data['author']['id'])
+        if author_id == self.user.id:
             return
-        if before.channel.id != self._config.channel_id:
+        if data.get('edited_at') is None:
+            return  # Not an edit by the author
+        content: str = data['content']
+        before: Optional[discord.Message] = payload.cached_message
+        if before is not None and before.content == content:
             return
 
-        # Check whether the original message or the edited message are
-        # legal messages. If either of those is a legal message,
-        # we need to show an alert. No need to check for reactions.
-        if not (all(c in POSSIBLE_CHARACTERS for c in before.content)
-                or all(c in POSSIBLE_CHARACTERS for c in after.content)):
+        # Show an alert if the original message took part in counting, or the edited one would have
+        if self.message_index.get(payload.message_id) is None and not is_expression(content):
+            return
+        channel: Optional[discord.abc.Messageable] = self.get_channel(payload.channel_id)
+        if channel is None:
+            return
+
+        self.event_log.record(EventKind.EDITED, payload.guild_id, payload.channel_id, payload.message_id,
+                              author_id, expected=config.current_count + 1)
+        jump_url: str = f'https://discord.com/channels/{payload.guild_id}/{payload.channel_id}/{payload.message_id}'
+        self.outbound.alert(channel, f'<@{author_id}> edited their number! {jump_url}', {
+            'edited': 'Please note that editing numbers is **prohibited**, even if it has messed up the count. '
+                      'Repeated violation of this policy will force the Mods to revoke your access the counting '
+                      'channel permanently.',
+            'next': f'The **NEXT** number is **{config.current_count + 1}**.'})
+
+    async def on_member_join(self, member: discord.Member) -> None:
+        self.member_resolver.invalidate(member.guild.id, member.id)
+
+    async def on_member_remove(self, member: discord.Member) -> None:
+        self.member_resolver.invalidate(member.guild.id, member.id)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        # Keep track of reliable role changes made by anyone, including mods
+        reliable_role: Optional[discord.Role] = self.guild_role(
+            after.guild.id, self.config_store.get(after.guild.id).reliable_counter_role_id)
+        if reliable_role and (reliable_role in before.roles) != (reliable_role in after.roles):
+            self.reliable_trackers[after.guild.id].set_holder(after.id, reliable_role in after.roles)
+
+    async def adopt_legacy_data(self) -> None:
+        """
+        Assigns the config and member stats from before multiple guilds were supported to their guild:
+        the guild of the old counting channel, or the only guild the bot is in.
+        """
+        legacy: Optional[Config] = self.config_store.legacy
+        if legacy is None:
             return
 
-        if before.content == after.content:
+        guild_id: Optional[int] = None
+        if legacy.channel_id is not None:
+            try:
+                channel = await self.fetch_channel(legacy.channel_id)
+                guild_id = channel.guild.id
+            except discord.HTTPException:
+                pass  # The channel was deleted
+        if guild_id is None:
+            guilds: list[discord.Guild] = [guild async for guild in self.fetch_guilds(limit=2)]
+            if len(guilds) == 1:
+                guild_id = guilds[0].id
+        if guild_id is None:
+            logger.warning('Could not tell which guild the old config belongs to; it is left unassigned')
             return
 
-        await after.channel.send(
-            f'{after.author.mention} edited their number! {before.jump_url}\n'
-            f'Please note that editing numbers is **prohibited**, even if it has messed up the count. Repeated '
-            f'violation of this policy will force the Mods to revoke your access the counting channel permanently.\n\n'
-            f'The **NEXT** number is **{self._config.current_count + 1}**.')
+        logger.info('Assigning the old config and member stats to guild %d', guild_id)
+        self.config_store.adopt_legacy(guild_id)
+        self.db.write('UPDATE members SET guild_id = ? WHERE guild_id = 0', (guild_id,))
+        await self.db.flush()
 
-    async def setup_hook(self) -> None:
+    async def sync_commands(self, force: bool = False) -> bool:
+        """
+        Syncs the slash commands with Discord if they have changed since the last sync, or if `force` is set.
+        Global syncs are slow and rate limited, so the hash of the synced commands is kept in the database.
+        """
+        payload: list[dict] = []
+        for command in self.tree.get_commands():
+            try:
+                payload.append(command.to_dict(self.tree))
+            except TypeError:  # discord.py before 2.4, where `to_dict` takes no tree
+                payload.append(command.to_dict())
+        digest: str = hashlib.sha256(json.dumps([self.application_id, payload], sort_keys=True).encode()).hexdigest()
+        row: Optional[tuple[str]] = await self.db.fetchone("SELECT value FROM meta WHERE key = 'command_tree_hash'")
+        if not force and row is not None and row[0] == digest:
+            return False
         await self.tree.sync()
-        conn = sqlite3.connect('database.sqlite3')
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS members (member_id INTEGER PRIMARY KEY,
-                score INTEGER, correct INTEGER, wrong INTEGER,
-                highest_valid_count INTEGER)''')
-        conn.commit()
-        conn.close()
+        self.db.write("INSERT INTO meta VALUES ('command_tree_hash', ?) ON CONFLICT(key) DO UPDATE SET value = "
+                      "excluded.value", (digest,))
+        return True
+
+    async def setup_hook(self) -> None:
+        self._startup.mark('login')
+        await self.db.start()  # Also creates the tables if they do not exist
+        self._startup.mark('database')
+        await self.config_store.load()  # Imports config.json on the first start
+        await self.adopt_legacy_data()
+        # Nothing is counted before the messages posted while offline, see `catch_up`
+        self._held = {config.channel_id: [] for config in self.config_store.configs() if config.channel_id}
+        self._startup.mark('config')
+        # Built once from the table, then kept up to date by `self.member_stats`
+        rows_by_guild: defaultdict[int, list[tuple[int, int]]] = defaultdict(list)
+        for guild_id, member_id, score in await self.db.fetchall('SELECT guild_id, member_id, score FROM members'):
+            rows_by_guild[guild_id].append((member_id, score))
+        for guild_id, rows in rows_by_guild.items():
+            self.score_indexes[guild_id].load(rows)
+        self._startup.mark('score_index')
+        # Messages counted before a restart can be detected as edited or deleted as well
+        self.message_index.load(await self.db.fetchall(
+            'SELECT message_id, member_id, kind, number FROM '
+            '(SELECT * FROM count_events ORDER BY id DESC LIMIT ?) ORDER BY id', (self.message_index.max_size,)))
+        self._startup.mark('message_index')
+        await self.member_stats.start()
+        await self.event_log.start()
+        await self.rollups.start()
+        self.maintenance.start()
+        self.role_queue.start()
+        self.outbound.start()
+        self.burst.start()
+        if METRICS_PORT:
+            self.metrics_server = MetricsServer(port=int(METRICS_PORT))
+            await self.metrics_server.start()
+        self._startup.mark('services')
+        synced: bool = await self.sync_commands()
+        self._startup.mark('command_sync' if synced else 'command_sync_skipped')
+
+    async def close(self) -> None:
+        for pipeline in self._pipelines.values():
+            await pipeline.close()  # Finish reacting to the messages that were already counted
+        await self.burst.stop()
+        await self.outbound.close()  # Send the queued reactions and alerts while still connected
+        await self.maintenance.stop()
+        await self.role_queue.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        await self.config_store.flush()
+        await self.journal.close()
+        await super().close()
+        await self.member_stats.close()  # Write back the cached stats
+        await self.event_log.close()
+        await self.rollups.close()
+        await self.db.close()  # Commit any queued writes before exiting
 
 
 bot = Bot()
@@ -474,26 +678,44 @@ async def sync(interaction: discord.Interaction):
         await interaction.response.send_message('You do not have permission to do this!')
         return
     await interaction.response.defer()
-    await bot.tree.sync()
+    await bot.sync_commands(force=True)
     await interaction.followup.send('Synced!')
 
 
-@bot.tree.command(name='set_channel', description='Sets the channel to count in')
+@bot.tree.command(name='set_channel', description='Sets a channel to count in')
 @app_commands.describe(channel='The channel to count in')
 @app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
 async def set_channel(interaction: discord.Interaction, channel: discord.TextChannel):
-    """Command to set the channel to count in"""
+    """Command to add a channel to count in, with a count of its own"""
     if not interaction.user.guild_permissions.ban_members:
         await interaction.response.send_message('You do not have permission to do this!')
         return
     await interaction.response.defer()
-    config = Config.read()
-    config.channel_id = channel.id
-    config.dump_data()
-    bot.read_config()  # Explicitly ask the bot to re-read the config
+    # Messages posted in the channel from now on are caught up after a restart
+    bot.config_store.add_channel(interaction.guild.id, channel.id, last_message_id=channel.last_message_id)
+    await bot.config_store.flush()  # Counts in the channel are journaled, which needs the channel to be saved
     await interaction.followup.send(f'Counting channel was set to {channel.mention}')
 
 
+@bot.tree.command(name='remove_channel', description='Stops counting in a channel')
+@app_commands.describe(channel='The channel to stop counting in')
+@app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
+async def remove_channel(interaction: discord.Interaction, channel: discord.TextChannel):
+    """Command to stop counting in a channel"""
+    if not interaction.user.guild_permissions.ban_members:
+        await interaction.response.send_message('You do not have permission to do this!')
+        return
+    await interaction.response.defer()
+    config: Optional[Config] = bot.config_store.for_channel(channel.id)
+    if config is None or config.guild_id != interaction.guild.id:
+        await interaction.followup.send(f'{channel.mention} is not a counting channel!')
+        return
+    bot.config_store.remove_channel(channel.id)
+    await interaction.followup.send(f'Stopped counting in {channel.mention}')
+
+
 @bot.tree.command(name='list_commands', description='Lists commands')
 @app_commands.describe(ephemeral='Whether the output should be ephemeral')
 async def list_commands(interaction: discord.Interaction, ephemeral: bool = True):
@@ -503,19 +725,25 @@ async def list_commands(interaction: discord.Interaction, ephemeral: bool = True
 **list_commands** - Lists all the slash commands
 **stats_user** - Shows the stats of a specific user
 **stats_server** - Shows the stats of the server
-**leaderboard** - Shows the leaderboard of the server''')
+**trends** - Shows how much the server counted recently, and who counted the most
+**leaderboard** - Shows the leaderboard of the server, by score, correct counts, accuracy or highest count''')
 
     if interaction.user.guild_permissions.ban_members:
         emb.description += '''\n
 __Restricted commands__ (Admin-only)
 **sync** - Syncs the slash commands to the bot
-**set_channel** - Sets the channel to count in
+**set_channel** - Sets a channel to count in. Every counting channel has its own count.
+**remove_channel** - Stops counting in a channel
 **set_failed_role** - Sets the role to give when a user fails
 **set_reliable_role** - Sets the reliable role
 **remove_failed_role** - Unsets the role to give when a user fails
 **remove_reliable_role** - Unsets the reliable role
 **force_dump** - Forcibly dump bot config data. Use only when no one is actively playing.
+**maintenance_status** - Shows when the config was last dumped and the roles last updated.
+**metrics** - Shows latency histograms and counters of the bot.
 **prune** - Remove data for users who are no longer in the server.
+**export** - Exports the member stats or count history of the server as CSV or NDJSON.
+**import** - Imports member stats or count history into the server from an exported file.
 '''
 
     await interaction.response.send_message(embed=emb, ephemeral=ephemeral)
@@ -523,6 +751,7 @@ __Restricted commands__ (Admin-only)
 
 @bot.tree.command(name='stats_user', description='Shows the user stats')
 @app_commands.describe(member='The member to get the stats for')
+@app_commands.guild_only()
 async def stats_user(interaction: discord.Interaction, member: discord.Member = None):
     """Command to show the stats of a specific user"""
     await interaction.response.defer()
@@ -532,46 +761,60 @@ async def stats_user(interaction: discord.Interaction, member: discord.Member =
 
     emb = discord.Embed(title=f'{member.display_name}\'s stats', color=discord.Color.blue())
 
-    conn = sqlite3.connect('database.sqlite3')
-    c = conn.cursor()
-
-    c.execute('SELECT * FROM members WHERE member_id = ?', (member.id,))
-    stats = c.fetchone()
+    stats: Optional[MemberStats] = await bot.member_stats.get(interaction.guild.id, member.id)
 
     if stats is None:
         await interaction.followup.send('You have never counted in this server!')
-        conn.close()
         return
 
-    c.execute(f'SELECT COUNT(member_id) FROM members WHERE score >= {stats[1]}')
-    position = c.fetchone()[0]
-    conn.close()
+    score_index: ScoreIndex = bot.score_indexes[interaction.guild.id]
+    position: int = score_index.rank(member.id)
+    nearby: str = ''
+    for _, member_id, score in score_index.nearby(member.id):
+        line: str = f'#{score_index.rank(member_id)} <@{member_id}> {score}'
+        nearby += f'**{line}**\n' if member_id == member.id else f'{line}\n'
 
     emb.description = f'''{member.mention}\'s stats:\n
-**Score:** {stats[1]} (#{position})
-**✅Correct:** {stats[2]}
-**❌Wrong:** {stats[3]}
-**Highest valid count:** {stats[4]}\n
-**Accuracy:** {(stats[2] / (stats[2] + stats[3])) * 100:.2f}%'''
+**Score:** {stats.score} (#{position})
+**✅Correct:** {stats.correct}
+**❌Wrong:** {stats.wrong}
+**Highest valid count:** {stats.highest_valid_count}\n
+**Accuracy:** {stats.accuracy:.2f}%\n
+**Nearby:**
+{nearby}'''
 
     await interaction.followup.send(embed=emb)
 
 
 @bot.tree.command(name="stats_server", description="View server counting stats")
+@app_commands.guild_only()
 async def stats_server(interaction: discord.Interaction):
     """Command to show the stats of the server"""
     await interaction.response.defer()
 
-    # Use the bot's config variable, do not re-read file as it may not have been updated yet
-    config: Config = bot._config
+    # Use the bot's configs of this guild, do not re-read file as they may not have been updated yet
+    configs: list[Config] = [config for config in bot.config_store.for_guild(interaction.guild.id)
+                             if config.channel_id is not None]
 
-    if config.channel_id is None:  # channel not set yet
+    if not configs:  # channel not set yet
         await interaction.followup.send("Counting channel not set yet!")
         return
 
-    server_stats_embed = discord.Embed(description=f'''**Current Count**: {config.current_count}
+    # One read of the hourly buckets of the last week
+    await bot.rollups.sync()
+    now: int = int(time.time())
+    week: list[tuple[int, int, int]] = await bot.rollups.series(interaction.guild.id, now - 7 * DAY, HOUR)
+    today: list[tuple[int, int, int]] = [bucket for bucket in week if bucket[0] >= now - DAY]
+
+    channels: str = '\n\n'.join(f'''<#{config.channel_id}>
+**Current Count**: {config.current_count}
 High Score: {config.high_score}
-{f"Last counted by: <@{config.current_member_id}>" if config.current_member_id else ""}''',
+{f"Last counted by: <@{config.current_member_id}>" if config.current_member_id else ""}'''.rstrip()
+                                  for config in configs)
+    server_stats_embed = discord.Embed(description=f'''{channels}
+
+Last 24 hours: {sum(b[1] for b in today)} counts, {sum(b[2] for b in today)} chain breaks
+Last 7 days: {sum(b[1] for b in week)} counts, {sum(b[2] for b in week)} chain breaks''',
         color=discord.Color.blurple()
     )
     server_stats_embed.set_author(name=interaction.guild, icon_url=interaction.guild.icon)
@@ -579,39 +822,69 @@ High Score: {config.high_score}
     await interaction.followup.send(embed=server_stats_embed)
 
 
-@bot.tree.command(name='leaderboard', description='Shows the first 10 users with the highest score')
-async def leaderboard(interaction: discord.Interaction):
-    """Command to show the top 10 users with the highest score in Indently"""
-    await interaction.response.defer()
+TRENDS_WINDOWS: dict[str, int] = {'hour': HOUR, 'day': DAY, 'week': 7 * DAY, 'month': 30 * DAY}
 
-    emb = discord.Embed(title='Top 10 users in Indently',
-                        color=discord.Color.blue(), description='')
 
-    conn = sqlite3.connect('database.sqlite3')
-    c = conn.cursor()
-    c.execute('SELECT member_id, score FROM members ORDER BY score DESC LIMIT 10')
-    users = c.fetchall()
+@bot.tree.command(name='trends', description='Shows how much the server counted recently')
+@app_commands.describe(window='How far back to look')
+@app_commands.guild_only()
+async def trends(interaction: discord.Interaction, window: Literal['hour', 'day', 'week', 'month'] = 'week'):
+    """Command to show the counting activity of the server over a time window, from the rollup tables"""
+    await interaction.response.defer()
+    guild_id: int = interaction.guild.id
+
+    await bot.rollups.sync()
+    until: int = int(time.time())
+    since: int = until - TRENDS_WINDOWS[window]
+    resolution: int = resolution_for(TRENDS_WINDOWS[window])
+    series: list[tuple[int, int, int]] = await bot.rollups.series(guild_id, since, resolution)
+    counters: list[tuple[int, int, int]] = await bot.rollups.top_members(guild_id, since, resolution)
+    streaks: list[tuple[int, int, int]] = await bot.rollups.top_streaks(guild_id)
+
+    correct: int = sum(bucket[1] for bucket in series)
+    breaks: int = sum(bucket[2] for bucket in series)
+    emb = discord.Embed(title=f'Counting trends in {interaction.guild.name}, last {window}',
+                        color=discord.Color.blurple())
+    emb.description = f'''**Correct counts:** {correct}
+**Chain breaks:** {breaks}{f" (one every {correct / breaks:.1f} counts)" if breaks else ""}
+`{sparkline(series, since, until)}`'''
+    if series:
+        busiest: tuple[int, int, int] = max(series, key=lambda bucket: bucket[1])
+        unit: str = {MINUTE: 'minute', HOUR: 'hour', DAY: 'day'}[resolution]
+        emb.description += f'\n**Busiest {unit}:** <t:{busiest[0]}:f> ({busiest[1]} counts)'
+    emb.add_field(name='Most active counters', inline=True, value='\n'.join(
+        f'{i}. <@{member_id}> {count} ({member_breaks} breaks)'
+        for i, (member_id, count, member_breaks) in enumerate(counters, 1)) or 'Nobody')
+    emb.add_field(name='Longest streaks', inline=True, value='\n'.join(
+        f'{i}. <@{member_id}> {best} (now {current})'
+        for i, (member_id, best, current) in enumerate(streaks, 1)) or 'Nobody')
+    await interaction.followup.send(embed=emb)
+
 
-    for i, user in enumerate(users, 1):
-        user_obj = await interaction.guild.fetch_member(user[0])
-        emb.description += f'{i}. {user_obj.mention} **{user[1]}**\n'
-    conn.close()
+@bot.tree.command(name='leaderboard', description='Shows the users with the highest score, 10 per page')
+@app_commands.describe(by='What to rank the users by')
+@app_commands.guild_only()
+async def leaderboard(interaction: discord.Interaction,
+                      by: Literal['score', 'correct', 'accuracy', 'highest_valid_count'] = 'score'):
+    """Command to show the users of the server with the highest score (or other stat), with buttons to page through"""
+    await interaction.response.defer()
 
-    await interaction.followup.send(embed=emb)
+    view: LeaderboardView = LeaderboardView(bot.leaderboards, interaction.user.id, by)
+    page: Page
+    view.number, page = await bot.leaderboards.page(interaction.guild, by, 0)  # Usually cached
+    view.message = await interaction.followup.send(embed=view.embed(interaction.guild, page), view=view, wait=True)
 
 
 @bot.tree.command(name='set_failed_role',
                   description='Sets the role to be used when a user fails to count')
 @app_commands.describe(role='The role to be used when a user fails to count')
 @app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
 async def set_failed_role(interaction: discord.Interaction, role: discord.Role):
     """Command to set the role to be used when a user fails to count"""
     await interaction.response.defer()
-    config = Config.read()
-    config.failed_role_id = role.id
-    config.dump_data()
-    bot.read_config()  # Explicitly ask the bot to re-read the config
-    bot.set_roles()  # Ask the bot to re-load the roles
+    bot.config_store.update(interaction.guild.id, failed_role_id=role.id)
+    bot.roles_changed(interaction.guild.id)  # Ask the bot to re-load the roles of this guild
     await interaction.followup.send(f'Failed role was set to {role.mention}.')
 
 
@@ -619,40 +892,33 @@ async def set_failed_role(interaction: discord.Interaction, role: discord.Role):
                   description='Sets the role to be used when a user gets 100 of score')
 @app_commands.describe(role='The role to be used when a user fails to count')
 @app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
 async def set_reliable_role(interaction: discord.Interaction, role: discord.Role):
     """Command to set the role to be used when a user gets 100 of score"""
     await interaction.response.defer()
-    config = Config.read()
-    config.reliable_counter_role_id = role.id
-    config.dump_data()
-    bot.read_config()  # Explicitly ask the bot to re-read the config
-    bot.set_roles()  # Ask the bot to re-load the roles
+    bot.config_store.update(interaction.guild.id, reliable_counter_role_id=role.id)
+    bot.roles_changed(interaction.guild.id)  # Ask the bot to re-load the roles of this guild
     await interaction.followup.send(f'Reliable role was set to {role.mention}.')
 
 
 @bot.tree.command(name='remove_failed_role', description='Removes the failed role feature')
 @app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
 async def remove_failed_role(interaction: discord.Interaction):
     await interaction.response.defer()
-    config = Config.read()
-    config.failed_role_id = None
-    config.failed_member_id = None
-    config.correct_inputs_by_failed_member = 0
-    config.dump_data()
-    bot.read_config()  # Explicitly ask the bot to re-read the config
-    bot.set_roles()  # Ask the bot to re-load the roles
+    bot.config_store.update(interaction.guild.id, failed_role_id=None, failed_member_id=None,
+                            correct_inputs_by_failed_member=0)
+    bot.roles_changed(interaction.guild.id)  # Ask the bot to re-load the roles of this guild
     await interaction.followup.send('Failed role removed.')
 
 
 @bot.tree.command(name='remove_reliable_role', description='Removes the reliable role feature')
 @app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
 async def remove_reliable_role(interaction: discord.Interaction):
     await interaction.response.defer()
-    config = Config.read()
-    config.reliable_counter_role_id = None
-    config.dump_data()
-    bot.read_config()  # Explicitly ask the bot to re-read the config
-    bot.set_roles()  # Ask the bot to re-load the roles
+    bot.config_store.update(interaction.guild.id, reliable_counter_role_id=None)
+    bot.roles_changed(interaction.guild.id)  # Ask the bot to re-load the roles of this guild
     await interaction.followup.send('Reliable role removed.')
 
 
@@ -669,44 +935,163 @@ async def disconnect(interaction: discord.Interaction):
 @app_commands.default_permissions(ban_members=True)
 async def force_dump(interaction: discord.Interaction):
     await interaction.response.defer()
-    bot._busy = 0
-    await bot.do_busy_work()
-    emb = discord.Embed(description=f'✅ Configuration data successfully dumped.', colour=discord.Colour.og_blurple())
+    await bot.maintenance.run_now()
+    config_metrics: dict = bot.config_store.metrics()
+    emb = discord.Embed(description=f'✅ Configuration data successfully dumped.\n\n'
+                                    f'**Writes:** {config_metrics["writes"]} writing {config_metrics["rows"]} '
+                                    f'row(s) for {config_metrics["changes"]} change(s) '
+                                    f'({config_metrics["coalesced"]} coalesced)\n'
+                                    f'**Last write:** {config_metrics["last_write_ms"]} ms',
+                        colour=discord.Colour.og_blurple())
     await interaction.followup.send(embed=emb)
 
 
-@bot.tree.command(name='prune', description='(DANGER) Deletes data of users who are no longer in the server')
+@bot.tree.command(name='maintenance_status', description='Shows the state of the background maintenance')
 @app_commands.default_permissions(ban_members=True)
-async def prune(interaction: discord.Interaction):
-    await interaction.response.defer()
-
-    conn: sqlite3.Connection = sqlite3.connect('database.sqlite3')
-    cursor: sqlite3.Cursor = conn.cursor()
+async def maintenance_status(interaction: discord.Interaction):
+    state: dict = bot.maintenance.state()
+    role_metrics: dict = bot.role_queue.metrics()
+    last_run: str = f'<t:{int(state["last_run"])}:R> ({state["last_reason"]}, {state["last_duration_ms"]} ms)' \
+        if state['last_run'] else 'Never'
+    emb = discord.Embed(title='Maintenance', colour=discord.Colour.og_blurple(), description=f'''\
+**Status:** {"Pending for " + str(state["pending_for"]) + "s" if state["pending"] else "Idle"}
+**Last activity:** {f'{state["idle_for"]}s ago' if state["idle_for"] is not None else 'None'}
+**Last run:** {last_run}
+**Runs:** {state["runs"]} ({state["deadline_runs"]} forced by the {bot.maintenance.max_delay:.0f}s deadline)
+**Configs dirty:** {bot.config_store.metrics()["dirty"]}
+**Role changes:** {role_metrics["applied"]} applied, {role_metrics["skipped"] + role_metrics["coalesced"]} avoided, \
+{role_metrics["failed"]} failed, {role_metrics["pending"]} pending''')
+    await interaction.response.send_message(embed=emb, ephemeral=True)
+
+
+@bot.tree.command(name='metrics', description='Shows latency histograms and counters of the bot')
+@app_commands.default_permissions(ban_members=True)
+async def metrics(interaction: discord.Interaction):
+    lines: list[str] = REGISTRY.summary()
+    text: str = ''
+    for line in lines:
+        if len(text) + len(line) > 3900:  # Embed descriptions are limited to 4096 characters
+            text += '…\n'
+            break
+        text += line + '\n'
+    emb = discord.Embed(title='Metrics', colour=discord.Colour.og_blurple(),
+                        description=f'```\n{text or "Nothing recorded yet"}```')
+    if METRICS_PORT:
+        emb.set_footer(text=f'Prometheus format on http://127.0.0.1:{METRICS_PORT}/metrics')
+    await interaction.response.send_message(embed=emb, ephemeral=True)
 
-    cursor.execute('SELECT member_id FROM members')
-    result: Optional[list[tuple[int]]] = cursor.fetchall()
 
-    if result:
-        count: int = 0
+@bot.tree.command(name='prune', description='(DANGER) Deletes data of users who are no longer in the server')
+@app_commands.describe(dry_run='Only count the users whose data would be deleted')
+@app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
+async def prune(interaction: discord.Interaction, dry_run: bool = False):
+    await interaction.response.defer()
+    guild: discord.Guild = interaction.guild
+
+    if not guild.chunked:
+        await guild.chunk()  # Members missing from the cache must not be mistaken for departed ones
+    present: set[int] = {member.id for member in guild.members}
+
+    bot.member_stats.flush()  # Members who only exist in the cache yet must be considered as well
+    await bot.db.flush()
+
+    scanned: int = 0
+    departed: list[int] = []
+    last_progress: float = time.monotonic()
+    async for rows in bot.db.stream('SELECT member_id FROM members WHERE guild_id = ?', (guild.id,),
+                                    chunk_size=PRUNE_CHUNK_SIZE):
+        scanned += len(rows)
+        departed.extend({row[0] for row in rows} - present)
+        if time.monotonic() - last_progress >= 2:  # Long runs show their progress
+            last_progress = time.monotonic()
+            await interaction.edit_original_response(
+                content=f'Scanned {scanned} user(s), {len(departed)} no longer in the server…')
+
+    if not scanned:
+        await interaction.edit_original_response(content='No users found in the database.')
+        return
+    if not departed:
+        await interaction.edit_original_response(content='No users met the criteria to be removed.')
+        return
+    if dry_run:
+        await interaction.edit_original_response(
+            content=f'Dry run: data for {len(departed)} of {scanned} user(s) would be removed.')
+        return
 
-        for res in result:
-            user_id: int = res[0]
+    # One statement per chunk of IDs, all in the same transaction
+    bot.db.write_many('DELETE FROM members WHERE guild_id = ? AND member_id IN (SELECT value FROM json_each(?))',
+                      [(guild.id, json.dumps(departed[i:i + PRUNE_CHUNK_SIZE]))
+                       for i in range(0, len(departed), PRUNE_CHUNK_SIZE)])
+    for table in ('member_streaks', 'member_rollups'):
+        bot.db.write_many(f'DELETE FROM {table} WHERE guild_id = ? AND member_id IN (SELECT value FROM json_each(?))',
+                          [(guild.id, json.dumps(departed[i:i + PRUNE_CHUNK_SIZE]))
+                           for i in range(0, len(departed), PRUNE_CHUNK_SIZE)])
+    bot.member_stats.discard(guild.id, departed)
+    bot.leaderboards.invalidate(guild.id)
+    await bot.db.flush()
+    logger.info('Pruned data for %d of %d user(s) in guild %d', len(departed), scanned, guild.id)
+    await interaction.edit_original_response(content=f'Successfully removed data for {len(departed)} user(s).')
+
+
+@bot.tree.command(name='export', description='Exports the member stats or count history of this server')
+@app_commands.describe(table='The data to export', file_format='The file format')
+@app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
+async def export(interaction: discord.Interaction, table: Literal['members', 'count_events'],
+                 file_format: Literal['csv', 'ndjson'] = 'csv'):
+    await interaction.response.defer()
+    bot.member_stats.flush()  # Include the stats that are only cached yet
+    bot.event_log.flush()
+    await bot.db.flush()
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path: str = os.path.join(EXPORT_DIR, f'{table}_{interaction.guild.id}_{int(time.time())}.{file_format}')
+    count: int = await export_table(bot.db, table, path, file_format, guild_id=interaction.guild.id)
+    if os.path.getsize(path) > interaction.guild.filesize_limit:
+        await interaction.followup.send(f'Exported {count} row(s), but the file is too large to attach. '
+                                        f'It was saved as `{path}` on the bot\'s host.')
+        return
+    try:
+        await interaction.followup.send(f'Exported {count} row(s).', file=discord.File(path))
+    finally:
+        os.remove(path)
 
-            if interaction.guild.get_member(user_id) is None:
-                cursor.execute(f'DELETE FROM members WHERE member_id = {user_id}')
-                count += 1
-                print(f'Removed data for user {user_id}.')
 
-        if count > 0:
-            conn.commit()
-            await interaction.followup.send(f'Successfully removed data for {count} user(s).')
-        else:
-            await interaction.followup.send('No users met the criteria to be removed.')
+@bot.tree.command(name='import', description='(DANGER) Imports member stats or count history into this server')
+@app_commands.describe(table='The data to import', file='A file made by /export, or by `main.py export`')
+@app_commands.default_permissions(ban_members=True)
+@app_commands.guild_only()
+async def import_(interaction: discord.Interaction, table: Literal['members', 'count_events'],
+                  file: discord.Attachment):
+    await interaction.response.defer()
+    guild_id: int = interaction.guild.id
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path: str = os.path.join(EXPORT_DIR, f'import_{guild_id}_{int(time.time())}_{os.path.basename(file.filename)}')
+    await file.save(path)
 
-    else:
-        await interaction.followup.send('No users found in the database.')
+    # Counts made during the import would update stats that are discarded afterwards, so they wait
+    paused: list[int] = await bot.pause_counting(guild_id) if table == 'members' else []
+    try:
+        bot.member_stats.flush()  # Imported stats replace the current ones, so those must be in the table first
+        try:
+            count, changed = await import_table(bot.db, table, path, guild_id=guild_id)
+        except (ValueError, UnicodeDecodeError) as exc:
+            await interaction.followup.send(f'Nothing was imported, the file is not a valid export: {exc}')
+            return
+        finally:
+            os.remove(path)
 
-    conn.close()
+        if table == 'members':
+            bot.member_stats.discard_guild(guild_id)  # Reloaded from the table when needed
+            bot.score_indexes[guild_id].load(await bot.db.fetchall(
+                'SELECT member_id, score FROM members WHERE guild_id = ?', (guild_id,)))
+            bot.leaderboards.invalidate(guild_id)
+            bot.roles_changed(guild_id)
+    finally:
+        bot.resume_counting(paused)
+    skipped: str = f' {count - changed} row(s) were already there and were skipped.' if count > changed else ''
+    await interaction.followup.send(f'Imported {changed} of {count} row(s).{skipped}')
 
 
 @bot.tree.command(name='calc', description='Evaluate a mathematical expression')
@@ -716,14 +1101,14 @@ async def calc(interaction: discord.Interaction, expression: str) -> None:
 
     emb: discord.Embed = discord.Embed(description='')
 
-    if not all(c in POSSIBLE_CHARACTERS for c in expression) or not any(char.isdigit() for char in expression):
+    if not is_expression(expression):
         emb.description = f'**Expression:** `{expression}`\n\n❌ Invalid mathematical expression!'
         emb.colour = discord.Colour.brand_red()
         await interaction.followup.send(embed=emb)
         return
 
     try:
-        number: int = round(eval(expression))
+        number: int = evaluate(expression)
         emb.description = f'**Expression:** `{expression}`\n\n**Result:** `{number}`'
         emb.colour = discord.Colour.brand_green()
         await interaction.followup.send(embed=emb)
@@ -737,6 +1122,48 @@ async def calc(interaction: discord.Interaction, expression: str) -> None:
         emb.colour = discord.Colour.brand_red()
         await interaction.followup.send(embed=emb)
         return
+    except ExpressionTooComplex:
+        emb.description = f'**Expression:** `{expression}`\n\n❌ Expression is too complex to evaluate!'
+        emb.colour = discord.Colour.brand_red()
+        await interaction.followup.send(embed=emb)
+        return
+
+async def transfer(args: argparse.Namespace) -> None:
+    """Runs `main.py export` or `main.py import` against the database, without connecting to Discord"""
+    db: Database = Database('database.sqlite3')
+    await db.start()
+    try:
+        if args.command == 'export':
+            count: int = await export_table(db, args.table, args.path, args.format, guild_id=args.guild)
+            print(f'Exported {count} row(s) of {args.table} to {args.path}')
+        else:
+            count, changed = await import_table(db, args.table, args.path, args.format, guild_id=args.guild)
+            print(f'Imported {changed} of {count} row(s) of {args.table} from {args.path}, '
+                  f'skipped {count - changed} that were already there')
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Counting Discord bot. Runs the bot unless a command is given.')
+    commands_parser = parser.add_subparsers(dest='command')
+    for command, help_text in (('export', 'Write a table to a CSV or NDJSON file, in chunks'),
+                               ('import', 'Insert the rows of an exported file, in a single transaction. '
+                                          'Stop the bot first, or use /import instead.')):
+        command_parser = commands_parser.add_parser(command, help=help_text)
+        command_parser.add_argument('table', choices=TABLES)
+        command_parser.add_argument('path')
+        command_parser.add_argument('--format', choices=FORMATS, help='Defaults to CSV for .csv files, else NDJSON')
+        command_parser.add_argument('--guild', type=int,
+                                    help='Only export this guild / assign every imported row to this guild')
+    args = parser.parse_args()
+
+    if args.command is None:
+        bot.run(TOKEN, root_logger=True)
+    else:
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(transfer(args))
+
 
 if __name__ == '__main__':
-    bot.run(TOKEN)
+    main()
@@ -0,0 +1,101 @@
+"""Background scheduling of the bot's maintenance work"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class MaintenanceScheduler:
+    """
+    A single long-lived task that runs `work` once counting has gone quiet.
+
+    Every counted message calls `poke()`. The work runs `idle_delay` seconds after the last poke,
+    but never later than `max_delay` seconds after the first poke since the previous run, so an
+    endless burst of messages cannot postpone it forever.
+    """
+
+    def __init__(self, work: Callable[[], Awaitable[None]], idle_delay: float = 5.0, max_delay: float = 60.0) -> None:
+        self._work: Callable[[], Awaitable[None]] = work
+        self.idle_delay: float = idle_delay
+        self.max_delay: float = max_delay
+        self._event: asyncio.Event = asyncio.Event()
+        self._lock: asyncio.Lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_activity: float = 0.0
+        self._pending_since: Optional[float] = None
+        self.pokes: int = 0
+        self.runs: int = 0
+        self.deadline_runs: int = 0
+        self.last_run: Optional[float] = None  # time.time() of the end of the last run
+        self.last_reason: Optional[str] = None
+        self.last_duration: float = 0.0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run_loop(), name='maintenance')
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def poke(self) -> None:
+        """Record counting activity. Never awaits."""
+        self.pokes += 1
+        self._last_activity = time.monotonic()
+        if self._pending_since is None:
+            self._pending_since = self._last_activity
+        self._event.set()
+
+    async def run_now(self, reason: str = 'forced') -> None:
+        """Run the work immediately, regardless of activity."""
+        self._pending_since = None
+        await self._run(reason)
+
+    async def _run_loop(self) -> None:
+        while True:
+            await self._event.wait()
+            self._event.clear()
+
+            while self._pending_since is not None:
+                now: float = time.monotonic()
+                idle_at: float = self._last_activity + self.idle_delay
+                deadline: float = self._pending_since + self.max_delay
+                if now >= idle_at or now >= deadline:
+                    reason: str = 'idle' if now >= idle_at else 'deadline'
+                    self._pending_since = None
+                    await self._run(reason)
+                    break
+                await asyncio.sleep(min(idle_at, deadline) - now)
+
+    async def _run(self, reason: str) -> None:
+        async with self._lock:
+            start: float = time.monotonic()
+            try:
+                await self._work()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception('Maintenance work failed')
+            self.last_duration = time.monotonic() - start
+            self.last_run = time.time()
+            self.last_reason = reason
+            self.runs += 1
+            if reason == 'deadline':
+                self.deadline_runs += 1
+                logger.info('Maintenance ran at its deadline after %.0fs of continuous activity', self.max_delay)
+
+    def state(self) -> dict[str, Any]:
+        """The current scheduler state, for display in admin commands"""
+        now: float = time.monotonic()
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'pending': self._pending_since is not None,
+            'pending_for': round(now - self._pending_since, 1) if self._pending_since is not None else None,
+            'idle_for': round(now - self._last_activity, 1) if self.pokes else None,
+            'pokes': self.pokes,
+            'runs': self.runs,
+            'deadline_runs': self.deadline_runs,
+            'last_run': self.last_run,
+            'last_reason': self.last_reason,
+            'last_duration_ms': round(self.last_duration * 1000, 2),
+        }
@@ -0,0 +1,110 @@
+"""Resolution of member IDs to `discord.Member` objects with as few API calls as possible"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import discord
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+QUERY_CHUNK_SIZE: int = 100  # Maximum number of user IDs per gateway member request
+
+
+class MemberResolver:
+    """
+    Resolves member IDs of a guild in three steps:
+
+    1. The gateway member cache of the guild.
+    2. A TTL'd LRU of members resolved earlier. Members who have left the server are remembered
+       as `None` for a shorter time.
+    3. Batched member requests over the gateway, with concurrent REST fetches as a fallback,
+       at most `max_concurrency` requests in flight.
+    """
+
+    def __init__(self, max_size: int = 2048, ttl: float = 300.0, departed_ttl: float = 60.0,
+                 max_concurrency: int = 5) -> None:
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.departed_ttl: float = departed_ttl
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        # (guild_id, member_id) -> (expiry as time.monotonic(), member or None if departed)
+        self._cache: OrderedDict[tuple[int, int], tuple[float, Optional[discord.Member]]] = OrderedDict()
+
+    async def resolve(self, guild: discord.Guild, member_id: int) -> Optional[discord.Member]:
+        """Resolve a single member, returning `None` if they are no longer in the guild."""
+        return (await self.resolve_many(guild, (member_id,)))[member_id]
+
+    async def resolve_many(self, guild: discord.Guild,
+                           member_ids: Iterable[int]) -> dict[int, Optional[discord.Member]]:
+        """Resolve several members at once. Members no longer in the guild map to `None`."""
+        result: dict[int, Optional[discord.Member]] = {}
+        missing: list[int] = []
+        now: float = time.monotonic()
+
+        for member_id in member_ids:
+            member: Optional[discord.Member] = guild.get_member(member_id)
+            if member is not None:
+                result[member_id] = member
+                continue
+
+            cached = self._cache.get((guild.id, member_id))
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end((guild.id, member_id))
+                result[member_id] = cached[1]
+            else:
+                missing.append(member_id)
+
+        if missing:
+            result.update(await self._fetch(guild, missing))
+        return result
+
+    def invalidate(self, guild_id: int, member_id: int) -> None:
+        """Forget a cached member, e.g. after they have joined or left."""
+        self._cache.pop((guild_id, member_id), None)
+
+    def _store(self, guild_id: int, member_id: int, member: Optional[discord.Member]) -> None:
+        ttl: float = self.ttl if member is not None else self.departed_ttl
+        self._cache[(guild_id, member_id)] = (time.monotonic() + ttl, member)
+        self._cache.move_to_end((guild_id, member_id))
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, guild: discord.Guild, member_ids: list[int]) -> dict[int, Optional[discord.Member]]:
+        chunks: list[list[int]] = [member_ids[i:i + QUERY_CHUNK_SIZE]
+                                   for i in range(0, len(member_ids), QUERY_CHUNK_SIZE)]
+        try:
+            results: list[list[discord.Member]] = await asyncio.gather(
+                *(self._query_chunk(guild, chunk) for chunk in chunks))
+        except (asyncio.TimeoutError, discord.ClientException):
+            # Gateway member requests are unavailable, fall back to REST
+            return await self._fetch_rest(guild, member_ids)
+
+        found: dict[int, discord.Member] = {member.id: member for members in results for member in members}
+        resolved: dict[int, Optional[discord.Member]] = {}
+        for member_id in member_ids:
+            # A member that was asked for but not returned is not in the guild anymore
+            resolved[member_id] = found.get(member_id)
+            self._store(guild.id, member_id, resolved[member_id])
+        return resolved
+
+    async def _query_chunk(self, guild: discord.Guild, member_ids: list[int]) -> list[discord.Member]:
+        async with self._semaphore:
+            return await guild.query_members(user_ids=member_ids, limit=len(member_ids), cache=True)
+
+    async def _fetch_rest(self, guild: discord.Guild, member_ids: list[int]) -> dict[int, Optional[discord.Member]]:
+        async def fetch(member_id: int) -> Optional[discord.Member]:
+            async with self._semaphore:
+                try:
+                    member: Optional[discord.Member] = await guild.fetch_member(member_id)
+                except discord.NotFound:
+                    member = None
+                except discord.HTTPException:
+                    logger.warning('Could not fetch member %d of guild %d', member_id, guild.id, exc_info=True)
+                    return None  # Unknown, so not cached
+            self._store(guild.id, member_id, member)
+            return member
+
+        members: list[Optional[discord.Member]] = await asyncio.gather(*(fetch(m) for m in member_ids))
+        return dict(zip(member_ids, members))
@@ -0,0 +1,227 @@
+"""Write-behind in-memory cache of the `members` table"""
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from typing import Iterable, Optional
+
+from database import Database
+from ranking import ScoreIndex
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MemberStats:
+    """Counting stats of a member in a guild, mirroring a row of the `members` table"""
+    guild_id: int
+    member_id: int
+    score: int = 0
+    correct: int = 0
+    wrong: int = 0
+    highest_valid_count: int = 0
+
+    @property
+    def accuracy(self) -> float:
+        """Percentage of correct inputs"""
+        total: int = self.correct + self.wrong
+        return (self.correct / total) * 100 if total else 0.0
+
+
+Key = tuple[int, int]  # (guild_id, member_id)
+
+UPSERT_SQL: str = '''INSERT INTO members VALUES(?, ?, ?, ?, ?, ?)
+ON CONFLICT(guild_id, member_id) DO UPDATE SET score = excluded.score, correct = excluded.correct,
+wrong = excluded.wrong, highest_valid_count = excluded.highest_valid_count'''
+
+
+class MemberStatsCache:
+    """
+    Keeps the stats of recently active members in memory, per guild.
+
+    Members are loaded from the database the first time they are needed. Updates only touch
+    memory and mark the member as dirty; dirty members are written back in bulk every
+    `flush_interval` seconds and when the cache is closed. Once more than `max_members` are
+    cached, the least recently used members whose changes are all committed are evicted.
+    Every score change is also applied to the guild's index in `score_indexes` (a `defaultdict(ScoreIndex)`), if given.
+    """
+
+    def __init__(self, db: Database, score_indexes: Optional[dict[int, ScoreIndex]] = None,
+                 max_members: int = 10_000, flush_interval: float = 10.0) -> None:
+        self._db: Database = db
+        self._score_indexes: Optional[dict[int, ScoreIndex]] = score_indexes
+        self.max_members: int = max_members
+        self.flush_interval: float = flush_interval
+        self._members: OrderedDict[Key, MemberStats] = OrderedDict()
+        self._dirty: set[Key] = set()
+        self._saving: dict[Key, asyncio.Future] = {}  # Members whose last flush is not committed yet
+        self._loading: dict[Key, asyncio.Future] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._flusher = asyncio.create_task(self._flush_loop(), name='member-stats-flusher')
+
+    async def close(self) -> None:
+        """Stop the periodic flush and write back everything that is still dirty."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+        await self._db.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Queue one bulk upsert for all dirty members."""
+        if not self._dirty:
+            return
+        keys: set[Key] = self._dirty
+        self._dirty = set()
+        statements: list[tuple[str, tuple[int, int, int, int, int, int]]] = []
+        for key in keys:
+            stats: Optional[MemberStats] = self._members.get(key)
+            if stats is not None:
+                statements.append((UPSERT_SQL, (stats.guild_id, stats.member_id, stats.score, stats.correct,
+                                                stats.wrong, stats.highest_valid_count)))
+        future: asyncio.Future = self._db.write_atomic(statements)
+        for key in keys:
+            self._saving[key] = future
+        future.add_done_callback(partial(self._flush_done, keys))
+        logger.debug('Flushed stats of %d member(s)', len(statements))
+
+    def _flush_done(self, keys: set[Key], future: asyncio.Future) -> None:
+        for key in keys:
+            if self._saving.get(key) is future:
+                del self._saving[key]
+        if future.cancelled() or future.exception() is not None:
+            # Already logged by the database. The members are still cached, so they are written next time.
+            self._dirty.update(key for key in keys if key in self._members)
+        self._evict()
+
+    def _evict(self) -> None:
+        # Least recently used members come first. Members whose changes are not committed yet are kept,
+        # or loading them again would read their old row; they go to the end, so the next call does not
+        # look at them again. Every member is looked at most once, in case all of them are kept.
+        if len(self._members) <= self.max_members:
+            return
+        for _ in range(len(self._members)):
+            key, stats = self._members.popitem(last=False)
+            if key in self._dirty or key in self._saving:
+                self._members[key] = stats
+            elif len(self._members) <= self.max_members:
+                return
+
+    def _store(self, stats: MemberStats) -> None:
+        key: Key = (stats.guild_id, stats.member_id)
+        self._members[key] = stats
+        self._members.move_to_end(key)
+        self._dirty.add(key)
+        if self._score_indexes is not None:
+            self._score_indexes[stats.guild_id].update(stats.member_id, stats.score)
+
+    # -----------
+    # Lookups
+    # -----------
+    async def get(self, guild_id: int, member_id: int) -> Optional[MemberStats]:
+        """Get the stats of a member, or `None` if they have never counted in the guild."""
+        key: Key = (guild_id, member_id)
+        stats: Optional[MemberStats] = self._members.get(key)
+        if stats is not None:
+            self._members.move_to_end(key)
+            return stats
+
+        if key in self._loading:
+            # Another coroutine is already loading this member
+            return await asyncio.shield(self._loading[key])
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            row: Optional[tuple] = await self._db.fetchone(
+                'SELECT * FROM members WHERE guild_id = ? AND member_id = ?', key)
+            # The member may have been created while the query was running
+            stats = self._members.get(key)
+            if stats is None and row is not None:
+                stats = MemberStats(*row)
+                self._members[key] = stats
+                self._evict()
+            future.set_result(stats)
+            return stats
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._loading[key]
+
+    async def get_or_create(self, guild_id: int, member_id: int) -> MemberStats:
+        """Get the stats of a member, creating them if the member has never counted in the guild."""
+        stats: Optional[MemberStats] = await self.get(guild_id, member_id)
+        if stats is None:
+            stats = self._members.get((guild_id, member_id))  # Created by someone else while loading
+        if stats is None:
+            stats = MemberStats(guild_id, member_id)
+            self._store(stats)
+        return stats
+
+    async def get_many(self, guild_id: int, member_ids: Iterable[int]) -> dict[int, MemberStats]:
+        """Get the stats of several members of a guild, loading all missing ones with a single query."""
+        keys: set[Key] = {(guild_id, member_id) for member_id in member_ids}
+        missing: list[int] = [k[1] for k in keys if k not in self._members and k not in self._loading]
+        if missing:
+            placeholders: str = ', '.join('?' * len(missing))
+            rows: list[tuple] = await self._db.fetchall(
+                f'SELECT * FROM members WHERE guild_id = ? AND member_id IN ({placeholders})', (guild_id, *missing))
+            for row in rows:
+                if (row[0], row[1]) not in self._members:
+                    self._members[(row[0], row[1])] = MemberStats(*row)
+            self._evict()
+        result: dict[int, MemberStats] = {}
+        for key in keys:
+            stats: Optional[MemberStats] = self._members.get(key)
+            if stats is None and key in self._loading:
+                stats = await self.get(*key)
+            if stats is not None:
+                result[key[1]] = stats
+        return result
+
+    def discard_guild(self, guild_id: int) -> None:
+        """Forget every cached member of a guild, e.g. because their rows were replaced. Flush first."""
+        self.discard(guild_id, [member_id for (g, member_id) in self._members if g == guild_id])
+
+    def discard(self, guild_id: int, member_ids: Iterable[int]) -> None:
+        """Forget members whose rows were deleted from the database."""
+        for member_id in member_ids:
+            self._members.pop((guild_id, member_id), None)
+            self._dirty.discard((guild_id, member_id))
+            if self._score_indexes is not None and guild_id in self._score_indexes:
+                self._score_indexes[guild_id].remove(member_id)
+
+    # -----------
+    # Updates
+    # -----------
+    def record_correct(self, stats: MemberStats, number: int) -> None:
+        """Record a correct count by the member."""
+        stats.score += 1
+        stats.correct += 1
+        stats.highest_valid_count = max(stats.highest_valid_count, number)
+        self._store(stats)
+
+    def record_wrong(self, stats: MemberStats) -> None:
+        """Record a wrong count by the member."""
+        stats.score -= 1
+        stats.wrong += 1
+        self._store(stats)
+
+    @property
+    def size(self) -> int:
+        return len(self._members)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty)
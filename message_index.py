@@ -0,0 +1,56 @@
+"""Bounded index of the messages that took part in counting"""
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Optional
+
+from events import OUTCOME_KINDS, EventKind
+from pipeline import CountResult
+
+
+class IndexedMessage(NamedTuple):
+    """What the bot decided about a counting message"""
+    author_id: int
+    number: Optional[int]
+    kind: EventKind
+
+
+class MessageIndex:
+    """
+    Remembers the last `max_size` messages that the counting pipeline decided on, by message ID.
+
+    Lets raw delete and edit events tell whether a message counted with an O(1) lookup, whether or
+    not discord.py still has the message in its cache. Filled by the counting path, and at startup
+    from the event log, so it also covers messages posted before a restart.
+    """
+
+    def __init__(self, max_size: int = 50_000) -> None:
+        self.max_size: int = max_size
+        self._messages: OrderedDict[int, IndexedMessage] = OrderedDict()
+
+    def add(self, result: CountResult) -> None:
+        """Index a message whose outcome has been decided. Never awaits."""
+        self._put(result.message.id, IndexedMessage(result.message.author.id, result.number,
+                                                     OUTCOME_KINDS[result.outcome]))
+
+    def _put(self, message_id: int, entry: IndexedMessage) -> None:
+        self._messages[message_id] = entry
+        if len(self._messages) > self.max_size:
+            self._messages.popitem(last=False)  # Oldest first
+
+    def load(self, events: Iterable[tuple[int, int, int, object]]) -> None:
+        """Replay `(message_id, member_id, kind, number)` events from the event log, oldest first."""
+        for message_id, member_id, kind, number in events:
+            if kind == EventKind.DELETED:
+                self._messages.pop(message_id, None)
+            elif kind != EventKind.EDITED:
+                self._put(message_id, IndexedMessage(member_id, int(number) if number is not None else None,
+                                                     EventKind(kind)))
+
+    def get(self, message_id: int) -> Optional[IndexedMessage]:
+        return self._messages.get(message_id)
+
+    def pop(self, message_id: int) -> Optional[IndexedMessage]:
+        """Forget a message, e.g. because it was deleted, and return what was known about it."""
+        return self._messages.pop(message_id, None)
+
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -0,0 +1,239 @@
+"""In-process counters and latency histograms, exposed in the Prometheus text format"""
+import logging
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Optional, Union
+
+from aiohttp import web
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from 10 µs (evaluating a number) to 10 s (a slow Discord API call)
+DEFAULT_BUCKETS: tuple[float, ...] = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                                      0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """A value that only goes up"""
+
+    def __init__(self) -> None:
+        self.value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """Counts observations per bucket. Observing is a binary search and three additions."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket that holds the `q` quantile; `inf` if it is past the last bucket."""
+        if not self.count:
+            return 0.0
+        rank: float = q * self.count
+        cumulative: int = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+Metric = Union[Counter, Histogram]
+
+
+class Family:
+    """A named metric, with one child per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, kind: str, label_names: tuple[str, ...],
+                 factory: Callable[[], Metric]) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.kind: str = kind
+        self.label_names: tuple[str, ...] = label_names
+        self._factory: Callable[[], Metric] = factory
+        self.children: dict[tuple[str, ...], Metric] = {}
+
+    def labels(self, *values: Any) -> Metric:
+        """The child for these label values. Hot paths should look it up once and keep it."""
+        key: tuple[str, ...] = tuple(str(value) for value in values)
+        child: Optional[Metric] = self.children.get(key)
+        if child is None:
+            if len(key) != len(self.label_names):
+                raise ValueError(f'{self.name} expects labels {self.label_names}, got {key}')
+            child = self.children[key] = self._factory()
+        return child
+
+
+class Registry:
+    """
+    All metrics of the process.
+
+    Recording only updates numbers in memory; nothing is formatted until `render` is called by
+    a scrape or a command, so metrics cost next to nothing when nobody is looking. Gauges are
+    callbacks that are only evaluated when rendering.
+    """
+
+    def __init__(self) -> None:
+        self._families: dict[str, Family] = {}
+        self._gauges: dict[str, tuple[str, str, Callable[[], Union[float, dict[Any, float]]]]] = {}
+
+    def _family(self, name: str, documentation: str, kind: str, label_names: tuple[str, ...],
+                factory: Callable[[], Metric]) -> Family:
+        family: Optional[Family] = self._families.get(name)
+        if family is None:
+            family = self._families[name] = Family(name, documentation, kind, label_names, factory)
+        elif family.kind != kind or family.label_names != label_names:
+            raise ValueError(f'Metric {name} is already registered differently')
+        return family
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Family:
+        """Get or create a counter family. Modules declare the metrics they record at import time."""
+        return self._family(name, documentation, 'counter', label_names, Counter)
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Family:
+        """Get or create a histogram family."""
+        return self._family(name, documentation, 'histogram', label_names, lambda: Histogram(buckets))
+
+    def gauge(self, name: str, documentation: str, func: Callable[[], Union[float, dict[Any, float]]],
+              label_name: str = 'key') -> None:
+        """
+        Register a gauge whose value is read from `func` when rendering.
+        `func` may return a mapping of the values of the label `label_name` to values.
+        """
+        self._gauges[name] = (documentation, label_name, func)
+
+    def families(self) -> list[Family]:
+        return list(self._families.values())
+
+    def gauges(self) -> dict[str, Union[float, dict[Any, float]]]:
+        """The current value of every gauge"""
+        values: dict[str, Union[float, dict[Any, float]]] = {}
+        for name, (_, _, func) in self._gauges.items():
+            try:
+                values[name] = func()
+            except Exception:
+                logger.exception('Failed to read gauge %s', name)
+        return values
+
+    def render(self) -> str:
+        """Everything, in the Prometheus text exposition format"""
+        lines: list[str] = []
+        for family in self._families.values():
+            lines.append(f'# HELP {family.name} {family.documentation}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for values, child in family.children.items():
+                labels: list[str] = [f'{name}="{_escape(value)}"' for name, value in zip(family.label_names, values)]
+                if isinstance(child, Counter):
+                    lines.append(f'{family.name}{_labels(labels)} {child.value}')
+                    continue
+                cumulative: int = 0
+                for bound, count in zip((*child.buckets, math.inf), child.counts):
+                    cumulative += count
+                    le: str = 'le="+Inf"' if bound == math.inf else f'le="{bound!r}"'
+                    lines.append(f'{family.name}_bucket{_labels([*labels, le])} {cumulative}')
+                lines.append(f'{family.name}_sum{_labels(labels)} {child.sum}')
+                lines.append(f'{family.name}_count{_labels(labels)} {child.count}')
+
+        for name, value in self.gauges().items():
+            documentation, label_name, _ = self._gauges[name]
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} gauge')
+            if isinstance(value, dict):
+                lines.extend(f'{name}{{{label_name}="{_escape(str(key))}"}} {v}' for key, v in value.items())
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> list[str]:
+        """One short line per metric child and gauge, for humans"""
+        lines: list[str] = []
+        for family in self._families.values():
+            for values, child in sorted(family.children.items()):
+                name: str = f'{family.name}{{{",".join(values)}}}' if values else family.name
+                if isinstance(child, Counter):
+                    lines.append(f'{name} {child.value:g}')
+                elif child.count:
+                    lines.append(f'{name} n={child.count} avg={_ms(child.sum / child.count)} '
+                                 f'p50<={_ms(child.quantile(0.5))} p99<={_ms(child.quantile(0.99))}')
+        for name, value in self.gauges().items():
+            if isinstance(value, dict):
+                lines.extend(f'{name}{{{key}}} {v:g}' for key, v in value.items())
+            else:
+                lines.append(f'{name} {value:g}')
+        return lines
+
+
+def _ms(seconds: float) -> str:
+    return f'{seconds * 1000:.3g}ms'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: list[str]) -> str:
+    return f'{{{",".join(labels)}}}' if labels else ''
+
+
+REGISTRY: Registry = Registry()
+
+
+class PhaseTimer:
+    """Times consecutive phases of a process, such as startup, and records them in `registry`"""
+
+    def __init__(self, name: str, registry: Registry = REGISTRY) -> None:
+        self._histogram: Family = registry.histogram(f'{name}_phase_seconds', f'Duration of each {name} phase',
+                                                     ('phase',))
+        self._last: float = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        """End the current phase, which is called `phase`, and start the next one."""
+        now: float = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._histogram.labels(phase).observe(now - self._last)
+        self._last = now
+
+    def __str__(self) -> str:
+        return ', '.join(f'{phase} {seconds * 1000:.0f} ms' for phase, seconds in self.phases)
+
+
+class MetricsServer:
+    """Serves `registry.render()` at /metrics. Binds to localhost unless told otherwise."""
+
+    def __init__(self, registry: Registry = REGISTRY, host: str = '127.0.0.1', port: int = 9108) -> None:
+        self.registry: Registry = registry
+        self.host: str = host
+        self.port: int = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app: web.Application = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info('Serving metrics on http://%s:%d/metrics', self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
@@ -0,0 +1,204 @@
+"""Bounded, prioritized queue of the messages and reactions the bot sends"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import discord
+
+from metrics import REGISTRY, Family, Metric
+from pipeline import STAGE_SECONDS
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+OUTBOUND_SENT: Family = REGISTRY.counter('outbound_sent_total', 'Reactions and alerts sent, by kind', ('kind',))
+OUTBOUND_DROPPED: Family = REGISTRY.counter('outbound_dropped_total',
+                                            'Reactions and alerts dropped because the queue was full, by kind',
+                                            ('kind',))
+OUTBOUND_FAILED: Family = REGISTRY.counter('outbound_failed_total', 'Reactions and alerts Discord rejected, by kind',
+                                           ('kind',))
+OUTBOUND_COALESCED: Metric = REGISTRY.counter('outbound_coalesced_alerts_total',
+                                              'Alerts merged into a summary instead of being sent on their own').labels()
+OUTBOUND_WAIT_SECONDS: Family = REGISTRY.histogram('outbound_wait_seconds',
+                                                   'Time from being queued until sent, by kind', ('kind',))
+_STAGES: dict[str, Metric] = {'reaction': STAGE_SECONDS.labels('reaction'),
+                              'alert': STAGE_SECONDS.labels('announcement')}
+
+MESSAGE_LIMIT: int = 2000  # Characters Discord allows in a message
+
+
+@dataclass
+class _PendingAlerts:
+    """The alerts queued for one channel during its current window"""
+    channel: discord.abc.Messageable
+    due: float
+    queued_at: float
+    lines: list[str] = field(default_factory=list)
+    footers: dict[str, str] = field(default_factory=dict)  # The latest footer of each kind
+
+    def render(self) -> str:
+        footer: str = '\n\n'.join(self.footers.values())
+        if len(self.lines) == 1:
+            return '\n'.join(filter(None, (self.lines[0], footer)))[:MESSAGE_LIMIT]
+        budget: int = MESSAGE_LIMIT - len(footer) - len('\n…and 9999 more\n\n')
+        shown: int = 0
+        for line in self.lines:
+            budget -= len(line) + 1
+            if budget < 0:
+                break
+            shown += 1
+        content: str = '\n'.join(self.lines[:shown])
+        if shown < len(self.lines):
+            content += f'\n…and {len(self.lines) - shown} more'
+        return '\n\n'.join(filter(None, (content, footer)))[:MESSAGE_LIMIT]
+
+
+class OutboundQueue:
+    """
+    Sends reactions and channel alerts in the background, so that the counting path never awaits Discord.
+
+    Reactions go first: they are what members watch while counting, but an alert that has been due for
+    another `window` seconds is sent before them, so alerts are never held back for long. Alerts about the same channel that
+    are queued within `window` seconds of the first one are merged into one message, which lists one
+    line per alert followed by the latest footer of each kind, so a pile-up of broken chains or
+    deleted numbers costs one message instead of one per offender. At most `max_concurrency` calls
+    are in flight; discord.py waits out the rate limits. When more than `max_reactions` reactions are
+    waiting, the oldest ones are dropped, and alerts past `max_alert_lines` per window are dropped.
+    """
+
+    def __init__(self, window: float = 2.0, max_concurrency: int = 4, max_reactions: int = 1000,
+                 max_alert_lines: int = 50) -> None:
+        self.window: float = window
+        self.max_reactions: int = max_reactions
+        self.max_alert_lines: int = max_alert_lines
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self._reactions: deque[tuple[discord.Message, str, float]] = deque()
+        self._alerts: dict[int, _PendingAlerts] = {}  # By channel ID, in the order they are due
+        self._in_flight: int = 0
+        self._tasks: set[asyncio.Task] = set()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._idle: asyncio.Event = asyncio.Event()
+        self._idle.set()
+        self._closing: bool = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name='outbound-queue')
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Send what is still queued right away, without waiting for alert windows, then stop."""
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('Gave up on %d queued reaction(s) and alert(s) while closing', self.pending)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def react(self, message: discord.Message, emoji: str) -> None:
+        """Queue a reaction to a message. Never awaits."""
+        if len(self._reactions) >= self.max_reactions:
+            self._reactions.popleft()  # The newest counts are the ones members are looking at
+            OUTBOUND_DROPPED.labels('reaction').inc()
+        self._reactions.append((message, emoji, time.perf_counter()))
+        self._queued()
+
+    def alert(self, channel: discord.abc.Messageable, line: str, footers: dict[str, str]) -> None:
+        """
+        Queue an alert. Sent on its own as `line` followed by `footers`, or merged with the other alerts
+        queued for the channel within the window. A footer replaces the earlier footer of the same kind,
+        e.g. the number to continue from. Never awaits.
+        """
+        now: float = time.perf_counter()
+        pending: Optional[_PendingAlerts] = self._alerts.get(channel.id)
+        if pending is None:
+            pending = self._alerts[channel.id] = _PendingAlerts(channel, now + self.window, now)
+        elif len(pending.lines) >= self.max_alert_lines:
+            OUTBOUND_DROPPED.labels('alert').inc()
+            return
+        else:
+            OUTBOUND_COALESCED.inc()
+        pending.lines.append(line)
+        for kind, footer in footers.items():
+            pending.footers.pop(kind, None)  # Keeps the footers in the order they were last queued
+            pending.footers[kind] = footer
+        self._queued()
+
+    def _queued(self) -> None:
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def join(self) -> None:
+        """Wait until everything queued so far has been sent (or has failed)."""
+        await self._idle.wait()
+
+    @property
+    def pending(self) -> int:
+        return len(self._reactions) + len(self._alerts) + self._in_flight
+
+    def _next_delay(self) -> Optional[float]:
+        """Seconds until something can be sent, or `None` if nothing is queued"""
+        if self._reactions:
+            return 0.0
+        if self._alerts:
+            if self._closing:
+                return 0.0
+            return max(0.0, next(iter(self._alerts.values())).due - time.perf_counter())
+        return None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            delay: Optional[float] = self._next_delay()
+            if delay is None:
+                if not self._in_flight:
+                    self._idle.set()
+                await self._wakeup.wait()
+                continue
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)  # A reaction may come first
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._semaphore.acquire()
+            self._in_flight += 1
+            task: asyncio.Task
+            head: Optional[_PendingAlerts] = next(iter(self._alerts.values()), None)
+            overdue: bool = head is not None and (self._closing or time.perf_counter() >= head.due + self.window)
+            if self._reactions and not overdue:
+                message, emoji, queued_at = self._reactions.popleft()
+                task = asyncio.create_task(self._send('reaction', queued_at, message.add_reaction(emoji)))
+            else:
+                channel_id: int = next(iter(self._alerts))
+                alerts: _PendingAlerts = self._alerts.pop(channel_id)
+                task = asyncio.create_task(self._send('alert', alerts.queued_at, alerts.channel.send(alerts.render())))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, kind: str, queued_at: float, call: Any) -> None:
+        start: float = time.perf_counter()
+        OUTBOUND_WAIT_SECONDS.labels(kind).observe(start - queued_at)
+        try:
+            await call
+            OUTBOUND_SENT.labels(kind).inc()
+        except discord.HTTPException:
+            OUTBOUND_FAILED.labels(kind).inc()
+            logger.warning('Could not send a queued %s', kind, exc_info=True)
+        finally:
+            _STAGES[kind].observe(time.perf_counter() - start)
+            self._in_flight -= 1
+            self._semaphore.release()
+            self._wakeup.set()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            'reactions': len(self._reactions),
+            'alerts': sum(len(alerts.lines) for alerts in self._alerts.values()),
+            'in_flight': self._in_flight,
+        }
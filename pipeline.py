@@ -0,0 +1,173 @@
+"""Ordered processing of the messages posted in a counting channel"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Awaitable, Callable, Optional
+
+import discord
+
+from evaluator import ExpressionTooComplex, evaluate, is_expression
+from metrics import REGISTRY, Family, Metric
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+STAGE_SECONDS: Family = REGISTRY.histogram('counting_stage_seconds',
+                                           'Time spent in each stage of handling a counting message', ('stage',))
+MESSAGES: Family = REGISTRY.counter('counting_messages_total', 'Messages posted in counting channels, by outcome',
+                                    ('outcome',))
+_FILTER_SECONDS: Metric = STAGE_SECONDS.labels('filter')
+_EVAL_SECONDS: Metric = STAGE_SECONDS.labels('eval')
+_IGNORED: Metric = MESSAGES.labels('ignored')
+
+
+class Outcome(Enum):
+    """What a counting message did to the count"""
+    CORRECT = 'correct'
+    WRONG_NUMBER = 'wrong_number'
+    WRONG_MEMBER = 'wrong_member'
+    SYNTAX_ERROR = 'syntax_error'
+    TOO_COMPLEX = 'too_complex'
+
+    @property
+    def is_failure(self) -> bool:
+        """Whether this outcome broke the chain"""
+        return self in (Outcome.WRONG_NUMBER, Outcome.WRONG_MEMBER)
+
+
+_OUTCOMES: dict[Outcome, Metric] = {outcome: MESSAGES.labels(outcome.value) for outcome in Outcome}
+
+
+@dataclass
+class CountResult:
+    """The decision taken for one message, together with everything its side effects need"""
+    message: discord.Message
+    outcome: Outcome
+    number: Optional[int] = None
+    expected: int = 0  # The number that was expected when the message was processed
+    high_score: int = 0
+    emoji: Optional[str] = None  # The reaction to add for a correct count
+    journal_seq: int = 0  # The journal entry of the state change, if any
+
+
+def decide(config: Any, message: discord.Message) -> Optional[CountResult]:
+    """
+    Decide whether a message is a correct count and update the counting state accordingly.
+
+    This never awaits, so the decision and the state change happen in one atomic step.
+    Returns `None` if the message does not take part in counting.
+    """
+    content: str = message.content
+    start: float = time.perf_counter()
+    if not is_expression(content):
+        _FILTER_SECONDS.observe(time.perf_counter() - start)
+        return None
+    filtered: float = time.perf_counter()
+    _FILTER_SECONDS.observe(filtered - start)
+    config.last_message_id = message.id
+
+    try:
+        number: Optional[int] = evaluate(content)
+    except SyntaxError:
+        return CountResult(message, Outcome.SYNTAX_ERROR)
+    except ExpressionTooComplex:
+        return CountResult(message, Outcome.TOO_COMPLEX)
+    except ZeroDivisionError:
+        number = None
+    finally:
+        _EVAL_SECONDS.observe(time.perf_counter() - filtered)
+
+    author_id: int = message.author.id
+    expected: int = config.current_count + 1
+
+    if number is None or (config.current_count and config.current_member_id == author_id):
+        outcome: Outcome = Outcome.WRONG_MEMBER
+    elif number != expected:
+        outcome = Outcome.WRONG_NUMBER
+    else:
+        outcome = Outcome.CORRECT
+
+    if outcome is not Outcome.CORRECT:
+        if config.failed_role_id is not None:
+            config.failed_member_id = author_id  # Designate current user as failed member
+            # Adding/removing failed role is done when not busy
+        config.reset()
+        return CountResult(message, outcome, number, expected, config.high_score)
+
+    config.increment(author_id)
+    emoji: str = config.reaction_emoji()
+
+    # Check and reset the config.failed_member_id to None.
+    # No need to remove the role itself, it will be done later when not busy
+    if config.failed_role_id is not None and config.failed_member_id == author_id:
+        config.correct_inputs_by_failed_member += 1
+        if config.correct_inputs_by_failed_member >= 30:
+            config.failed_member_id = None
+            config.correct_inputs_by_failed_member = 0
+
+    return CountResult(message, outcome, number, expected, config.high_score, emoji)
+
+
+class CountPipeline:
+    """
+    Processes the messages of one counting channel in two stages.
+
+    `submit` decides every message synchronously in arrival order, so concurrent messages can
+    never interleave or both be credited for the same number. The results are then handed to
+    `handler`, which performs the side effects (reactions, announcements, stats) concurrently,
+    with at most `max_concurrency` of them in flight.
+    """
+
+    def __init__(self, handler: Callable[[CountResult], Awaitable[None]], max_concurrency: int = 16) -> None:
+        self._handler: Callable[[CountResult], Awaitable[None]] = handler
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self._queue: asyncio.Queue[CountResult] = asyncio.Queue()
+        self._tasks: set[asyncio.Task] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+    def submit(self, config: Any, message: discord.Message, handle: bool = True) -> Optional[CountResult]:
+        """
+        Decide the outcome of a message and queue its side effects, unless `handle` is false because
+        the caller performs them itself. Never awaits.
+        """
+        result: Optional[CountResult] = decide(config, message)
+        (_IGNORED if result is None else _OUTCOMES[result.outcome]).inc()
+        if result is not None and handle:
+            if self._worker is None:
+                self._worker = asyncio.create_task(self._run(), name='count-pipeline')
+            self._queue.put_nowait(result)
+        return result
+
+    async def _run(self) -> None:
+        while True:
+            result: CountResult = await self._queue.get()
+            await self._semaphore.acquire()
+            task: asyncio.Task = asyncio.create_task(self._handle(result))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, result: CountResult) -> None:
+        try:
+            await self._handler(result)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception('Failed to handle %s message %d', result.outcome.value, result.message.id)
+        finally:
+            self._semaphore.release()
+            self._queue.task_done()
+
+    async def join(self) -> None:
+        """Wait until the side effects of every submitted message have completed."""
+        await self._queue.join()
+
+    async def close(self) -> None:
+        """Finish the pending side effects and stop the worker."""
+        await self.join()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    @property
+    def pending(self) -> int:
+        """Number of messages whose side effects have not completed yet"""
+        return self._queue.qsize() + len(self._tasks)
@@ -0,0 +1,161 @@
+"""In-memory order statistics over member scores"""
+from bisect import bisect_left, insort
+from typing import Iterable, Optional
+
+
+class ScoreIndex:
+    """
+    Answers ranking queries over the scores of all members in logarithmic time.
+
+    A Fenwick tree counts members per score, so the number of members at or above a score and
+    the score at a given position can be found in O(log range). Members with the same score are
+    kept in sorted buckets, ordered by member ID, which breaks ties when listing neighbours.
+    Scores only ever change by small steps, so the tree is rebuilt (doubling its range) on the
+    rare occasion that a score falls outside of it.
+    """
+
+    def __init__(self) -> None:
+        self._scores: dict[int, int] = {}  # member_id -> score
+        self._buckets: dict[int, list[int]] = {}  # score -> sorted member IDs
+        self._offset: int = 0  # Lowest score covered by the tree
+        self._tree: list[int] = [0] * 65  # 1-based Fenwick tree
+        self._total: int = 0
+
+    def __len__(self) -> int:
+        return self._total
+
+    def load(self, rows: Iterable[tuple[int, int]]) -> None:
+        """Replace the index contents with `(member_id, score)` rows."""
+        self._scores = {member_id: score or 0 for member_id, score in rows}
+        self._buckets = {}
+        for member_id, score in self._scores.items():
+            self._buckets.setdefault(score, []).append(member_id)
+        for bucket in self._buckets.values():
+            bucket.sort()
+        self._rebuild()
+
+    # ---------
+    # Updates
+    # ---------
+    def update(self, member_id: int, score: int) -> None:
+        """Set the score of a member, adding the member if needed."""
+        old: Optional[int] = self._scores.get(member_id)
+        if old == score:
+            return
+        if old is not None:
+            self._remove_from_bucket(member_id, old)
+            self._add(old, -1)
+        self._scores[member_id] = score
+        insort(self._buckets.setdefault(score, []), member_id)
+        if not self._offset <= score < self._offset + len(self._tree) - 1:
+            self._rebuild()  # Also counts the new score
+        else:
+            self._add(score, 1)
+
+    def remove(self, member_id: int) -> None:
+        """Remove a member from the index."""
+        score: Optional[int] = self._scores.pop(member_id, None)
+        if score is not None:
+            self._remove_from_bucket(member_id, score)
+            self._add(score, -1)
+
+    def _remove_from_bucket(self, member_id: int, score: int) -> None:
+        bucket: list[int] = self._buckets[score]
+        del bucket[bisect_left(bucket, member_id)]
+        if not bucket:
+            del self._buckets[score]
+
+    # ---------
+    # Queries
+    # ---------
+    def score(self, member_id: int) -> Optional[int]:
+        return self._scores.get(member_id)
+
+    def count_at_least(self, score: int) -> int:
+        """Number of members whose score is `score` or higher."""
+        return self._total - self._prefix(score - 1)
+
+    def rank(self, member_id: int) -> Optional[int]:
+        """
+        Position of a member on the leaderboard, counting every member whose score is at least as
+        high (so members with equal scores share the lowest of their positions).
+        """
+        score: Optional[int] = self._scores.get(member_id)
+        return None if score is None else self.count_at_least(score)
+
+    def position(self, member_id: int) -> Optional[int]:
+        """Exact 1-based position of a member, ordered by score (descending), then by member ID."""
+        score: Optional[int] = self._scores.get(member_id)
+        if score is None:
+            return None
+        return self.count_at_least(score + 1) + bisect_left(self._buckets[score], member_id) + 1
+
+    def at_position(self, position: int) -> tuple[int, int]:
+        """`(member_id, score)` of the member at an exact 1-based position."""
+        if not 1 <= position <= self._total:
+            raise IndexError(position)
+        # The position counted from the lowest score
+        target: int = self._total - position + 1
+        index: int = 0
+        remaining: int = target
+        step: int = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt: int = index + step
+            if nxt < len(self._tree) and self._tree[nxt] < remaining:
+                index = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        score: int = index + self._offset  # Tree node `index + 1` holds the score
+        bucket: list[int] = self._buckets[score]
+        # `remaining` counts upwards from the bottom of the bucket, which is its highest member ID
+        return bucket[len(bucket) - remaining], score
+
+    def nearby(self, member_id: int, distance: int = 2) -> list[tuple[int, int, int]]:
+        """
+        The members directly above and below a member on the leaderboard, including the member,
+        as `(position, member_id, score)` tuples.
+        """
+        position: Optional[int] = self.position(member_id)
+        if position is None:
+            return []
+        return [(p, *self.at_position(p))
+                for p in range(max(1, position - distance), min(self._total, position + distance) + 1)]
+
+    # ---------
+    # Fenwick tree
+    # ---------
+    def _add(self, score: int, delta: int) -> None:
+        self._total += delta
+        i: int = score - self._offset + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, score: int) -> int:
+        """Number of members whose score is `score` or lower."""
+        i: int = min(score - self._offset + 1, len(self._tree) - 1)
+        count: int = 0
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count
+
+    def _rebuild(self) -> None:
+        low: int = min(self._buckets, default=0)
+        high: int = max(self._buckets, default=0)
+        size: int = len(self._tree) - 1
+        while size < (high - low + 1) * 2:
+            size *= 2
+        # Leave room on both sides, as scores can go up and down
+        self._offset = low - (size - (high - low + 1)) // 2
+        self._tree = [0] * (size + 1)
+        self._total = 0
+        for score, bucket in self._buckets.items():
+            i: int = score - self._offset + 1
+            self._tree[i] += len(bucket)
+            self._total += len(bucket)
+        # Turn the per-score counts into a Fenwick tree in O(size)
+        for i in range(1, size + 1):
+            parent: int = i + (i & -i)
+            if parent <= size:
+                self._tree[parent] += self._tree[i]
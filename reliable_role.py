@@ -0,0 +1,90 @@
+"""Incremental tracking of who should hold the reliable counter role"""
+from typing import Iterable, Optional
+
+from member_stats import MemberStats
+
+MIN_ACCURACY: int = 99  # Percent, after rounding to two decimals
+MIN_NET_CORRECT: int = 100  # correct - wrong
+
+
+def is_reliable(stats: MemberStats) -> bool:
+    """
+    Criteria for getting the reliable role:
+    1. Accuracy must be >= 99%, rounded to two decimals. (Accuracy = correct / (correct + wrong))
+    2. Must have at least 100 more correct than wrong inputs.
+    """
+    if stats.correct - stats.wrong < MIN_NET_CORRECT:
+        return False
+    # Integer version of `round(accuracy, 2) >= 99.00`, i.e. accuracy >= 98.995%
+    return stats.correct * 100_000 >= (MIN_ACCURACY * 1000 - 5) * (stats.correct + stats.wrong)
+
+
+class ReliableRoleTracker:
+    """
+    Knows which members currently hold the reliable role and which members should.
+
+    `observe` is called after every change to a member's stats and is O(1). A member is only
+    queued for a role change when their eligibility differs from whether they hold the role,
+    so role API calls are made for actual transitions only. Until the holders are known (see
+    `reset`), every observed member is kept, and compared with the holders once they are.
+    A transition that Discord refused is not queued again until the next `reset`.
+    """
+
+    def __init__(self) -> None:
+        self._holders: Optional[set[int]] = None  # Unknown until the first reset
+        self._pending: dict[int, bool] = {}  # member_id -> whether they should hold the role
+        self._refused: dict[int, bool] = {}  # member_id -> the transition the bot is not allowed to make
+
+    def reset(self, holder_ids: Iterable[int]) -> None:
+        """
+        Start over from the members who hold the role right now, e.g. after the role has changed.
+        Pending changes that are still needed for the new holders are kept.
+        """
+        holders: set[int] = set(holder_ids)
+        self._holders = holders
+        self._pending = {member_id: eligible for member_id, eligible in self._pending.items()
+                         if eligible != (member_id in holders)}
+        self._refused = {}
+
+    def forget_holders(self) -> None:
+        """Stop trusting the known holders, e.g. because the role has changed, until the next `reset`."""
+        self._holders = None
+
+    def observe(self, stats: MemberStats) -> None:
+        """Check whether a change to a member's stats crossed the eligibility threshold."""
+        eligible: bool = is_reliable(stats)
+        if self._refused.get(stats.member_id) == eligible:
+            return
+        if self._holders is None or eligible != (stats.member_id in self._holders):
+            self._pending[stats.member_id] = eligible
+        else:
+            self._pending.pop(stats.member_id, None)
+
+    def set_holder(self, member_id: int, holds_role: bool) -> None:
+        """Record that a member has gained or lost the role."""
+        if self._holders is not None:
+            if holds_role:
+                self._holders.add(member_id)
+            else:
+                self._holders.discard(member_id)
+        self._pending.pop(member_id, None)
+        self._refused.pop(member_id, None)
+
+    def change_failed(self, member_id: int, holds_role: bool) -> None:
+        """Record that giving (`holds_role=True`) or taking the role failed, so that it is tried again."""
+        if self._holders is None or holds_role != (member_id in self._holders):
+            self._pending.setdefault(member_id, holds_role)  # A newer transition takes precedence
+
+    def change_refused(self, member_id: int, holds_role: bool) -> None:
+        """Record that the bot is not allowed to give (`holds_role=True`) or take the role from a member."""
+        self._refused[member_id] = holds_role
+
+    def take_transitions(self) -> dict[int, bool]:
+        """Return and forget the pending role changes, as member_id -> whether to add the role."""
+        transitions: dict[int, bool] = self._pending
+        self._pending = {}
+        return transitions
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,135 @@
+"""Coalescing, concurrency-limited execution of role changes"""
+import asyncio
+import logging
+from typing import Any, Callable, Optional
+
+import discord
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+Callback = Callable[[bool, Optional[discord.HTTPException]], None]
+
+
+class RoleMutationQueue:
+    """
+    Applies role changes to members in the background.
+
+    Changes are keyed by (member, role) and only the last requested state of each key is kept,
+    so adding and then removing a role before the change is applied costs nothing. A change is
+    skipped if the member already is in the requested state. At most `max_concurrency` changes
+    are in flight; discord.py already waits out per-route rate limits, and transient failures
+    (server errors, rate limits that reach us) are retried with exponential backoff.
+    The optional callback of a change is called with whether the member ended up in the requested
+    state and the API error that stopped it, if any (`discord.Forbidden` is never retried); a change
+    that is replaced by a later request for the same key never calls it.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_retries: int = 3, retry_delay: float = 1.0) -> None:
+        self.max_retries: int = max_retries
+        self.retry_delay: float = retry_delay
+        self._semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+        self._desired: dict[tuple[int, int], tuple[discord.Member, discord.Role, bool, Optional[Callback]]] = {}
+        self._in_flight: set[tuple[int, int]] = set()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._idle: asyncio.Event = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+        self.requested: int = 0
+        self.coalesced: int = 0
+        self.applied: int = 0
+        self.skipped: int = 0
+        self.failed: int = 0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name='role-queue')
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def set_role(self, member: discord.Member, role: discord.Role, present: bool,
+                 on_done: Optional[Callback] = None) -> None:
+        """
+        Request that `member` has (`present=True`) or does not have `role`, and call `on_done` with
+        whether that worked once the change is done. Never awaits.
+        """
+        key: tuple[int, int] = (member.id, role.id)
+        self.requested += 1
+        if key in self._desired:
+            self.coalesced += 1
+        self._desired[key] = (member, role, present, on_done)
+        self._idle.clear()
+        self._wakeup.set()
+
+    async def join(self) -> None:
+        """Wait until every requested change has been applied (or has failed)."""
+        await self._idle.wait()
+
+    @property
+    def pending(self) -> int:
+        return len(self._desired) + len(self._in_flight)
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # A key that is still being applied stays queued until that finishes
+            for key in [key for key in self._desired if key not in self._in_flight]:
+                await self._semaphore.acquire()
+                member, role, present, on_done = self._desired.pop(key)
+                self._in_flight.add(key)
+                asyncio.create_task(self._apply(key, member, role, present, on_done))
+
+    async def _apply(self, key: tuple[int, int], member: discord.Member, role: discord.Role, present: bool,
+                     on_done: Optional[Callback]) -> None:
+        done: bool = False
+        error: Optional[discord.HTTPException] = None
+        try:
+            # Prefer the cached member, which reflects role changes made since the request
+            member = member.guild.get_member(member.id) or member
+            if (role in member.roles) == present:
+                self.skipped += 1
+                done = True
+                return
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    if present:
+                        await member.add_roles(role)
+                    else:
+                        await member.remove_roles(role)
+                    self.applied += 1
+                    done = True
+                    return
+                except discord.NotFound as exc:
+                    error = exc  # The member has left or the role was deleted
+                    return
+                except discord.HTTPException as exc:
+                    if (exc.status < 500 and exc.status != 429) or attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        except discord.HTTPException as exc:
+            error = exc
+            self.failed += 1
+            logger.warning('Could not %s role %d for member %d', 'add' if present else 'remove', role.id,
+                           member.id, exc_info=True)
+        finally:
+            if on_done is not None:
+                on_done(done, error)
+            self._in_flight.discard(key)
+            self._semaphore.release()
+            if self._desired:
+                self._wakeup.set()  # Requests for a key that was in flight
+            elif not self._in_flight:
+                self._idle.set()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            'pending': self.pending,
+            'requested': self.requested,
+            'coalesced': self.coalesced,
+            'applied': self.applied,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
@@ -0,0 +1,176 @@
+"""Incrementally maintained per-minute, per-hour and per-day counting stats"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+from database import Database
+from pipeline import CountResult, Outcome
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+MINUTE: int = 60
+HOUR: int = 3600
+DAY: int = 86400
+RESOLUTIONS: tuple[int, ...] = (MINUTE, HOUR, DAY)
+# How long the buckets of each resolution are kept; day buckets are kept forever
+RETENTION: dict[int, int] = {MINUTE: 2 * DAY, HOUR: 90 * DAY}
+
+Bucket = list[int]  # [correct, breaks]
+
+
+@dataclass
+class _Streak:
+    """How a member's streak changed since the last flush"""
+    first: int = 0  # Correct counts before the first break, which extend the stored streak
+    best: int = 0  # The longest streak that started and ended since the last flush
+    run: int = 0  # Correct counts since the last break
+    broken: bool = False
+
+
+def resolution_for(seconds: int) -> int:
+    """The finest resolution that answers a window of `seconds` in at most a few hundred buckets"""
+    if seconds <= 3 * HOUR:
+        return MINUTE
+    if seconds <= 8 * DAY:
+        return HOUR
+    return DAY
+
+
+class Rollups:
+    """
+    Keeps counts of correct counts and chain breaks in time buckets, per guild and per member,
+    and the longest streak of correct counts of every member.
+
+    Recording a result only updates a few counters in memory. Every `flush_interval` seconds the
+    buckets that changed are added to the `guild_rollups` and `member_rollups` tables with one
+    upsert per bucket, at every resolution at once, so any window is answered by a range read of
+    at most a few hundred rows of the primary key. Old minute and hour buckets are deleted.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 10.0, prune_interval: float = 3600.0) -> None:
+        self._db: Database = db
+        self.flush_interval: float = flush_interval
+        self.prune_interval: float = prune_interval
+        self._guild_buckets: defaultdict[tuple[int, int, int], Bucket] = defaultdict(lambda: [0, 0])
+        self._member_buckets: defaultdict[tuple[int, int, int, int], Bucket] = defaultdict(lambda: [0, 0])
+        self._streaks: defaultdict[tuple[int, int], _Streak] = defaultdict(_Streak)
+        self._last_prune: float = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._flusher = asyncio.create_task(self._flush_loop(), name='rollups-flusher')
+
+    async def close(self) -> None:
+        """Stop the periodic flush and queue everything that is still buffered."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def record_result(self, result: CountResult) -> None:
+        """Count a message whose outcome has been decided by the pipeline. Never awaits."""
+        if result.outcome is not Outcome.CORRECT and not result.outcome.is_failure:
+            return
+        guild_id: int = result.message.guild.id
+        member_id: int = result.message.author.id
+        timestamp: int = int(result.message.created_at.timestamp())
+        column: int = 0 if result.outcome is Outcome.CORRECT else 1
+        for resolution in RESOLUTIONS:
+            bucket: int = timestamp - timestamp % resolution
+            self._guild_buckets[guild_id, resolution, bucket][column] += 1
+            self._member_buckets[guild_id, resolution, bucket, member_id][column] += 1
+
+        streak: _Streak = self._streaks[guild_id, member_id]
+        if column == 0:
+            streak.run += 1
+            if not streak.broken:
+                streak.first = streak.run
+        else:
+            if streak.broken:
+                streak.best = max(streak.best, streak.run)
+            streak.broken = True
+            streak.run = 0
+
+    def flush(self) -> None:
+        """Queue the upserts of every bucket and streak that changed."""
+        if self._guild_buckets:
+            self._db.write_many('''INSERT INTO guild_rollups VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(guild_id, resolution, bucket) DO UPDATE SET correct = correct + excluded.correct,
+breaks = breaks + excluded.breaks''',
+                                [(*key, *counts) for key, counts in self._guild_buckets.items()])
+            self._db.write_many('''INSERT INTO member_rollups VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(guild_id, resolution, bucket, member_id) DO UPDATE SET correct = correct + excluded.correct,
+breaks = breaks + excluded.breaks''',
+                                [(*key, *counts) for key, counts in self._member_buckets.items()])
+            logger.debug('Flushed %d guild and %d member bucket(s)', len(self._guild_buckets),
+                         len(self._member_buckets))
+            self._guild_buckets.clear()
+            self._member_buckets.clear()
+        if self._streaks:
+            # The stored streak goes on with `first` unless it was broken since, then it is `run`
+            self._db.write_many('''INSERT INTO member_streaks VALUES (:guild_id, :member_id, :run, :best)
+ON CONFLICT(guild_id, member_id) DO UPDATE SET current = CASE WHEN :broken THEN :run ELSE current + :run END,
+best = MAX(best, current + :first, :best)''', [
+                {'guild_id': guild_id, 'member_id': member_id, 'run': streak.run, 'first': streak.first,
+                 'best': max(streak.best, streak.first, streak.run), 'broken': streak.broken}
+                for (guild_id, member_id), streak in self._streaks.items()])
+            self._streaks.clear()
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self._last_prune = time.monotonic()
+            now: int = int(time.time())
+            for resolution, retention in RETENTION.items():
+                self._db.write('DELETE FROM guild_rollups WHERE resolution = ? AND bucket < ?',
+                               (resolution, now - retention))
+                self._db.write('DELETE FROM member_rollups WHERE resolution = ? AND bucket < ?',
+                               (resolution, now - retention))
+
+    async def sync(self) -> None:
+        """Make everything recorded so far visible to queries."""
+        self.flush()
+        await self._db.flush()
+
+    # -----------
+    # Queries
+    # -----------
+    async def series(self, guild_id: int, since: int, resolution: int) -> list[tuple[int, int, int]]:
+        """`(bucket, correct, breaks)` of a guild's buckets from `since` on, oldest first, without the empty ones"""
+        return await self._db.fetchall(
+            'SELECT bucket, correct, breaks FROM guild_rollups WHERE guild_id = ? AND resolution = ? AND bucket >= ? '
+            'ORDER BY bucket', (guild_id, resolution, since - since % resolution))
+
+    async def top_members(self, guild_id: int, since: int, resolution: int,
+                          limit: int = 5) -> list[tuple[int, int, int]]:
+        """`(member_id, correct, breaks)` of the members with the most correct counts from `since` on"""
+        return await self._db.fetchall(
+            'SELECT member_id, SUM(correct), SUM(breaks) FROM member_rollups '
+            'WHERE guild_id = ? AND resolution = ? AND bucket >= ? GROUP BY member_id ORDER BY 2 DESC LIMIT ?',
+            (guild_id, resolution, since - since % resolution, limit))
+
+    async def top_streaks(self, guild_id: int, limit: int = 5) -> list[tuple[int, int, int]]:
+        """`(member_id, best, current)` of the members with the longest streaks of correct counts"""
+        return await self._db.fetchall(
+            'SELECT member_id, best, current FROM member_streaks WHERE guild_id = ? ORDER BY best DESC LIMIT ?',
+            (guild_id, limit))
+
+
+SPARK_LEVELS: str = '▁▂▃▄▅▆▇█'
+
+
+def sparkline(series: list[tuple[int, int, int]], since: int, until: int, width: int = 24) -> str:
+    """The correct counts of `series` from `since` to `until`, summed into `width` columns of block characters"""
+    columns: list[int] = [0] * width
+    span: float = max(1, until - since) / width
+    for bucket, correct, _ in series:
+        columns[min(width - 1, max(0, int((bucket - since) / span)))] += correct
+    peak: int = max(columns)
+    if not peak:
+        return SPARK_LEVELS[0] * width
+    return ''.join(SPARK_LEVELS[round(value / peak * (len(SPARK_LEVELS) - 1))] for value in columns)
@@ -0,0 +1,110 @@
+import asyncio
+import sqlite3
+
+from config import ConfigStore
+from database import SCHEMA_VERSION, Database
+from journal import CountJournal
+
+
+async def open_store(tmp_path, journal=True):
+    db = Database(str(tmp_path / 'db.sqlite3'))
+    await db.start()
+    store = ConfigStore(db, legacy_path=str(tmp_path / 'config.json'),
+                        journal=CountJournal(str(tmp_path / 'journal')) if journal else None)
+    await store.load()
+    return db, store
+
+
+async def close_store(db, store, flush=True):
+    if flush:
+        await store.flush()
+    await store.journal.close()
+    await db.close()
+
+
+def test_every_channel_of_a_guild_has_its_own_count(tmp_path):
+    async def scenario():
+        db, store = await open_store(tmp_path)
+        store.update(1, failed_role_id=5)  # Before the guild counts anywhere
+        first = store.add_channel(1, 10)
+        second = store.add_channel(1, 20)
+        first.increment(100)
+        store.record_transition(first)
+        for member_id in (100, 101):
+            second.increment(member_id)
+            store.record_transition(second)
+        await close_store(db, store)
+
+        db, store = await open_store(tmp_path)
+        counts = {config.channel_id: (config.current_count, config.failed_role_id)
+                  for config in store.for_guild(1)}
+        await close_store(db, store)
+        return first.failed_role_id, second.failed_role_id, counts
+
+    assert asyncio.run(scenario()) == (5, 5, {10: (1, 5), 20: (2, 5)})
+
+
+def test_counts_are_replayed_into_their_own_channel(tmp_path):
+    async def scenario():
+        db, store = await open_store(tmp_path)
+        first = store.add_channel(1, 10)
+        second = store.add_channel(1, 20)
+        await store.flush()
+        second.increment(100)
+        await store.synced(store.record_transition(second))
+        await close_store(db, store, flush=False)  # As if the bot crashed before the next snapshot
+
+        db, store = await open_store(tmp_path)
+        counts = {config.channel_id: config.current_count for config in store.for_guild(1)}
+        await close_store(db, store)
+        return first.current_count, counts
+
+    assert asyncio.run(scenario()) == (0, {10: 0, 20: 1})
+
+
+def test_removing_the_last_channel_keeps_the_settings_of_the_guild(tmp_path):
+    async def scenario():
+        db, store = await open_store(tmp_path)
+        store.add_channel(1, 10)
+        store.add_channel(1, 20)
+        store.update(1, reliable_counter_role_id=7)
+        await store.flush()
+        store.remove_channel(10)
+        store.remove_channel(20)
+        await close_store(db, store)
+
+        db, store = await open_store(tmp_path)
+        configs = [(config.channel_id, config.reliable_counter_role_id) for config in store.for_guild(1)]
+        channel = store.for_channel(20)
+        await close_store(db, store)
+        return configs, channel
+
+    assert asyncio.run(scenario()) == ([(None, 7)], None)
+
+
+def test_upgrade_keeps_the_counting_channel_of_every_guild(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    conn = sqlite3.connect(path)
+    # The schema of version 7, with one counting channel per guild
+    conn.execute('CREATE TABLE members (guild_id INTEGER, member_id INTEGER, score INTEGER, correct INTEGER, '
+                 'wrong INTEGER, highest_valid_count INTEGER, PRIMARY KEY (guild_id, member_id))')
+    conn.execute('''CREATE TABLE guild_configs (guild_id INTEGER PRIMARY KEY, channel_id INTEGER,
+                    current_count INTEGER, high_score INTEGER, current_member_id INTEGER,
+                    put_high_score_emoji INTEGER, failed_role_id INTEGER, reliable_counter_role_id INTEGER,
+                    failed_member_id INTEGER, correct_inputs_by_failed_member INTEGER, last_message_id INTEGER)''')
+    conn.execute('CREATE INDEX idx_guild_configs_channel ON guild_configs(channel_id)')
+    conn.execute('INSERT INTO guild_configs VALUES (1, 10, 42, 50, 100, 0, 5, NULL, NULL, 0, 999)')
+    conn.execute('PRAGMA user_version = 7')
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        db, store = await open_store(tmp_path, journal=False)
+        config = store.for_channel(10)
+        added = store.add_channel(1, 20)
+        await store.flush()
+        version = await db.fetchone('PRAGMA user_version')
+        await db.close()
+        return config.current_count, config.last_message_id, added.failed_role_id, version
+
+    assert asyncio.run(scenario()) == (42, 999, 5, (SCHEMA_VERSION,))
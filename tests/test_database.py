@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from database import SCHEMA_VERSION, Database
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_failed_write_only_drops_itself(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'db.sqlite3'))
+        await db.start()
+        db.write('INSERT INTO meta VALUES (?, ?)', ('a', '1'))
+        db.write('INSERT INTO no_such_table VALUES (1)')
+        db.write_many('INSERT INTO meta VALUES (?, ?)', [('b', '2'), ('c', '3')])
+        committed = db.write_atomic([('INSERT INTO meta VALUES (?, ?)', ('d', '4'))])
+        failed = db.write_atomic([('INSERT INTO meta VALUES (?, ?)', ('a', 'duplicate'))])
+        await db.flush()
+        assert await committed is None
+        with pytest.raises(sqlite3.IntegrityError):
+            await failed
+        rows = await db.fetchall('SELECT key, value FROM meta ORDER BY key')
+        await db.close()
+        return rows
+
+    assert run(scenario()) == [('a', '1'), ('b', '2'), ('c', '3'), ('d', '4')]
+
+
+def test_write_that_sqlite_cannot_bind_does_not_stop_the_writer(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'db.sqlite3'))
+        await db.start()
+        failed = db.write_atomic([('INSERT INTO meta VALUES (?, ?)', ('big', 2 ** 63))])
+        db.write('INSERT INTO meta VALUES (?, ?)', ('a', '1'))
+        with pytest.raises(OverflowError):
+            await failed
+        committed = db.write_atomic([('INSERT INTO meta VALUES (?, ?)', ('b', '2'))])
+        await asyncio.wait_for(db.flush(), 5)
+        assert await committed is None
+        rows = await db.fetchall('SELECT key, value FROM meta ORDER BY key')
+        await db.close()
+        return rows
+
+    assert run(scenario()) == [('a', '1'), ('b', '2')]
+
+
+def test_upgrades_a_baseline_database(tmp_path):
+    path = str(tmp_path / 'db.sqlite3')
+    conn = sqlite3.connect(path)
+    # The schema before versioning, with one member
+    conn.execute('''CREATE TABLE members (member_id INTEGER PRIMARY KEY, score INTEGER, correct INTEGER,
+                    wrong INTEGER, highest_valid_count INTEGER)''')
+    conn.execute('INSERT INTO members VALUES (7, 5, 6, 1, 6)')
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        db = Database(path)
+        await db.start()
+        members = await db.fetchall('SELECT * FROM members')
+        version = await db.fetchone('PRAGMA user_version')
+        configs = await db.fetchall('SELECT last_message_id FROM guild_configs')
+        rollups = await db.fetchall('SELECT * FROM guild_rollups')
+        await db.close()
+        return members, version, configs, rollups
+
+    members, version, configs, rollups = run(scenario())
+    assert members == [(0, 7, 5, 6, 1, 6)]
+    assert version == (SCHEMA_VERSION,)
+    assert configs == [] and rollups == []
@@ -0,0 +1,14 @@
+import pytest
+
+from evaluator import MAX_MAGNITUDE, ExpressionTooComplex, evaluate
+
+
+@pytest.mark.parametrize('expression', [str(MAX_MAGNITUDE), f'({MAX_MAGNITUDE})'])
+def test_the_largest_number_is_allowed(expression):
+    assert evaluate(expression) == MAX_MAGNITUDE
+
+
+@pytest.mark.parametrize('expression', [str(MAX_MAGNITUDE + 1), f'({MAX_MAGNITUDE + 1})', '9' * 101, '1' * 102])
+def test_plain_numbers_and_expressions_have_the_same_limit(expression):
+    with pytest.raises(ExpressionTooComplex):
+        evaluate(expression)
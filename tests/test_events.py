@@ -0,0 +1,26 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from database import Database
+from events import EventKind, EventLog
+from pipeline import CountResult, Outcome
+
+
+def test_counts_are_logged_at_the_time_of_their_message(tmp_path):
+    posted = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    message = SimpleNamespace(id=30, guild=SimpleNamespace(id=1), channel=SimpleNamespace(id=2),
+                              author=SimpleNamespace(id=4), created_at=posted)
+
+    async def scenario():
+        db = Database(str(tmp_path / 'db.sqlite3'))
+        await db.start()
+        event_log = EventLog(db)
+        event_log.record_result(CountResult(message, Outcome.CORRECT, number=5, expected=5))
+        event_log.flush()
+        await db.flush()
+        rows = await db.fetchall('SELECT kind, number, created_at FROM count_events')
+        await db.close()
+        return rows
+
+    assert asyncio.run(scenario()) == [(EventKind.CORRECT, 5, int(posted.timestamp()))]
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+from database import Database
+from leaderboard import Leaderboards
+from member_resolver import MemberResolver
+from member_stats import MemberStatsCache
+
+
+class StubGuild:
+    id = 1
+
+    def get_member(self, member_id):
+        return SimpleNamespace(id=member_id, mention=f'<@{member_id}>')
+
+
+def test_a_new_member_below_the_last_page_shows_up(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'db.sqlite3'))
+        await db.start()
+        member_stats = MemberStatsCache(db)
+        leaderboards = Leaderboards(db, member_stats, MemberResolver())
+        guild = StubGuild()
+        for member_id, score in ((1, 10), (2, 5), (3, 2)):
+            stats = await member_stats.get_or_create(guild.id, member_id)
+            stats.score = score
+            member_stats.record_correct(stats, 1)  # Marks the member dirty
+        _, before = await leaderboards.page(guild, 'score', 0)
+
+        newcomer = await member_stats.get_or_create(guild.id, 4)
+        member_stats.record_correct(newcomer, 1)
+        leaderboards.member_changed(newcomer)
+        _, after = await leaderboards.page(guild, 'score', 0)
+        await db.close()
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before.member_ids == {1, 2, 3} and not before.has_next
+    assert after.member_ids == {1, 2, 3, 4}
+    assert after.description.splitlines()[-1] == '4. <@4> **1**'
@@ -0,0 +1,51 @@
+import asyncio
+
+from database import Database
+from member_stats import MemberStatsCache
+
+
+def test_members_are_not_evicted_before_their_flush_commits(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'db.sqlite3'))
+        await db.start()
+        cache = MemberStatsCache(db, max_members=1)
+        stats = await cache.get_or_create(1, 1)
+        for number in range(1, 6):
+            cache.record_correct(stats, number)
+        cache.flush()
+        cached = await cache.get(1, 1)  # Before the upsert is committed
+        other = await cache.get_or_create(1, 2)
+        cache.record_correct(other, 1)
+        cache.flush()
+        await db.flush()
+        await asyncio.sleep(0)  # Lets the completion callbacks run
+        reloaded = await cache.get(1, 1)
+        await db.close()
+        return cached, reloaded, cache.size
+
+    cached, reloaded, size = asyncio.run(scenario())
+    assert cached is not None and cached.score == 5
+    assert reloaded is not None and reloaded.score == 5
+    assert size == 1
+
+
+
+def test_the_least_recently_used_committed_members_are_evicted(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / 'db.sqlite3'))
+        await db.start()
+        cache = MemberStatsCache(db, max_members=2)
+        for member_id in (1, 2, 3):
+            await cache.get_or_create(1, member_id)
+        cache.flush()
+        await db.flush()
+        await asyncio.sleep(0)  # Lets the completion callbacks run, which evict member 1
+        cache.record_correct(await cache.get(1, 3), 1)  # Not committed, so never evicted
+        await cache.get(1, 1)  # Loaded again, which evicts member 2
+        after_first = sorted(member_id for (_, member_id) in cache._members)
+        await cache.get(1, 2)  # Evicts member 1 rather than member 3, which was used less recently
+        after_second = sorted(member_id for (_, member_id) in cache._members)
+        await db.close()
+        return after_first, after_second
+
+    assert asyncio.run(scenario()) == ([1, 3], [2, 3])
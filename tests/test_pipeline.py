@@ -0,0 +1,61 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+from config import Config
+from pipeline import CountPipeline, Outcome
+
+MESSAGES = 200
+LATENCY = 0.01  # Maximum simulated side effect latency, in seconds
+
+
+def make_message(message_id, author_id, content):
+    return SimpleNamespace(id=message_id, content=content, author=SimpleNamespace(id=author_id))
+
+
+def burst(messages):
+    """Submits every message in a task of its own, like discord.py dispatches gateway events, with slow side effects"""
+    async def scenario():
+        config = Config()
+        handled = []
+
+        async def handler(result):
+            await asyncio.sleep(random.uniform(0, LATENCY))  # Simulated Discord HTTP round trip
+            handled.append(result)
+
+        pipeline = CountPipeline(handler)
+
+        async def deliver(message):
+            pipeline.submit(config, message)
+
+        await asyncio.gather(*(deliver(message) for message in messages))
+        await pipeline.close()
+        return config, sorted(handled, key=lambda result: result.message.id)
+
+    return asyncio.run(scenario())
+
+
+def outcomes(results):
+    return [result.outcome for result in results]
+
+
+def test_a_clean_stream_counts_every_number():
+    config, handled = burst([make_message(i, i % 7, str(i)) for i in range(1, MESSAGES + 1)])
+    assert config.current_count == MESSAGES
+    assert outcomes(handled) == [Outcome.CORRECT] * MESSAGES
+    assert [result.number for result in handled] == list(range(1, MESSAGES + 1))
+
+
+def test_only_the_first_of_racing_duplicates_is_credited():
+    # Everyone posts the same number: the next one breaks the chain, after which it is correct again
+    _, handled = burst([make_message(i, i, '1') for i in range(MESSAGES)])
+    assert outcomes(handled) == [Outcome.CORRECT, Outcome.WRONG_NUMBER] * (MESSAGES // 2)
+
+
+def test_expressions_double_counts_and_wrong_numbers():
+    contents = [(1, '1'), (2, '1+1'), (3, '3'), (3, '4'), (1, '1'), (2, '2*1'), (1, '7')]
+    config, handled = burst([make_message(i, author, content) for i, (author, content) in enumerate(contents)])
+    assert outcomes(handled) == [Outcome.CORRECT, Outcome.CORRECT, Outcome.CORRECT, Outcome.WRONG_MEMBER,
+                                 Outcome.CORRECT, Outcome.CORRECT, Outcome.WRONG_NUMBER]
+    assert config.current_count == 0
+    assert config.high_score == 3
@@ -0,0 +1,35 @@
+from member_stats import MemberStats
+from reliable_role import ReliableRoleTracker
+
+RELIABLE = MemberStats(1, 10, score=200, correct=200)
+UNRELIABLE = MemberStats(1, 10, score=0, correct=100, wrong=100)
+
+
+def test_changes_observed_before_the_holders_are_known_are_kept():
+    tracker = ReliableRoleTracker()
+    tracker.observe(UNRELIABLE)  # Member 10 holds the role, but the tracker does not know that yet
+    tracker.reset([10])
+    assert tracker.take_transitions() == {10: False}
+
+
+def test_a_refused_change_is_not_queued_again():
+    tracker = ReliableRoleTracker()
+    tracker.reset([])
+    tracker.observe(RELIABLE)
+    assert tracker.take_transitions() == {10: True}
+    tracker.change_refused(10, True)
+    tracker.observe(RELIABLE)
+    assert tracker.take_transitions() == {}
+
+    tracker.reset([])  # E.g. the role has been set again
+    tracker.observe(RELIABLE)
+    assert tracker.take_transitions() == {10: True}
+
+
+def test_a_failed_change_is_queued_again():
+    tracker = ReliableRoleTracker()
+    tracker.reset([])
+    tracker.observe(RELIABLE)
+    tracker.take_transitions()
+    tracker.change_failed(10, True)
+    assert tracker.take_transitions() == {10: True}
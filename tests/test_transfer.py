@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from database import Database
+from transfer import export_table, import_table
+
+EVENTS = [(1, 10, 100 + i, 7, 1, i + 1, i + 1, 1_700_000_000 + i) for i in range(5)]
+
+
+async def open_db(path):
+    db = Database(str(path))
+    await db.start()
+    return db
+
+
+def test_imported_events_get_new_ids_and_duplicates_are_skipped(tmp_path):
+    async def scenario():
+        source = await open_db(tmp_path / 'source.sqlite3')
+        source.write_many('INSERT INTO count_events (guild_id, channel_id, message_id, member_id, kind, number, '
+                          'expected, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', EVENTS)
+        await source.flush()
+        await export_table(source, 'count_events', str(tmp_path / 'events.ndjson'))
+        await source.close()
+
+        target = await open_db(tmp_path / 'target.sqlite3')
+        # Other history, with the same IDs as the exported events
+        target.write_many('INSERT INTO count_events (guild_id, channel_id, message_id, member_id, kind, number, '
+                          'expected, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          [(2, 20, 200 + i, 8, 1, i + 1, i + 1, 1_700_000_000 + i) for i in range(5)])
+        await target.flush()
+        first = await import_table(target, 'count_events', str(tmp_path / 'events.ndjson'))
+        second = await import_table(target, 'count_events', str(tmp_path / 'events.ndjson'))
+        total = await target.fetchone('SELECT COUNT(*) FROM count_events')
+        await target.close()
+        return first, second, total
+
+    first, second, total = asyncio.run(scenario())
+    assert first == (5, 5)
+    assert second == (5, 0)
+    assert total == (10,)
+
+
+@pytest.mark.parametrize('line, error', [
+    ('[1, 2, 3]', 'Line 2: not an object'),
+    ('{"guild_id": 1, "member_id": 2, "score": 1.7, "correct": 1, "wrong": 0, "highest_valid_count": 1}',
+     'Line 2: not a whole number'),
+    ('{"guild_id": 1, "member_id": 2, "score": true, "correct": 1, "wrong": 0, "highest_valid_count": 1}',
+     'Line 2: not a whole number'),
+    ('{"guild_id": 1, "member_id": 2, "score": "1.7", "correct": 1, "wrong": 0, "highest_valid_count": 1}',
+     'Line 2: not a whole number'),
+    ('{"guild_id": 1, "member_id": 2}', "Line 2: missing column 'score'"),
+    ('{"guild_id": 1,', 'Line 2: not valid JSON'),
+])
+def test_invalid_ndjson_lines_are_rejected_with_their_line_number(tmp_path, line, error):
+    valid = '{"guild_id": 1, "member_id": 1, "score": 3, "correct": 3, "wrong": 0, "highest_valid_count": 3}'
+    path = tmp_path / 'members.ndjson'
+    path.write_text(f'{valid}\n{line}\n', encoding='utf-8')
+
+    async def scenario():
+        db = await open_db(tmp_path / 'db.sqlite3')
+        try:
+            with pytest.raises(ValueError) as exc_info:
+                await import_table(db, 'members', str(path))
+            return str(exc_info.value), await db.fetchall('SELECT * FROM members')
+        finally:
+            await db.close()
+
+    message, rows = asyncio.run(scenario())
+    assert message == error
+    assert rows == []  # Nothing is imported
+
+
+def test_csv_values_must_be_whole_numbers(tmp_path):
+    path = tmp_path / 'members.csv'
+    path.write_text('guild_id,member_id,score,correct,wrong,highest_valid_count\n1,1,3,3,0,3\n1,2,1.5,1,0,1\n',
+                    encoding='utf-8')
+
+    async def scenario():
+        db = await open_db(tmp_path / 'db.sqlite3')
+        try:
+            with pytest.raises(ValueError, match='Line 3: not a whole number'):
+                await import_table(db, 'members', str(path))
+        finally:
+            await db.close()
+
+    asyncio.run(scenario())
+
+
+def test_malformed_csv_is_rejected_with_its_line_number(tmp_path):
+    path = tmp_path / 'members.csv'
+    path.write_text('guild_id,member_id,score,correct,wrong,highest_valid_count\n1,1,3,3,0,3\n1,2,"' + 'x' * 200_000
+                    + '",1,0,1\n', encoding='utf-8')
+
+    async def scenario():
+        db = await open_db(tmp_path / 'db.sqlite3')
+        try:
+            with pytest.raises(ValueError, match='Line 3: field larger than field limit'):
+                await import_table(db, 'members', str(path))
+            return await db.fetchall('SELECT * FROM members')
+        finally:
+            await db.close()
+
+    assert asyncio.run(scenario()) == []
@@ -0,0 +1,165 @@
+"""Streaming export and import of member stats and count history, as CSV or NDJSON"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import sqlite3
+from functools import partial
+from itertools import islice
+from typing import Any, Iterator, Optional, TextIO
+
+from database import Database
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# The columns of each table that can be exported, in order
+TABLES: dict[str, tuple[str, ...]] = {
+    'members': ('guild_id', 'member_id', 'score', 'correct', 'wrong', 'highest_valid_count'),
+    'count_events': ('id', 'guild_id', 'channel_id', 'message_id', 'member_id', 'kind', 'number', 'expected',
+                     'created_at'),
+}
+# The columns of each table that are imported: events get a new ID, as theirs may be taken
+IMPORT_COLUMNS: dict[str, tuple[str, ...]] = {table: tuple(column for column in columns if column != 'id')
+                                              for table, columns in TABLES.items()}
+# Imported members replace the stats they conflict with. An event is skipped if the same event of the
+# same message is already there, so importing a file twice does not duplicate it. The check is a lookup
+# in `idx_count_events_channel`.
+IMPORT_SQL: dict[str, str] = {
+    'members': '''INSERT INTO members VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(guild_id, member_id) DO UPDATE SET
+score = excluded.score, correct = excluded.correct, wrong = excluded.wrong,
+highest_valid_count = excluded.highest_valid_count''',
+    'count_events': '''INSERT INTO count_events (guild_id, channel_id, message_id, member_id, kind, number, expected,
+created_at) SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8 WHERE NOT EXISTS (SELECT 1 FROM count_events
+WHERE channel_id = ?2 AND message_id = ?3 AND kind = ?5 AND created_at IS ?8)''',
+}
+FORMATS: tuple[str, ...] = ('csv', 'ndjson')
+CHUNK_SIZE: int = 1000
+INT64_MAX: int = 2 ** 63 - 1
+
+
+def format_of(path: str) -> str:
+    """The format of a file, from its extension: CSV for `.csv`, NDJSON otherwise"""
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+async def export_table(db: Database, table: str, path: str, fmt: Optional[str] = None,
+                       guild_id: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Write the rows of `table` (only those of `guild_id`, if given) to `path`, and return how many were written.
+
+    Rows are read `chunk_size` at a time and formatted and written in a worker thread, so memory use
+    does not depend on the size of the table and the event loop is never blocked. Other reads run
+    between chunks. The file only appears at `path` once it is complete.
+    """
+    columns: tuple[str, ...] = TABLES[table]
+    fmt = fmt or format_of(path)
+    sql: str = f'SELECT {", ".join(columns)} FROM {table}'
+    params: tuple = ()
+    if guild_id is not None:
+        sql += ' WHERE guild_id = ?'
+        params = (guild_id,)
+    sql += ' ORDER BY guild_id, member_id' if table == 'members' else ' ORDER BY id'
+
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    temporary: str = f'{path}.partial'
+    file: TextIO = await loop.run_in_executor(None, partial(open, temporary, 'w', encoding='utf-8', newline=''))
+    written: int = 0
+    try:
+        if fmt == 'csv':
+            await loop.run_in_executor(None, csv.writer(file).writerow, columns)
+        async for rows in db.stream(sql, params, chunk_size=chunk_size):
+            await loop.run_in_executor(None, _write_chunk, file, fmt, columns, rows)
+            written += len(rows)
+        await loop.run_in_executor(None, file.close)
+        os.replace(temporary, path)
+    except BaseException:
+        file.close()
+        os.remove(temporary)
+        raise
+    logger.info('Exported %d row(s) of %s to %s', written, table, path)
+    return written
+
+
+def _write_chunk(file: TextIO, fmt: str, columns: tuple[str, ...], rows: list[tuple]) -> None:
+    if fmt == 'csv':
+        csv.writer(file).writerows(rows)
+    else:
+        file.writelines(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n' for row in rows)
+
+
+async def import_table(db: Database, table: str, path: str, fmt: Optional[str] = None,
+                       guild_id: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> tuple[int, int]:
+    """
+    Read rows of `table` from `path` and insert them, all in one transaction, `chunk_size` at a time.
+    If `guild_id` is given, every row is assigned to that guild. Returns the number of rows read and
+    the number of rows inserted or updated: events that are already there are skipped.
+
+    Runs on the database writer thread: the event loop is not blocked, and the writes queued
+    meanwhile are committed after the import. Raises `ValueError` if the file does not match the table;
+    nothing is imported then.
+    """
+    count, changed = await db.run_in_transaction(
+        partial(_import, table, path, fmt or format_of(path), guild_id, chunk_size))
+    logger.info('Imported %d of %d row(s) of %s from %s', changed, count, table, path)
+    return count, changed
+
+
+def _import(table: str, path: str, fmt: str, guild_id: Optional[int], chunk_size: int,
+            conn: sqlite3.Connection) -> tuple[int, int]:
+    columns: tuple[str, ...] = IMPORT_COLUMNS[table]
+    count: int = 0
+    changes: int = conn.total_changes
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        # Each record with its line number, for error messages
+        records: Iterator[tuple[int, Any]]
+        if fmt == 'csv':
+            records = _csv_records(file)
+        else:
+            records = ((line, _parse(text, line)) for line, text in enumerate(file, 1) if text.strip())
+        rows: Iterator[tuple] = (_row(columns, record, guild_id, line) for line, record in records)
+        while chunk := list(islice(rows, chunk_size)):
+            conn.executemany(IMPORT_SQL[table], chunk)
+            count += len(chunk)
+    return count, conn.total_changes - changes
+
+
+def _csv_records(file: TextIO) -> Iterator[tuple[int, dict[str, str]]]:
+    reader: csv.DictReader = csv.DictReader(file)
+    try:
+        for record in reader:
+            yield reader.line_num, record
+    except csv.Error as exc:
+        raise ValueError(f'Line {reader.line_num + 1}: {exc}') from None
+
+
+def _parse(text: str, line: int) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        raise ValueError(f'Line {line}: not valid JSON') from None
+
+
+def _row(columns: tuple[str, ...], record: Any, guild_id: Optional[int], line: int) -> tuple:
+    if not isinstance(record, dict):
+        raise ValueError(f'Line {line}: not an object')
+    try:
+        values: list[Any] = [_value(record[column]) for column in columns]
+    except KeyError as exc:
+        raise ValueError(f'Line {line}: missing column {exc}') from None
+    except ValueError:
+        raise ValueError(f'Line {line}: not a whole number') from None
+    if guild_id is not None:
+        values[columns.index('guild_id')] = guild_id
+    return tuple(values)
+
+
+def _value(value: Any) -> Any:
+    """A whole number, from an integer or its text. Raises `ValueError` for anything else, e.g. 1.7 or true."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    number: int = int(value)
+    # Numbers too large for an SQLite integer are kept as text, like `events.EventLog` does
+    return number if -INT64_MAX <= number <= INT64_MAX else str(number)